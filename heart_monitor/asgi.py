@@ -2,6 +2,12 @@
 ASGI config for heart_monitor project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Serve the project through it (e.g. ``uvicorn heart_monitor.asgi:application``)
+to use the live heart rate stream at /api/heart-rates/stream/, which keeps a
+connection open per client without holding a worker thread.
+
+Requests are routed with ASGI_URLCONF, which serves the patient endpoints and the
+heart rate history/ingest endpoint with native async views (patient.async_views).
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
@@ -9,8 +15,20 @@ https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'heart_monitor.settings')
 
-application = get_asgi_application()
+
+class AsyncViewsASGIHandler(ASGIHandler):
+    """ASGIHandler that resolves every request against ASGI_URLCONF instead of ROOT_URLCONF."""
+    async def get_response_async(self, request):
+        request.urlconf = getattr(settings, 'ASGI_URLCONF', settings.ROOT_URLCONF)
+        return await super().get_response_async(request)
+
+
+# What get_asgi_application() does, with the handler above
+django.setup(set_prefix=False)
+application = AsyncViewsASGIHandler()
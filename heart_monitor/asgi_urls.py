@@ -0,0 +1,12 @@
+"""
+URL configuration of the ASGI application (ASGI_URLCONF): the same URLs as heart_monitor.urls, with
+the patient, heart rate history and export endpoints answered by the native async views in patient.async_views,
+plus the live heart rate stream, which is not routed under WSGI.
+"""
+from django.urls import path, include
+from .urls import urlpatterns as sync_urlpatterns
+
+urlpatterns = [
+    # Matched before the DRF routes of the same paths
+    path('api/', include('patient.async_urls')),
+] + sync_urlpatterns
@@ -0,0 +1,132 @@
+"""
+Process-local request metrics, exposed in the Prometheus text format at /metrics.
+Each worker process keeps its own numbers, so scrape every process when running several.
+"""
+import threading
+from bisect import bisect_left
+from django.conf import settings
+from django.http import Http404, HttpResponse
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labelnames):
+        self.name, self.help_text, self.labelnames = name, help_text, labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            yield f'{self.name}{_labels(self.labelnames, labels)} {value}'
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labelnames, buckets):
+        self.name, self.help_text, self.labelnames, self.buckets = name, help_text, labelnames, buckets
+        self._values = {}  # labels -> [count per bucket (+Inf last), sum]
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                counts = self._values[labels] = [[0] * (len(self.buckets) + 1), 0]
+            counts[0][bisect_left(self.buckets, value)] += 1
+            counts[1] += value
+
+    def samples(self):
+        with self._lock:
+            values = {labels: (list(counts), total) for labels, (counts, total) in self._values.items()}
+        for labels, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                yield f'{self.name}_bucket{_labels(self.labelnames, labels, [("le", bound)])} {cumulative}'
+            yield f'{self.name}_sum{_labels(self.labelnames, labels)} {total}'
+            yield f'{self.name}_count{_labels(self.labelnames, labels)} {cumulative}'
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name, help_text, labelnames=()):
+        metric = Counter(name, help_text, labelnames)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, help_text, labelnames, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.help_text}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+# Recorded for every request
+REQUESTS = REGISTRY.counter(
+    'http_requests_total', 'Requests handled, by route name, method and status code.', ('route', 'method', 'status'),
+)
+LATENCY = REGISTRY.histogram(
+    'http_request_duration_seconds', 'Time from the request entering the middleware stack to the response leaving it.',
+    ('route', 'method'),
+)
+RESPONSE_SIZE = REGISTRY.histogram(
+    'http_response_size_bytes', 'Size of non-streaming response bodies.', ('route',), SIZE_BUCKETS,
+)
+# Recorded for sampled requests only (METRICS_SAMPLE_RATE)
+DB_QUERIES = REGISTRY.histogram(
+    'http_request_db_queries', 'Database queries per sampled request.', ('route',), QUERY_BUCKETS,
+)
+DB_TIME = REGISTRY.histogram(
+    'http_request_db_duration_seconds', 'Time spent in database queries per sampled request.', ('route',),
+)
+SERIALIZE_TIME = REGISTRY.histogram(
+    'http_request_serialize_duration_seconds',
+    'Time spent in DRF serializers (outside the database) and response rendering per sampled request.', ('route',),
+)
+
+
+def route_name(request):
+    """URL name of the route that served a request, used as the label for its measurements."""
+    match = getattr(request, 'resolver_match', None)
+    return match.url_name if match is not None and match.url_name else 'unmatched'
+
+
+def metrics_view(request):
+    """Prometheus scrape endpoint. Only answers callers from METRICS_ALLOWED_IPS (loopback by default)."""
+    if request.META.get('REMOTE_ADDR') not in getattr(settings, 'METRICS_ALLOWED_IPS', ('127.0.0.1', '::1')):
+        raise Http404
+    return HttpResponse(REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
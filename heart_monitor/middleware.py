@@ -0,0 +1,146 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connection
+from rest_framework.response import Response
+from .metrics import DB_QUERIES, DB_TIME, LATENCY, REQUESTS, RESPONSE_SIZE, SERIALIZE_TIME, route_name
+
+# The sample of the request being handled, if it was picked for detailed timing
+current_sample = ContextVar('current_sample', default=None)
+
+
+class Sample:
+    """Detailed timings of one sampled request."""
+    def __init__(self):
+        self.queries = 0
+        self.db = 0.0
+        self.serialize = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        # Database execute wrapper: counts and times every query of the request
+        began = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.db += perf_counter() - began
+
+
+@contextmanager
+def serializing():
+    """
+    Counts the time of the block, less its database time, as serialization of the sampled request.
+    Views wrap their serializers' `.data` and the async views their rendering in it.
+    """
+    sample = current_sample.get()
+    if sample is None:
+        yield
+        return
+    began, db = perf_counter(), sample.db
+    try:
+        yield
+    finally:
+        sample.serialize += perf_counter() - began - (sample.db - db)
+
+
+class TimedSerializationMixin:
+    """
+    list() and retrieve() of DRF's generic views with the serializer's work timed by serializing(),
+    for the views answering them with the stock mixins.
+    """
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        with serializing():
+            data = self.get_serializer(queryset if page is None else page, many=True).data
+        return Response(data) if page is None else self.get_paginated_response(data)
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        with serializing():
+            data = self.get_serializer(instance).data
+        return Response(data)
+
+
+class RequestMetricsMiddleware:
+    """
+    Records latency, status and response size of every request, labelled by URL route name,
+    for the Prometheus endpoint in heart_monitor.metrics.
+    A METRICS_SAMPLE_RATE share of requests also gets database query count and time and
+    serializer/rendering time, and with METRICS_SERVER_TIMING those go out as a `Server-Timing` header.
+    Serialization is timed where views serialize (see serializing()), plus the rendering of DRF responses.
+    Unsampled requests only pay for a timer and a few counter updates.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def start_sample(self):
+        if random.random() < getattr(settings, 'METRICS_SAMPLE_RATE', 0.1):
+            return Sample()
+        return None
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        began = perf_counter()
+        sample = self.start_sample()
+        token = current_sample.set(sample)
+        try:
+            if sample is None:
+                response = self.get_response(request)
+            else:
+                with connection.execute_wrapper(sample):
+                    response = self.get_response(request)
+        finally:
+            current_sample.reset(token)
+        self.record(request, response, perf_counter() - began, sample)
+        return response
+
+    async def __acall__(self, request):
+        began = perf_counter()
+        sample = self.start_sample()
+        # Queries of async views run on other threads' connections, so only their serialization is sampled
+        token = current_sample.set(sample)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_sample.reset(token)
+        self.record(request, response, perf_counter() - began, sample)
+        return response
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered after the view returns; rendering counts as serialization
+        sample = current_sample.get()
+        if sample is not None:
+            began = perf_counter()
+
+            def rendered(response):
+                sample.serialize += perf_counter() - began
+            response.add_post_render_callback(rendered)
+        return response
+
+    def record(self, request, response, elapsed, sample):
+        route = route_name(request)
+        REQUESTS.inc((route, request.method, response.status_code))
+        LATENCY.observe((route, request.method), elapsed)
+        if not response.streaming:
+            RESPONSE_SIZE.observe((route,), len(response.content))
+        if sample is None:
+            return
+
+        DB_QUERIES.observe((route,), sample.queries)
+        DB_TIME.observe((route,), sample.db)
+        SERIALIZE_TIME.observe((route,), sample.serialize)
+        if getattr(settings, 'METRICS_SERVER_TIMING', False):
+            response['Server-Timing'] = (
+                f'db;dur={sample.db * 1000:.2f};desc="{sample.queries} queries", '
+                f'serialize;dur={sample.serialize * 1000:.2f}, total;dur={elapsed * 1000:.2f}'
+            )
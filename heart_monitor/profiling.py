@@ -0,0 +1,150 @@
+"""
+Opt-in request profiling. With PROFILING_SAMPLE_RATE above zero, that share of requests runs under
+cProfile with every SQL query timed; queries slower than PROFILING_SLOW_QUERY_MS are EXPLAINed.
+Each profiled request is written as one JSON file to PROFILING_DIR, which keeps the newest
+PROFILING_MAX_FILES files. `manage.py profile_summary` reports the top offenders.
+"""
+import cProfile
+import json
+import os
+import pstats
+import random
+import time
+from pathlib import Path
+from time import perf_counter
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DatabaseError, connection
+from .metrics import route_name
+
+# Functions kept per profile, by cumulative time
+PROFILE_FUNCTIONS = 40
+
+
+def profile_dir():
+    return Path(getattr(settings, 'PROFILING_DIR', settings.BASE_DIR / 'profiles'))
+
+
+class QueryLog:
+    """Database execute wrapper keeping the SQL, parameters and duration of every query."""
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        began = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append([sql, params, many, (perf_counter() - began) * 1000])
+
+
+def explain(sql, params):
+    """Returns the query plan of a SELECT as text lines, or None when it cannot be explained."""
+    if not sql.lstrip().upper().startswith('SELECT'):
+        return None
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f'{connection.ops.explain_query_prefix()} {sql}', params)
+            return [' '.join(str(column) for column in row) for row in cursor.fetchall()]
+    except DatabaseError:
+        return None
+
+
+def top_functions(profiler):
+    stats = pstats.Stats(profiler)
+    rows = []
+    for (filename, line, name), (_, calls, total, cumulative, _) in stats.stats.items():
+        rows.append({
+            'function': f'{filename}:{line}({name})',
+            'calls': calls,
+            'total_ms': round(total * 1000, 3),
+            'cumulative_ms': round(cumulative * 1000, 3),
+        })
+    rows.sort(key=lambda row: row['cumulative_ms'], reverse=True)
+    return rows[:PROFILE_FUNCTIONS]
+
+
+def write_profile(record):
+    directory = profile_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / f"{time.time_ns()}-{record['route']}.json"
+    partial = path.with_name(path.name + '.partial')
+    partial.write_text(json.dumps(record, default=str))
+    os.replace(partial, path)
+
+    # Rotate: drop the oldest files beyond the limit (names start with the time they were written)
+    files = sorted(entry.name for entry in os.scandir(directory) if entry.name.endswith('.json'))
+    for name in files[:max(0, len(files) - getattr(settings, 'PROFILING_MAX_FILES', 500))]:
+        (directory / name).unlink(missing_ok=True)
+
+
+def read_profiles(directory=None):
+    """Yields the records written by ProfilingMiddleware, oldest first."""
+    directory = Path(directory) if directory else profile_dir()
+    if not directory.is_dir():
+        return
+    for name in sorted(entry.name for entry in os.scandir(directory) if entry.name.endswith('.json')):
+        try:
+            yield json.loads((directory / name).read_text())
+        except (OSError, ValueError):
+            continue  # Rotated away or half written
+
+
+class ProfilingMiddleware:
+    """
+    Profiles a sample of synchronous requests, see the module docstring.
+    Removed from the middleware chain at startup when PROFILING_SAMPLE_RATE is 0, so it costs nothing when off.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'PROFILING_SAMPLE_RATE', 0):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            # cProfile would also pick up every other task on the event loop
+            return self.get_response(request)
+        if random.random() >= settings.PROFILING_SAMPLE_RATE:
+            return self.get_response(request)
+
+        log = QueryLog()
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler (a debugger, coverage) already holds the hook
+            return self.get_response(request)
+        began = perf_counter()
+        try:
+            with connection.execute_wrapper(log):
+                response = self.get_response(request)
+        finally:
+            profiler.disable()
+        duration = (perf_counter() - began) * 1000
+
+        # Plans are fetched after the request so they do not count towards it
+        threshold = getattr(settings, 'PROFILING_SLOW_QUERY_MS', 100)
+        queries = []
+        for sql, params, many, query_ms in log.queries:
+            query = {'sql': sql, 'duration_ms': round(query_ms, 3)}
+            if query_ms >= threshold and not many:
+                query['explain'] = explain(sql, params)
+            queries.append(query)
+
+        write_profile({
+            'time': time.time(),
+            'route': route_name(request),
+            'method': request.method,
+            'path': request.get_full_path(),
+            'status': response.status_code,
+            'duration_ms': round(duration, 3),
+            'queries': queries,
+            'functions': top_functions(profiler),
+        })
+        return response
@@ -48,6 +48,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'heart_monitor.profiling.ProfilingMiddleware', # Off unless PROFILING_SAMPLE_RATE is set
+    'heart_monitor.middleware.RequestMetricsMiddleware', # Early, so its timings cover the whole stack
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -77,6 +79,10 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'heart_monitor.wsgi.application'
 
+# URLconf of the ASGI application (heart_monitor.asgi): the same API with native async views for the
+# patient, heart rate history and export endpoints. Set it to ROOT_URLCONF to serve the DRF views under ASGI too.
+ASGI_URLCONF = 'heart_monitor.asgi_urls'
+
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
@@ -99,6 +105,91 @@ DATABASES = {
 # }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Local memory by default; point this at a shared backend (e.g. Redis) when running several processes
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'heart-monitor',
+    }
+}
+
+# Seconds a patient's cached latest reading is kept; new readings update it immediately
+LATEST_VITALS_TTL = 60
+
+# Seconds the user fields needed to authenticate a token are cached; saving a user updates them immediately
+AUTH_USER_CACHE_TTL = 60
+
+# Request metrics (heart_monitor.metrics): share of requests timed in detail (queries, serialization),
+# whether those timings go out as a Server-Timing header, and who may read /metrics
+METRICS_SAMPLE_RATE = 0.1
+METRICS_SERVER_TIMING = DEBUG
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+
+# Request profiling (heart_monitor.profiling): share of requests run under cProfile (0 turns it off),
+# queries slower than this many milliseconds get an EXPLAIN, and the newest files kept in PROFILING_DIR
+PROFILING_SAMPLE_RATE = 0
+PROFILING_SLOW_QUERY_MS = 100
+PROFILING_DIR = BASE_DIR / 'profiles'
+PROFILING_MAX_FILES = 500
+
+# Raw readings of months older than this are moved to HEART_RATE_ARCHIVE_DIR by `manage.py archive_heart_rates`
+HEART_RATE_RETENTION_DAYS = 90
+HEART_RATE_ARCHIVE_DIR = BASE_DIR / 'archive'
+
+# Write-behind ingest (patient.writebehind): POSTs are journaled to the spill directory and acknowledged,
+# and a background thread stores them in batches. Off by default: ingest commits before responding.
+HEART_RATE_WRITE_BEHIND = False
+HEART_RATE_WRITE_BEHIND_SPILL_DIR = BASE_DIR / 'spill'
+HEART_RATE_WRITE_BEHIND_MAX_PENDING = 10000
+HEART_RATE_WRITE_BEHIND_BATCH_SIZE = 500
+HEART_RATE_WRITE_BEHIND_FLUSH_SECONDS = 0.5
+
+# Device keys (patient.devices) are looked up through the cache; this bounds how long another process
+# may still accept a deleted key when caches are not shared
+DEVICE_KEY_CACHE_TTL = 300
+
+# Patient and heart rate lists (patient.response_cache) are cached per user for this many seconds, and
+# answer 304 to a matching If-None-Match. Writes move the lists on at once; 0 only keeps the 304s.
+# Writes are tracked by version counters kept for RESPONSE_CACHE_VERSION_TTL seconds. With a per-process
+# cache such as LocMemCache, a write only moves on the lists of the process that made it: other workers
+# serve their earlier lists until the counters expire. Run several workers on a shared cache (Redis,
+# Memcached) for writes to show everywhere at once.
+RESPONSE_CACHE_TTL = 300
+RESPONSE_CACHE_VERSION_TTL = 60
+
+# Bulk patient onboarding (users.onboarding): passwords are hashed on this many threads
+# (None: one per CPU), and users and patients are inserted this many rows per transaction
+PASSWORD_HASH_WORKERS = None
+PATIENT_ONBOARDING_CHUNK_SIZE = 500
+
+# Logins check passwords on the same threads (users.backends), queued behind at most one round of
+# onboarding hashes. Beyond this many waiting for one, the token endpoint answers 503 with Retry-After.
+PASSWORD_CHECK_QUEUE = 32
+
+
+# Password hashing
+# https://docs.djangoproject.com/en/5.2/topics/auth/passwords/
+# New passwords are hashed with scrypt at the cost below (32 MiB, about 130ms per hash on one core,
+# against about 420ms for PBKDF2 at Django's default). Hashes made with a hasher further down the list,
+# or with other scrypt parameters, are upgraded when their user next logs in.
+
+PASSWORD_HASHERS = [
+    'users.hashers.TunedScryptPasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+]
+PASSWORD_SCRYPT_WORK_FACTOR = 2 ** 15
+PASSWORD_SCRYPT_BLOCK_SIZE = 8
+PASSWORD_SCRYPT_PARALLELISM = 1
+
+AUTHENTICATION_BACKENDS = ['users.backends.PooledModelBackend']
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -145,7 +236,7 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'users.authentication.CachedJWTAuthentication',
     ),
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 2, # 2 records per page
@@ -179,4 +270,8 @@ SPECTACULAR_SETTINGS = {
     # OTHER SETTINGS
 }
 
-CORS_ALLOW_ALL_ORIGINS = True
\ No newline at end of file
+CORS_ALLOW_ALL_ORIGINS = True
+
+#Live heart rate push (served by the ASGI app at /api/heart-rates/stream/)
+# Any class with subscribe/unsubscribe/publish, e.g. one backed by a local broker
+HEART_RATE_BROKER = 'patient.pubsub.InProcessBroker'
\ No newline at end of file
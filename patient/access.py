@@ -0,0 +1,99 @@
+from .models import Patient
+
+
+class AccessScope:
+    """
+    Answers which patients a user may read and write, for one request.
+    Role rules live here instead of in every view:
+    - HOD: manages every patient, but does not read heart rate data.
+    - DOCTOR: manages, reads and writes data of the patients assigned to them.
+    - PATIENT: reads their own data.
+    Who owns a patient (doctor and user ids) is memoized for the request, so a check costs at most
+    one indexed query, shared by every lookup in the request. It is never cached across requests:
+    a patient moving to another doctor takes effect with the next request, in every process.
+    """
+    def __init__(self, user):
+        self.user = user
+        self._owners = {}  # patient_id -> (doctor_id, user_id), or None when there is no such patient
+
+    def owners(self, patient_ids):
+        """Returns {patient_id: (doctor_id, user_id) or None}, loading what is not known yet in one query."""
+        missing = [pk for pk in patient_ids if pk not in self._owners]
+        if missing:
+            self._take(missing, self._owner_rows(missing))
+        return {pk: self._owners[pk] for pk in patient_ids}
+
+    async def aowners(self, patient_ids):
+        """owners() for async views. Once it returns, checks on these patients are answered from memory."""
+        missing = [pk for pk in patient_ids if pk not in self._owners]
+        if missing:
+            self._take(missing, [row async for row in self._owner_rows(missing)])
+        return {pk: self._owners[pk] for pk in patient_ids}
+
+    def _owner_rows(self, patient_ids):
+        return Patient.objects.filter(pk__in=patient_ids).order_by().values_list('pk', 'doctor_id', 'user_id')
+
+    def _take(self, patient_ids, rows):
+        """Memoizes the owners read from the database."""
+        found = {pk: (doctor_id, user_id) for pk, doctor_id, user_id in rows}
+        for pk in patient_ids:
+            self._owners[pk] = found.get(pk)
+
+    def exists(self, patient_id):
+        return self.owners([patient_id])[patient_id] is not None
+
+    def _may_read(self, owner):
+        if owner is None:
+            return False
+        doctor_id, user_id = owner
+        if self.user.role == 'DOCTOR':
+            return doctor_id == self.user.pk
+        elif self.user.role == 'PATIENT':
+            return user_id == self.user.pk
+        return False
+
+    def _may_write(self, owner):
+        return owner is not None and self.user.role == 'DOCTOR' and owner[0] == self.user.pk
+
+    def can_read(self, patient_id):
+        return self._may_read(self.owners([patient_id])[patient_id])
+
+    def can_write(self, patient_id):
+        return self._may_write(self.owners([patient_id])[patient_id])
+
+    def writable(self, patient_ids):
+        """The subset of patient_ids whose data the user may add to."""
+        return {pk for pk, owner in self.owners(patient_ids).items() if self._may_write(owner)}
+
+    def readable_rows(self, queryset, patient_id):
+        """Restricts a queryset of per-patient rows (readings, rollups, archives) to one patient, if readable."""
+        if not self.can_read(patient_id):
+            return queryset.none()
+        return queryset.filter(patient_id=patient_id)
+
+    def managed_patients(self, queryset=None):
+        """Patients the user manages through the patient API."""
+        queryset = Patient.objects.all() if queryset is None else queryset
+        if self.user.role == 'HOD':
+            return queryset
+        elif self.user.role == 'DOCTOR':
+            return queryset.filter(doctor=self.user)
+        return queryset.none()
+
+    def readable_patients(self):
+        """Patients whose heart rate data the user may read."""
+        if self.user.role == 'DOCTOR':
+            return Patient.objects.filter(doctor=self.user)
+        elif self.user.role == 'PATIENT':
+            return Patient.objects.filter(user=self.user)
+        return Patient.objects.none()
+
+
+def access_scope(request):
+    """The AccessScope of the request's user, created once per request."""
+    # Kept on the HttpRequest so a DRF Request and the request it wraps share it
+    request = getattr(request, '_request', request)
+    scope = getattr(request, 'access_scope', None)
+    if scope is None or scope.user is not request.user:
+        scope = request.access_scope = AccessScope(request.user)
+    return scope
@@ -0,0 +1,161 @@
+import heapq
+from datetime import datetime, timedelta, timezone as dt_timezone
+from itertools import groupby, islice
+from operator import itemgetter
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+
+# Bucket name -> bucket width
+BUCKETS = {
+    '1m': timedelta(minutes=1),
+    '5m': timedelta(minutes=5),
+    '1h': timedelta(hours=1),
+    '1d': timedelta(days=1),
+}
+
+
+def floor_time(moment, width):
+    """Rounds a datetime down to a multiple of width since the epoch (UTC)."""
+    seconds = int(width.total_seconds())
+    epoch = int(moment.timestamp()) // seconds * seconds
+    return datetime.fromtimestamp(epoch, tz=dt_timezone.utc)
+
+
+def month_start(moment):
+    return datetime(moment.year, moment.month, 1, tzinfo=dt_timezone.utc)
+
+
+def next_month(month):
+    return month.replace(year=month.year + 1, month=1) if month.month == 12 else month.replace(month=month.month + 1)
+
+
+def merge_buckets(rows, width):
+    """
+    Folds (start, min, max, sum, count) rows, ordered by start, into buckets of the given width.
+    Rows from a finer truncation (e.g. minutes for 5 minute buckets) are combined in one pass.
+    """
+    merged = []
+    for start, low, high, total, count in rows:
+        start = floor_time(start, width)
+        if merged and merged[-1]['start'] == start:
+            bucket = merged[-1]
+            bucket['min'] = min(bucket['min'], low)
+            bucket['max'] = max(bucket['max'], high)
+            bucket['sum'] += total
+            bucket['count'] += count
+        else:
+            merged.append({'start': start, 'min': low, 'max': high, 'sum': total, 'count': count})
+
+    for bucket in merged:
+        bucket['avg'] = bucket.pop('sum') / bucket['count']
+    return merged
+
+
+def rollup_stats(queryset, bucket):
+    """
+    Returns min/max/avg/count per time bucket, read from a HeartRateMinute/HeartRateHour queryset
+    instead of scanning raw readings.
+    """
+    width = BUCKETS[bucket]
+    rows = queryset.order_by('bucket').values_list('bucket', 'min_value', 'max_value', 'total', 'count')
+    return merge_buckets(rows, width)
+
+
+def rollup_stats_by_patient(queryset, bucket):
+    """
+    rollup_stats for a rollup queryset spanning several patients, as {patient_id: buckets}.
+    One query for all of them; patients without rollups are left out.
+    """
+    width = BUCKETS[bucket]
+    rows = queryset.order_by('patient_id', 'bucket').values_list(
+        'patient_id', 'bucket', 'min_value', 'max_value', 'total', 'count'
+    )
+    return {
+        patient_id: merge_buckets((row[1:] for row in group), width)
+        for patient_id, group in groupby(rows, key=itemgetter(0))
+    }
+
+
+def latest_readings_by_patient(queryset, limit):
+    """
+    The newest `limit` readings of every patient in a HeartRate queryset, as {patient_id: [(timestamp, value)]}
+    oldest first. One query: readings are numbered per patient with a window function, so a patient with
+    a long history does not crowd out the others and nothing past the limit is sent back.
+    """
+    rows = (
+        queryset.order_by()
+        .annotate(recency=Window(
+            RowNumber(), partition_by=F('patient_id'), order_by=(F('timestamp').desc(), F('id').desc()),
+        ))
+        .filter(recency__lte=limit)
+        .order_by('patient_id', 'timestamp', 'id')
+        .values_list('patient_id', 'timestamp', 'value')
+    )
+    return {
+        patient_id: [row[1:] for row in group]
+        for patient_id, group in groupby(rows, key=itemgetter(0))
+    }
+
+
+def lttb(points, threshold, count=None):
+    """
+    Largest-Triangle-Three-Buckets downsampling.
+    Takes (timestamp, value) pairs ordered by time and keeps at most `threshold` of them,
+    picking in each bucket the point that best preserves the visual shape of the series.
+    `points` may be any iterable when `count` says how many it holds: the buckets follow from the
+    count, so only two buckets are held in memory at a time. Points beyond the count end up in the
+    last one; if fewer arrive, the missing buckets are skipped.
+    """
+    if count is None:
+        points = list(points)
+        count = len(points)
+    points = iter(points)
+    if threshold >= count or threshold < 3:
+        return list(points)
+
+    first = next(points, None)
+    if first is None:
+        return []
+    every = (count - 2) / (threshold - 2)
+
+    def buckets():
+        for i in range(threshold - 2):
+            yield list(islice(points, int((i + 1) * every) - int(i * every)))
+        # The last point, and anything that arrived after the count was taken
+        yield list(points)
+
+    sampled = [first]
+    selected = first[0].timestamp(), first[1]
+    groups = (group for group in buckets() if group)
+    current = next(groups, None)
+    if current is None:
+        return sampled
+    for following in groups:
+        # Average of the next bucket is the third corner of the triangle
+        avg_x = sum(p[0].timestamp() for p in following) / len(following)
+        avg_y = sum(p[1] for p in following) / len(following)
+
+        ax, ay = selected
+        best_area, best = -1, None
+        for point in current:
+            x = point[0].timestamp()
+            area = abs((ax - avg_x) * (point[1] - ay) - (ax - x) * (avg_y - ay))
+            if area > best_area:
+                best_area, best = area, point
+        sampled.append(best)
+        selected = best[0].timestamp(), best[1]
+        current = following
+
+    sampled.append(current[-1])
+    return sampled
+
+
+def downsample(queryset, threshold, archived=(), archived_count=0):
+    """
+    Returns at most `threshold` (timestamp, value) points for a HeartRate queryset, oldest first.
+    `archived` (timestamp, value) points, oldest first and `archived_count` of them, are merged into the series.
+    Readings are streamed from the database in chunks, after a COUNT: memory does not grow with the range.
+    """
+    count = queryset.count() + archived_count
+    rows = queryset.order_by('timestamp', 'id').values_list('timestamp', 'value').iterator(chunk_size=5000)
+    return lttb(heapq.merge(archived, rows, key=itemgetter(0)), threshold, count)
@@ -0,0 +1,154 @@
+import threading
+import time
+from collections import deque
+from datetime import timedelta
+from django.db import transaction
+from django.db.models import Q
+from .models import Alert, AlertRule, Patient
+
+# Readings kept per patient for rate-of-change checks
+RATE_WINDOW = timedelta(minutes=1)
+# How long a patient's rules are cached before they are reloaded (edits in this process invalidate at once)
+RULES_TTL_SECONDS = 60
+
+
+class PatientState:
+    """What the rules of one patient need between batches."""
+    def __init__(self):
+        self.recent = deque()       # (timestamp, value) within RATE_WINDOW
+        self.breaches = {}          # rule_id -> [kind, started_at, alerted]
+        self.rate_alerted = set()   # rule_ids currently over the rate limit
+
+    def copy(self):
+        state = PatientState()
+        state.recent = deque(self.recent)
+        state.breaches = {rule_id: list(breach) for rule_id, breach in self.breaches.items()}
+        state.rate_alerted = set(self.rate_alerted)
+        return state
+
+
+class AlertEngine:
+    """
+    Evaluates alert rules against readings as they are ingested.
+    Everything a rule needs (the current breach, the last minute of readings) is kept in memory per
+    patient, so each reading costs a constant amount of work instead of a query over past readings.
+    State is per process: every worker tracks the readings it ingests.
+    A batch is evaluated on a copy of its patients' state, which replaces the live state only once the
+    ingest transaction commits: a batch that is rolled back or retried leaves no trace.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Drops all cached rules and breach state."""
+        self._rules = {}        # patient_id -> (loaded_at, [AlertRule])
+        self._states = {}       # patient_id -> PatientState
+
+    def forget_rules(self):
+        """Makes the next batch reload rules from the database."""
+        with self._lock:
+            self._rules.clear()
+
+    def _rules_for(self, patient_ids):
+        now = time.monotonic()
+        stale = [pk for pk in patient_ids if pk not in self._rules or now - self._rules[pk][0] > RULES_TTL_SECONDS]
+        if stale:
+            doctors = dict(Patient.objects.filter(pk__in=stale).values_list('pk', 'doctor_id'))
+            rules = AlertRule.objects.filter(is_active=True).filter(
+                Q(patient_id__in=stale) | Q(doctor_id__in={d for d in doctors.values() if d is not None})
+            )
+            loaded = {pk: [] for pk in stale}
+            for rule in rules:
+                if rule.patient_id is not None:
+                    loaded[rule.patient_id].append(rule)
+                else:
+                    for pk, doctor_id in doctors.items():
+                        if doctor_id == rule.doctor_id:
+                            loaded[pk].append(rule)
+            for pk, patient_rules in loaded.items():
+                self._rules[pk] = (now, patient_rules)
+        return {pk: self._rules[pk][1] for pk in patient_ids}
+
+    def _check_level(self, rule, reading, state):
+        if rule.max_value is not None and reading.value > rule.max_value:
+            kind = Alert.Kind.HIGH
+        elif rule.min_value is not None and reading.value < rule.min_value:
+            kind = Alert.Kind.LOW
+        else:
+            kind = None
+
+        if kind is None:
+            state.breaches.pop(rule.pk, None)
+            return None
+
+        breach = state.breaches.get(rule.pk)
+        if breach is None or breach[0] != kind:
+            breach = state.breaches[rule.pk] = [kind, reading.timestamp, False]
+        # Alert once per breach, as soon as it has lasted long enough
+        if not breach[2] and (reading.timestamp - breach[1]).total_seconds() >= rule.sustained_seconds:
+            breach[2] = True
+            return Alert(rule=rule, patient_id=reading.patient_id, kind=kind,
+                         value=reading.value, triggered_at=reading.timestamp)
+        return None
+
+    def _check_rate(self, rule, reading, state):
+        if rule.max_change_per_minute is None or not state.recent:
+            return None
+        # Compare with the oldest reading still inside the window
+        if abs(reading.value - state.recent[0][1]) <= rule.max_change_per_minute:
+            state.rate_alerted.discard(rule.pk)
+            return None
+        if rule.pk in state.rate_alerted:
+            return None
+        state.rate_alerted.add(rule.pk)
+        return Alert(rule=rule, patient_id=reading.patient_id, kind=Alert.Kind.RATE,
+                     value=reading.value, triggered_at=reading.timestamp)
+
+    def evaluate(self, readings):
+        """
+        Returns the (unsaved) alerts raised by a batch of newly stored readings.
+        Called inside the ingest transaction; the state it leads to is kept when that commits.
+        """
+        alerts = []
+        staged = {}
+        with self._lock:
+            rules = self._rules_for({r.patient_id for r in readings})
+            for reading in sorted(readings, key=lambda r: (r.patient_id, r.timestamp)):
+                patient_rules = rules[reading.patient_id]
+                if not patient_rules:
+                    continue
+                state = staged.get(reading.patient_id)
+                if state is None:
+                    live = self._states.get(reading.patient_id)
+                    state = staged[reading.patient_id] = live.copy() if live is not None else PatientState()
+                recent = state.recent
+                if recent and reading.timestamp < recent[-1][0]:
+                    # Late replay of an older reading; the live state has already moved past it
+                    continue
+                while recent and reading.timestamp - recent[0][0] > RATE_WINDOW:
+                    recent.popleft()
+
+                for rule in patient_rules:
+                    for alert in (self._check_level(rule, reading, state), self._check_rate(rule, reading, state)):
+                        if alert is not None:
+                            alerts.append(alert)
+                recent.append((reading.timestamp, reading.value))
+        if staged:
+            transaction.on_commit(lambda: self._keep(staged))
+        return alerts
+
+    def _keep(self, staged):
+        with self._lock:
+            self._states.update(staged)
+
+
+alert_engine = AlertEngine()
+
+
+def raise_alerts(readings):
+    """Evaluates newly stored readings and saves any alerts they raise."""
+    alerts = alert_engine.evaluate(readings)
+    if alerts:
+        Alert.objects.bulk_create(alerts)
+    return alerts
@@ -0,0 +1,142 @@
+import csv
+import gzip
+import heapq
+import os
+from pathlib import Path
+from uuid import uuid4
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, OuterRef, Subquery
+from django.utils.dateparse import parse_datetime
+from .columnar import ChunkReader, write_chunks
+from .export import EXPORT_FIELDS
+from .aggregation import month_start, next_month
+from .models import HeartRate, HeartRateArchive, Patient
+from .rollups import rebuild_rollups
+
+
+def archive_dir():
+    return Path(getattr(settings, 'HEART_RATE_ARCHIVE_DIR', settings.BASE_DIR / 'archive'))
+
+
+def segment_path(patient_id, month):
+    """
+    Relative path for a new file holding one patient-month of readings.
+    Every write gets a fresh name, so the file an archive row points to is never rewritten in place.
+    """
+    return f"{month:%Y-%m}/patient-{patient_id}-{uuid4().hex[:12]}.hrc"
+
+
+def write_segment(relative_path, rows):
+    """
+    Writes reading rows (EXPORT_FIELDS order, oldest first) to a columnar file, see columnar.py.
+    Returns (count, first timestamp, last timestamp).
+    """
+    path = archive_dir() / relative_path
+    path.parent.mkdir(parents=True, exist_ok=True)
+    partial = path.with_name(path.name + '.partial')
+    with open(partial, 'wb') as handle:
+        count, first, last = write_chunks(handle, rows)
+    os.replace(partial, path)
+    return count, first, last
+
+
+def _read_csv_segment(path, start, end, descending):
+    # Months archived before the columnar format were written as gzip CSV
+    with gzip.open(path, 'rt', newline='') as handle:
+        reader = csv.reader(handle)
+        next(reader)
+        rows = [
+            (int(pk), parse_datetime(timestamp), int(value), device_id, int(sequence) if sequence else None)
+            for pk, timestamp, value, device_id, sequence in reader
+        ]
+    rows = [row for row in rows if (start is None or row[1] >= start) and (end is None or row[1] <= end)]
+    yield from reversed(rows) if descending else rows
+
+
+def read_segment(relative_path, start=None, end=None, descending=False):
+    """
+    Yields (id, timestamp, value, device_id, sequence) tuples from an archived file,
+    limited to start <= timestamp <= end, oldest first (newest first when `descending`).
+    """
+    path = archive_dir() / relative_path
+    if path.name.endswith('.csv.gz'):
+        yield from _read_csv_segment(path, start, end, descending)
+        return
+    with ChunkReader(path) as reader:
+        yield from reader.rows(start, end, descending)
+
+
+def archived_rows(archives, start=None, end=None, descending=False):
+    """
+    Yields reading tuples from a list of HeartRateArchive rows ordered by month, as one series.
+    Files whose time range lies outside [start, end] are not opened.
+    """
+    for archive in reversed(archives) if descending else archives:
+        if (start is not None and archive.last_timestamp < start) or (end is not None and archive.first_timestamp > end):
+            continue
+        yield from read_segment(archive.path, start, end, descending)
+
+
+def first_readings(before):
+    """Returns {patient_id: timestamp of their oldest reading} for patients with readings before a time."""
+    oldest = HeartRate.objects.filter(patient=OuterRef('pk')).order_by('timestamp').values('timestamp')[:1]
+    # One index seek per patient rather than a scan of the whole table
+    rows = Patient.objects.annotate(first=Subquery(oldest)).filter(first__lt=before).values_list('pk', 'first')
+    return dict(rows)
+
+
+def archive_month(patient_id, month):
+    """
+    Moves one patient-month of raw readings into an archive file.
+    The month is first compacted into rollups (once), the raw rows are written to disk,
+    and then they are removed with a single range DELETE. A month that was archived before
+    and received late readings is merged into its existing file.
+    Returns the number of readings moved.
+    """
+    end = next_month(month)
+    readings = HeartRate.objects.filter(patient_id=patient_id, timestamp__gte=month, timestamp__lt=end)
+    # Readings that arrive while the file is written have higher ids; they stay for the next run
+    newest_id = readings.aggregate(newest=Max('id'))['newest']
+    if newest_id is None:
+        return 0
+    readings = readings.filter(id__lte=newest_id)
+    existing = HeartRateArchive.objects.filter(patient_id=patient_id, month=month.date()).first()
+    if existing is None:
+        # Late readings are already in the rollups (ingest maintains them); the first pass makes sure old data is too
+        rebuild_rollups(month, end, patient_ids=[patient_id])
+
+    rows = readings.order_by('timestamp', 'id').values_list(*EXPORT_FIELDS).iterator(chunk_size=5000)
+    if existing is not None:
+        rows = heapq.merge(read_segment(existing.path), rows, key=lambda row: (row[1], row[0]))
+
+    relative_path = segment_path(patient_id, month)
+    count, first, last = write_segment(relative_path, rows)
+    with transaction.atomic():
+        HeartRateArchive.objects.update_or_create(
+            patient_id=patient_id, month=month.date(),
+            defaults={'path': relative_path, 'count': count, 'first_timestamp': first, 'last_timestamp': last},
+        )
+        # HeartRate has no dependent rows or delete signals, so this is one DELETE over an index range
+        moved = readings.delete()[0]
+        if existing is not None:
+            # Readers switch to the new file with the commit; the old one is not needed after that
+            transaction.on_commit(lambda: (archive_dir() / existing.path).unlink(missing_ok=True))
+    return moved
+
+
+def archive_before(cutoff):
+    """
+    Archives every full month that ended before `cutoff`, patient by patient.
+    Returns {(patient_id, month): readings moved}.
+    """
+    last_month = month_start(cutoff)
+    moved = {}
+    for patient_id, first in first_readings(last_month).items():
+        month = month_start(first)
+        while month < last_month:
+            count = archive_month(patient_id, month)
+            if count:
+                moved[(patient_id, month)] = count
+            month = next_month(month)
+    return moved
@@ -0,0 +1,18 @@
+from django.urls import path, re_path
+from .async_views import AsyncHeartRateExportView, AsyncHeartRateListCreateView, AsyncPatientViewSet
+from .streams import heart_rate_stream
+
+# Routes of patient.urls that the ASGI application serves with native async views (see heart_monitor.asgi_urls),
+# and the live stream, which only the ASGI application serves: under WSGI it would hold a worker thread forever
+urlpatterns = [
+    path('patients/', AsyncPatientViewSet.as_view({'get': 'list', 'post': 'create'}), name='patient-list'),
+    re_path(r'^patients/(?P<pk>[^/.]+)/$', AsyncPatientViewSet.as_view({
+        'get': 'retrieve', 'put': 'update', 'patch': 'partial_update', 'delete': 'destroy',
+    }), name='patient-detail'),
+    path('patients/<int:patient_pk>/heart-rates/', AsyncHeartRateListCreateView.as_view(), name='patient-heart-rates'),
+    path(
+        'patients/<int:patient_pk>/heart-rates/export/', AsyncHeartRateExportView.as_view(),
+        name='patient-heart-rates-export',
+    ),
+    path('heart-rates/stream/', heart_rate_stream, name='heart-rates-stream'),
+]
@@ -0,0 +1,189 @@
+"""
+Native async versions of the busiest API endpoints, routed in place of the DRF views by the ASGI
+application (see heart_monitor.asgi_urls).
+
+Each async view drives its DRF counterpart: the DRF view still supplies the queryset, filters,
+pagination, serializers and permissions, and answers exactly as under WSGI, while the database
+and cache work is done with the async ORM and cache API. A request waiting on a slow client
+therefore holds no worker thread, and the export streams through async iterators, which Django
+would otherwise load whole on a thread. Not everything can be async:
+- Ingest keeps its transaction (readings, rollups and alerts commit together) on a thread, since
+  Django has no async transactions.
+- Requests for a renderer other than JSON (the browsable API), and methods without an async
+  handler, are passed to the DRF view unchanged.
+"""
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ValidationError
+from django.http import Http404, HttpResponse
+from django.utils.decorators import classonlymethod
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import status
+from rest_framework.exceptions import APIException, NotAuthenticated
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import ForcedAuthentication
+from rest_framework.response import Response
+from heart_monitor.middleware import serializing
+from users.authentication import CachedJWTAuthentication
+from .access import access_scope
+from .export import ASYNC_EXPORT_LINES
+from .models import HeartRateArchive
+from .pagination import apaginate_by_page_number
+from .views import HeartRateExportView, HeartRateListCreateView, PatientViewSet
+from .vitals import aget_latest_vitals
+from .writebehind import accept_readings, write_behind_enabled
+
+
+class AsyncAPIView(View):
+    """
+    Base class of the async views. `view_class` is the DRF view doing the same job; as with viewsets,
+    `as_view()` takes the {method: action} map when it is one. Subclasses implement what they serve
+    asynchronously as `async def <method or action>(self, view, request, *args, **kwargs)`, with `view`
+    the DRF view set up for the request as its own dispatch() would have.
+    """
+    view_class = None
+    actions = None
+    drf_view = None  # view_class.as_view(), which answers the requests passed on
+    view_is_async = True
+
+    @classonlymethod
+    def as_view(cls, actions=None, **initkwargs):
+        drf_view = cls.view_class.as_view(actions) if actions else cls.view_class.as_view()
+        # Tokens, not session cookies, authenticate API calls, so CSRF does not apply (as with DRF views)
+        return csrf_exempt(super().as_view(actions=actions, drf_view=drf_view, **initkwargs))
+
+    async def dispatch(self, request, *args, **kwargs):
+        method = request.method.lower()
+        handler = getattr(self, self.actions.get(method, '') if self.actions else method, None)
+
+        view = self.view_class(args=args, kwargs=kwargs, format_kwarg=None)
+        if self.actions:
+            view.action_map = self.actions
+        view.headers = view.default_response_headers
+        drf_request = view.request = view.initialize_request(request, *args, **kwargs)
+        try:
+            renderer, media_type = view.perform_content_negotiation(drf_request)
+        except APIException:
+            renderer = None
+        if handler is None or method == 'options' or not isinstance(renderer, JSONRenderer):
+            return await sync_to_async(self.drf_view)(request, *args, **kwargs)
+        drf_request.accepted_renderer, drf_request.accepted_media_type = renderer, media_type
+
+        try:
+            await self.authenticate(drf_request)
+            view.check_permissions(drf_request)
+            response = await handler(view, drf_request, *args, **kwargs)
+        except Exception as exc:
+            response = view.handle_exception(exc)
+        return self.finalize(view, drf_request, response)
+
+    async def authenticate(self, request):
+        user_auth = await CachedJWTAuthentication().aauthenticate(request)
+        if user_auth is None:
+            # Every async view requires a user, as IsAuthenticated would
+            raise NotAuthenticated()
+        # The user is resolved already; DRF's Request takes it from here without authenticating again
+        request.authenticators = (ForcedAuthentication(*user_auth),)
+
+    def finalize(self, view, request, response):
+        # Rendered here into a plain HttpResponse: Django would render a DRF Response on a thread
+        response = view.finalize_response(request, response)
+        if not isinstance(response, Response):
+            # Streamed as it is
+            return response
+        with serializing():
+            content = response.rendered_content
+        return HttpResponse(content, status=response.status_code, headers=response.headers)
+
+
+class AsyncHeartRateListCreateView(AsyncAPIView):
+    """
+    Async HeartRateListCreateView: a patient's heart rate history and ingest, for ASGI.
+    """
+    view_class = HeartRateListCreateView
+
+    async def get(self, view, request, *args, **kwargs):
+        return await view.alist(request, lambda: self.page(view, request, kwargs['patient_pk']))
+
+    async def page(self, view, request, patient_pk):
+        # Loaded here, so the access checks and the archive merge of the DRF view need no query
+        await access_scope(request).aowners([patient_pk])
+        view.archives = [archive async for archive in view.scope(HeartRateArchive.objects.all())]
+
+        queryset = view.filter_queryset(view.get_queryset())
+        page = await view.paginator.apaginate_queryset(queryset, request, view=view)
+        with serializing():
+            data = view.get_serializer(page, many=True).data
+        return view.get_paginated_response(data)
+
+    async def post(self, view, request, *args, **kwargs):
+        serializer = view.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        await access_scope(request).aowners([kwargs['patient_pk']])
+        patient_pk = view.writable_patient_pk()
+
+        if write_behind_enabled():
+            items = serializer.validated_data
+            items = items if isinstance(items, list) else [items]
+            # On a thread, as the journal is fsynced before the readings are acknowledged
+            accepted = await sync_to_async(accept_readings)(
+                [{**item, 'patient_id': patient_pk} for item in items], request.user
+            )
+            return Response({'accepted': accepted}, status=status.HTTP_202_ACCEPTED)
+
+        await sync_to_async(serializer.save)(patient_id=patient_pk)
+        with serializing():
+            data = serializer.data
+        return Response(data, status=status.HTTP_201_CREATED)
+
+
+class AsyncHeartRateExportView(AsyncAPIView):
+    """
+    Async HeartRateExportView: a patient's full heart rate history as a file download, for ASGI.
+    """
+    view_class = HeartRateExportView
+
+    async def get(self, view, request, *args, **kwargs):
+        output = view.export_output()
+        # Loaded here, so the access check and the archive merge of the DRF view need no query
+        await access_scope(request).aowners([kwargs['patient_pk']])
+        view.archives = [archive async for archive in view.scope(HeartRateArchive.objects.all())]
+
+        queryset = view.filter_queryset(view.get_queryset())
+        return view.export_response(output, ASYNC_EXPORT_LINES[output](queryset, view.archived_rows()))
+
+
+class AsyncPatientViewSet(AsyncAPIView):
+    """
+    Async PatientViewSet read paths (list and retrieve), for ASGI.
+    Creating, updating and deleting patients is passed to the viewset.
+    """
+    view_class = PatientViewSet
+
+    async def list(self, view, request, *args, **kwargs):
+        return await view.alist(request, lambda: self.page(view, request))
+
+    async def page(self, view, request):
+        queryset = view.filter_queryset(view.get_queryset())
+        page = await apaginate_by_page_number(view.paginator, queryset, request)
+        patients = page if page is not None else [patient async for patient in queryset.aiterator()]
+        data = await self.serialize(view, patients, many=True)
+        return view.get_paginated_response(data) if page is not None else Response(data)
+
+    async def retrieve(self, view, request, *args, **kwargs):
+        lookup = {view.lookup_field: kwargs[view.lookup_url_kwarg or view.lookup_field]}
+        try:
+            patient = await view.filter_queryset(view.get_queryset()).filter(**lookup).afirst()
+        except (TypeError, ValueError, ValidationError):
+            patient = None
+        if patient is None:
+            raise Http404("No Patient matches the given query.")
+        view.check_object_permissions(request, patient)
+        return Response(await self.serialize(view, patient))
+
+    async def serialize(self, view, patients, many=False):
+        # The serializer reads the latest vitals from the context instead of looking them up itself
+        context = view.get_serializer_context()
+        context['vitals'] = await aget_latest_vitals([patient.pk for patient in (patients if many else [patients])])
+        with serializing():
+            return view.get_serializer_class()(patients, many=many, context=context).data
@@ -0,0 +1,296 @@
+"""
+In-process load generator for the API, used by `manage.py benchmark`.
+Requests go through the whole Django/DRF stack (middleware, JWT authentication, permissions,
+serializers, database) with the test client and no network, so runs compare code changes
+rather than server setups.
+Each scenario can be driven the WSGI way (one thread per concurrent client, through the DRF views)
+or the ASGI way (one task per client on a single event loop, through ASGI_URLCONF and its async views).
+"""
+import asyncio
+import math
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.hashers import get_hasher, make_password
+from django.db import connection
+from django.test import AsyncClient
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+from users.hashing import hash_workers
+from users.models import CustomUser
+from .models import HeartRate, Patient
+from .rollups import rebuild_rollups
+
+LOGIN_PASSWORD = 'benchmark-password'
+
+
+def seed(doctors, patients_per_doctor, readings_per_patient):
+    """
+    Creates doctors, their patients and one reading per second up to now for every patient.
+    The first doctor gets a real password for the login scenario; the others are unusable, as
+    hashing one per user would dominate the setup. Returns {doctor: [patient ids]}.
+    """
+    now = timezone.now().replace(microsecond=0)
+    start = now - timedelta(seconds=readings_per_patient)
+    unusable = make_password(None)
+
+    doctor_users = CustomUser.objects.bulk_create(
+        CustomUser(username=f'bench-doctor-{d}', role=CustomUser.Role.DOCTOR, password=unusable) for d in range(doctors)
+    )
+    doctor_users[0].set_password(LOGIN_PASSWORD)
+    doctor_users[0].save(update_fields=['password'])
+
+    patient_users = CustomUser.objects.bulk_create(
+        CustomUser(username=f'bench-patient-{d}-{p}', role=CustomUser.Role.PATIENT, password=unusable)
+        for d in range(doctors) for p in range(patients_per_doctor)
+    )
+    patients = Patient.objects.bulk_create(
+        Patient(user=user, doctor=doctor_users[i // patients_per_doctor], full_name=user.username, age=40)
+        for i, user in enumerate(patient_users)
+    )
+
+    rng = random.Random(0)
+    for patient in patients:
+        HeartRate.objects.bulk_create(
+            (HeartRate(patient=patient, value=rng.randint(55, 110), timestamp=start + timedelta(seconds=s))
+             for s in range(readings_per_patient)),
+            batch_size=500,
+        )
+    rebuild_rollups(start, now + timedelta(minutes=1))
+
+    return {
+        doctor: [patient.pk for patient in patients if patient.doctor_id == doctor.pk] for doctor in doctor_users
+    }
+
+
+class Worker:
+    """One simulated client: a doctor's authenticated API clients (sync and async) and that doctor's patients."""
+    def __init__(self, doctor, patient_ids, batch_size, seed):
+        self.headers = {'Authorization': f'Bearer {AccessToken.for_user(doctor)}'}
+        self.client = APIClient(headers=self.headers)
+        self.async_client = AsyncClient()
+        self.doctor = doctor
+        self.patient_ids = patient_ids
+        self.batch_size = batch_size
+        self.rng = random.Random(seed)
+
+    def patient(self):
+        return self.rng.choice(self.patient_ids)
+
+    def readings(self, count):
+        now = timezone.now()
+        return [
+            {'value': self.rng.randint(55, 110), 'timestamp': (now + timedelta(microseconds=i)).isoformat()}
+            for i in range(count)
+        ]
+
+    def send(self, method, url, data):
+        if method == 'get':
+            return self.client.get(url, data)
+        return self.client.post(url, data, format='json')
+
+    async def asend(self, method, url, data):
+        if method == 'get':
+            return await self.async_client.get(url, data, headers=self.headers)
+        return await self.async_client.post(url, data, content_type='application/json', headers=self.headers)
+
+
+# Each scenario returns the (method, url, data) of the next request of a worker
+
+def list_patients(worker):
+    return 'get', reverse('patient-list'), None
+
+
+def heart_rate_history(worker):
+    url = reverse('patient-heart-rates', kwargs={'patient_pk': worker.patient()})
+    return 'get', url, {'page_size': 100}
+
+
+def heart_rate_aggregate(worker):
+    url = reverse('patient-heart-rates-aggregate', kwargs={'patient_pk': worker.patient()})
+    return 'get', url, {'bucket': '1m'}
+
+
+def heart_rate_ingest(worker):
+    url = reverse('patient-heart-rates', kwargs={'patient_pk': worker.patient()})
+    return 'post', url, worker.readings(worker.batch_size)
+
+
+def bulk_ingest(worker):
+    readings = worker.readings(worker.batch_size)
+    for reading in readings:
+        reading['patient'] = worker.patient()
+    return 'post', reverse('heart-rates-bulk'), readings
+
+
+def login(worker):
+    # The token view ignores the worker's credentials
+    return 'post', reverse('token_obtain_pair'), {'username': 'bench-doctor-0', 'password': LOGIN_PASSWORD}
+
+
+# Scenario name -> function building one request for a worker
+SCENARIOS = {
+    'patients': list_patients,
+    'history': heart_rate_history,
+    'aggregate': heart_rate_aggregate,
+    'ingest': heart_rate_ingest,
+    'bulk-ingest': bulk_ingest,
+    'login': login,
+}
+
+SERVERS = ('wsgi', 'asgi')
+
+
+def percentile(ordered, fraction):
+    """Nearest-rank percentile of an ascending list."""
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))]
+
+
+def summarize(samples, seconds):
+    """Reduces (latency seconds, queries, status) samples to the reported figures."""
+    latencies = sorted(sample[0] * 1000 for sample in samples)
+    return {
+        'requests': len(samples),
+        'errors': sum(1 for sample in samples if sample[2] >= 400),
+        'seconds': round(seconds, 3),
+        'requests_per_second': round(len(samples) / seconds, 1) if seconds else None,
+        'latency_ms': {
+            'p50': round(percentile(latencies, 0.50), 2),
+            'p95': round(percentile(latencies, 0.95), 2),
+            'p99': round(percentile(latencies, 0.99), 2),
+            'max': round(latencies[-1], 2),
+            'mean': round(sum(latencies) / len(latencies), 2),
+        },
+        'queries_per_request': (
+            round(sum(sample[1] for sample in samples) / len(samples), 2) if samples[0][1] is not None else None
+        ),
+    }
+
+
+def split(requests, workers):
+    """Number of requests for each worker, as even as possible."""
+    return [requests // len(workers) + (1 if i < requests % len(workers) else 0) for i in range(len(workers))]
+
+
+def run_scenario(scenario, workers, requests, server='wsgi'):
+    """
+    Sends `requests` requests through `scenario`, spread evenly over the workers, which run concurrently:
+    in their own threads (inline when there is only one) for 'wsgi', as tasks on one event loop for 'asgi'.
+    """
+    if server == 'asgi':
+        return run_scenario_async(scenario, workers, requests)
+
+    samples = []
+    lock = threading.Lock()
+
+    def drive(worker, count):
+        measured = []
+        for _ in range(count):
+            with CaptureQueriesContext(connection) as ctx:
+                began = time.perf_counter()
+                response = worker.send(*scenario(worker))
+                elapsed = time.perf_counter() - began
+            measured.append((elapsed, len(ctx), response.status_code))
+        with lock:
+            samples.extend(measured)
+
+    def drive_in_thread(worker, count):
+        try:
+            drive(worker, count)
+        finally:
+            # Each thread opened its own connection
+            connection.close()
+
+    counts = split(requests, workers)
+    began = time.perf_counter()
+    if len(workers) == 1:
+        drive(workers[0], counts[0])
+    else:
+        with ThreadPoolExecutor(max_workers=len(workers)) as pool:
+            for future in [pool.submit(drive_in_thread, worker, count) for worker, count in zip(workers, counts)]:
+                future.result()
+    return summarize(samples, time.perf_counter() - began)
+
+
+def run_scenario_async(scenario, workers, requests):
+    samples = []
+
+    async def drive(worker, count):
+        for _ in range(count):
+            began = time.perf_counter()
+            response = await worker.asend(*scenario(worker))
+            samples.append((time.perf_counter() - began, None, response.status_code))
+
+    async def drive_all():
+        await asyncio.gather(*(drive(worker, count) for worker, count in zip(workers, split(requests, workers))))
+
+    # Run from a sync context like this, the queries of the async ORM are all made on this thread's connection
+    with override_settings(ROOT_URLCONF=getattr(settings, 'ASGI_URLCONF', settings.ROOT_URLCONF)):
+        with CaptureQueriesContext(connection) as ctx:
+            began = time.perf_counter()
+            async_to_sync(drive_all)()
+            seconds = time.perf_counter() - began
+    result = summarize(samples, seconds)
+    # Requests overlap, so queries are only known in total
+    result['queries_per_request'] = round(len(ctx) / len(samples), 2)
+    return result
+
+
+def hashing_cost(rounds=5):
+    """
+    Time one password hash takes with the preferred hasher and with PBKDF2 (Django's default), on one
+    core, and the logins per second per core that allows. Login throughput is bounded by the hashing
+    pool: about PASSWORD_HASH_WORKERS times this, as far as there are cores for them.
+    """
+    hashers = {}
+    for algorithm in dict.fromkeys(['default', 'pbkdf2_sha256']):
+        hasher = get_hasher(algorithm)
+        hasher.encode(LOGIN_PASSWORD, hasher.salt())  # Warm up
+        began = time.perf_counter()
+        for _ in range(rounds):
+            hasher.encode(LOGIN_PASSWORD, hasher.salt())
+        seconds = (time.perf_counter() - began) / rounds
+        hashers[hasher.algorithm] = {
+            'ms_per_hash': round(seconds * 1000, 1),
+            'hashes_per_second_per_core': round(1 / seconds, 1),
+        }
+    return {'workers': hash_workers(), 'cpus': os.cpu_count(), 'hashers': hashers}
+
+
+def changes(result, previous):
+    """Relative change of p50, p95 and throughput of a scenario result against another one."""
+    def change(new, old):
+        return f"{(new - old) / old * 100:+.1f}%" if old else 'n/a'
+
+    return (
+        f"p50 {change(result['latency_ms']['p50'], previous['latency_ms']['p50'])}, "
+        f"p95 {change(result['latency_ms']['p95'], previous['latency_ms']['p95'])}, "
+        f"req/s {change(result['requests_per_second'], previous['requests_per_second'])}"
+    )
+
+
+def compare(report, baseline):
+    """Yields one line per scenario and server with the relative changes against an earlier report."""
+    # Reports from before the ASGI runs only have WSGI results, under 'scenarios'
+    previous_servers = baseline.get('servers') or {'wsgi': baseline.get('scenarios', {})}
+    for server, scenarios in report['servers'].items():
+        for name, result in scenarios.items():
+            previous = previous_servers.get(server, {}).get(name)
+            if previous is not None:
+                yield f"{name} ({server}): {changes(result, previous)}"
+
+
+def compare_servers(report):
+    """Yields one line per scenario run under both servers, with ASGI relative to WSGI."""
+    servers = report['servers']
+    for name, result in servers.get('asgi', {}).items():
+        if name in servers.get('wsgi', {}):
+            yield f"{name}: asgi vs wsgi {changes(result, servers['wsgi'][name])}"
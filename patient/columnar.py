@@ -0,0 +1,167 @@
+"""
+Compact columnar file format for archived heart rate readings.
+
+A file holds one patient-month split into chunks of up to CHUNK_ROWS readings. Each column of a
+chunk is delta encoded into an `array` and zlib compressed on its own, so near-regular timestamps
+and slowly changing values shrink to a few bytes per reading, and a reader only inflates the
+columns and chunks it needs. Files are read through mmap; the footer index lets a reader skip
+every chunk outside the requested time range without touching it.
+
+Layout (little endian):
+    b'HRC1'                               magic
+    column blobs                          zlib(array) per chunk and column
+    device table                          JSON list of device ids (the device column stores indexes)
+    chunk index                           CHUNK_ENTRY per chunk
+    trailer                               TRAILER
+"""
+import json
+import mmap
+import struct
+import sys
+import zlib
+from array import array
+from datetime import datetime, timedelta, timezone as dt_timezone
+from itertools import accumulate
+
+MAGIC = b'HRC1'
+CHUNK_ROWS = 8192
+# (column, array typecode, delta encoded)
+COLUMNS = (
+    ('timestamp', 'q', True),  # microseconds since the epoch
+    ('id', 'q', True),
+    ('value', 'i', True),
+    ('device', 'H', False),    # index into the device table
+    ('sequence', 'q', True),   # -1 for readings without a sequence
+)
+# first timestamp, last timestamp, rows, then (offset, length) per column
+CHUNK_ENTRY = struct.Struct('<qqI' + 'QI' * len(COLUMNS))
+# device table offset and length, chunk index offset, chunk count, magic
+TRAILER = struct.Struct('<QIQI4s')
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def to_micros(moment):
+    return (moment - EPOCH) // timedelta(microseconds=1)
+
+
+def from_micros(micros):
+    return EPOCH + timedelta(microseconds=micros)
+
+
+def _pack(typecode, values, delta):
+    if delta:
+        previous = 0
+        deltas = []
+        for value in values:
+            deltas.append(value - previous)
+            previous = value
+        values = deltas
+    data = array(typecode, values)
+    if sys.byteorder == 'big':
+        data.byteswap()
+    return zlib.compress(data.tobytes(), 6)
+
+
+def _unpack(typecode, blob, delta):
+    data = array(typecode)
+    data.frombytes(zlib.decompress(blob))
+    if sys.byteorder == 'big':
+        data.byteswap()
+    return list(accumulate(data)) if delta else data
+
+
+def write_chunks(handle, rows):
+    """
+    Writes (id, timestamp, value, device_id, sequence) rows, oldest first, to a binary file handle.
+    Returns (count, first timestamp, last timestamp).
+    """
+    devices = {}
+    index = []
+    count = 0
+    handle.write(MAGIC)
+
+    def flush(chunk):
+        entry = [chunk['timestamp'][0], chunk['timestamp'][-1], len(chunk['timestamp'])]
+        for name, typecode, delta in COLUMNS:
+            blob = _pack(typecode, chunk[name], delta)
+            entry += [handle.tell(), len(blob)]
+            handle.write(blob)
+        index.append(entry)
+
+    chunk = {name: [] for name, _, _ in COLUMNS}
+    for pk, timestamp, value, device_id, sequence in rows:
+        chunk['timestamp'].append(to_micros(timestamp))
+        chunk['id'].append(pk)
+        chunk['value'].append(value)
+        chunk['device'].append(devices.setdefault(device_id, len(devices)))
+        chunk['sequence'].append(-1 if sequence is None else sequence)
+        count += 1
+        if len(chunk['timestamp']) == CHUNK_ROWS:
+            flush(chunk)
+            chunk = {name: [] for name, _, _ in COLUMNS}
+    if chunk['timestamp']:
+        flush(chunk)
+
+    device_table = json.dumps(list(devices)).encode()
+    device_offset = handle.tell()
+    handle.write(device_table)
+    index_offset = handle.tell()
+    for entry in index:
+        handle.write(CHUNK_ENTRY.pack(*entry))
+    handle.write(TRAILER.pack(device_offset, len(device_table), index_offset, len(index), MAGIC))
+
+    if not index:
+        return 0, None, None
+    return count, from_micros(index[0][0]), from_micros(index[-1][1])
+
+
+class ChunkReader:
+    """Memory-mapped reader for a file written by write_chunks. Use as a context manager."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        self._file = open(self.path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._map)
+        device_offset, device_length, index_offset, chunk_count, magic = TRAILER.unpack_from(
+            self._map, len(self._map) - TRAILER.size
+        )
+        if magic != MAGIC or self._map[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{self.path} is not a heart rate archive file")
+        self.devices = json.loads(bytes(self._view[device_offset:device_offset + device_length]))
+        self.chunks = [
+            CHUNK_ENTRY.unpack_from(self._map, index_offset + i * CHUNK_ENTRY.size) for i in range(chunk_count)
+        ]
+        return self
+
+    def __exit__(self, *exc_info):
+        self._view.release()
+        self._map.close()
+        self._file.close()
+
+    def _column(self, entry, position):
+        name, typecode, delta = COLUMNS[position]
+        offset, length = entry[3 + position * 2], entry[4 + position * 2]
+        return _unpack(typecode, self._view[offset:offset + length], delta)
+
+    def rows(self, start=None, end=None, descending=False):
+        """
+        Yields (id, timestamp, value, device_id, sequence) with start <= timestamp <= end,
+        oldest first (or newest first). Chunks outside the range are never decompressed.
+        """
+        low = to_micros(start) if start is not None else None
+        high = to_micros(end) if end is not None else None
+        chunks = reversed(self.chunks) if descending else self.chunks
+        for entry in chunks:
+            first, last = entry[0], entry[1]
+            if (low is not None and last < low) or (high is not None and first > high):
+                continue
+            columns = [self._column(entry, position) for position in range(len(COLUMNS))]
+            rows = zip(*columns)
+            for micros, pk, value, device, sequence in (reversed(list(rows)) if descending else rows):
+                if (low is not None and micros < low) or (high is not None and micros > high):
+                    continue
+                yield pk, from_micros(micros), value, self.devices[device], None if sequence == -1 else sequence
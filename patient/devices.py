@@ -0,0 +1,108 @@
+"""
+Device keys: long-lived API keys that let a monitor post the readings of one patient.
+
+A monitor sends `Authorization: Device <key>` to the device ingest endpoint. The key is checked
+against the SHA-256 hashes of the issued keys through the cache, so a monitor costs no user lookup,
+no token refresh and, once its key is cached, no query before its readings are written. Keys
+are never written to on use. Deleting a key (or its patient) drops it from the cache at once.
+"""
+import hashlib
+import secrets
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework.authentication import BaseAuthentication, get_authorization_header
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.permissions import BasePermission
+from .models import DeviceKey
+
+KEYWORD = 'Device'
+KEY_PREFIX = 'hmd_'
+
+# Stored in the cache for hashes of no key, so a monitor retrying with a deleted key stays cheap
+MISSING = 'missing'
+
+
+def hash_key(key):
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def device_key_key(key_hash):
+    return f'device-key:{key_hash}'
+
+
+def device_key_ttl():
+    # Bounds how long another process may accept a deleted key when caches are not shared
+    return getattr(settings, 'DEVICE_KEY_CACHE_TTL', 300)
+
+
+def issue_key(patient, name):
+    """Creates a DeviceKey for the patient. Returns (device key, key); the key cannot be recovered later."""
+    key = KEY_PREFIX + secrets.token_urlsafe(32)
+    device_key = DeviceKey.objects.create(patient=patient, name=name, prefix=key[:12], key_hash=hash_key(key))
+    return device_key, key
+
+
+def forget_device_key(key_hash):
+    cache.delete(device_key_key(key_hash))
+
+
+def get_device_key_state(key):
+    """
+    Returns {'id', 'patient_id'} of the device key, or None if there is no such key.
+    Served from the cache; a miss costs one query.
+    """
+    key_hash = hash_key(key)
+    cache_key = device_key_key(key_hash)
+    state = cache.get(cache_key)
+    if state is None:
+        state = DeviceKey.objects.filter(key_hash=key_hash).values('id', 'patient_id').first() or MISSING
+        cache.set(cache_key, state, timeout=device_key_ttl())
+    return None if state == MISSING else state
+
+
+class Device:
+    """
+    request.user of a request made with a device key. Not a user: it has no role, so the
+    permission classes of the user endpoints turn it away.
+    """
+    is_authenticated = True
+    is_anonymous = False
+    role = None
+    pk = None
+
+    def __init__(self, state):
+        self.key_id = state['id']
+        self.patient_id = state['patient_id']
+
+
+class DeviceKeyAuthentication(BaseAuthentication):
+    """Authenticates `Authorization: Device <key>`. request.auth is the key's id."""
+
+    def authenticate(self, request):
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != KEYWORD.lower().encode():
+            return None
+        if len(auth) != 2:
+            raise AuthenticationFailed(_("Invalid device key header."))
+        try:
+            key = auth[1].decode()
+        except UnicodeError:
+            raise AuthenticationFailed(_("Invalid device key header."))
+
+        state = get_device_key_state(key)
+        if state is None:
+            raise AuthenticationFailed(_("Invalid device key."), code='invalid_device_key')
+        return Device(state), state['id']
+
+    def authenticate_header(self, request):
+        # Makes unauthenticated requests 401 rather than 403
+        return KEYWORD
+
+
+class IsDevice(BasePermission):
+    """
+    Allows only requests made with a device key
+    """
+    def has_permission(self, request, view):
+        return isinstance(request.user, Device)
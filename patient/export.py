@@ -0,0 +1,78 @@
+import csv
+import heapq
+from itertools import islice
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+
+# Columns written for every exported reading, in order
+EXPORT_FIELDS = ('id', 'timestamp', 'value', 'device_id', 'sequence')
+CHUNK_SIZE = 2000
+
+
+class Echo:
+    """File-like object whose write() hands the line back, so csv.writer can feed a generator."""
+    def write(self, value):
+        return value
+
+
+def export_rows(queryset, archived=()):
+    """
+    Yields reading tuples oldest first, fetched from the database in chunks.
+    `archived` rows (same tuples, oldest first) are merged into the series.
+    """
+    rows = queryset.order_by('timestamp', 'id').values_list(*EXPORT_FIELDS).iterator(chunk_size=CHUNK_SIZE)
+    return heapq.merge(archived, rows, key=lambda row: (row[1], row[0]))
+
+
+async def aexport_rows(queryset, archived=()):
+    """
+    export_rows() for async views. The rows are read on a thread, CHUNK_SIZE at a time, so neither the
+    queries nor the archive files block the event loop, and the history is never held whole.
+    """
+    rows = export_rows(queryset, archived)
+    take = sync_to_async(lambda: list(islice(rows, CHUNK_SIZE)))
+    while chunk := await take():
+        for row in chunk:
+            yield row
+
+
+def ndjson_lines(queryset, archived=()):
+    """Yields one JSON object per reading, newline delimited."""
+    encoder = DjangoJSONEncoder()
+    for row in export_rows(queryset, archived):
+        yield encoder.encode(dict(zip(EXPORT_FIELDS, row))) + '\n'
+
+
+def csv_lines(queryset, archived=()):
+    """Yields a CSV header followed by one line per reading."""
+    writer = csv.writer(Echo())
+    yield writer.writerow(EXPORT_FIELDS)
+    for row in export_rows(queryset, archived):
+        yield writer.writerow(row)
+
+
+async def andjson_lines(queryset, archived=()):
+    """ndjson_lines() for async views."""
+    encoder = DjangoJSONEncoder()
+    async for row in aexport_rows(queryset, archived):
+        yield encoder.encode(dict(zip(EXPORT_FIELDS, row))) + '\n'
+
+
+async def acsv_lines(queryset, archived=()):
+    """csv_lines() for async views."""
+    writer = csv.writer(Echo())
+    yield writer.writerow(EXPORT_FIELDS)
+    async for row in aexport_rows(queryset, archived):
+        yield writer.writerow(row)
+
+
+# Output name -> (line generator, content type, file extension)
+EXPORT_FORMATS = {
+    'ndjson': (ndjson_lines, 'application/x-ndjson', 'ndjson'),
+    'csv': (csv_lines, 'text/csv', 'csv'),
+}
+# Output name -> async line generator, for the async views
+ASYNC_EXPORT_LINES = {
+    'ndjson': andjson_lines,
+    'csv': acsv_lines,
+}
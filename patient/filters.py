@@ -1,5 +1,5 @@
 import django_filters
-from .models import Patient, HeartRate
+from .models import Patient, HeartRate, HeartRateRollup, Alert
 
 class PatientFilter(django_filters.FilterSet):
     class Meta:
@@ -9,6 +9,11 @@ class PatientFilter(django_filters.FilterSet):
             'age': ['exact', 'gte', 'lte'], # Filter by exact age, greater than, or less than
         }
 
+class WardFilter(PatientFilter):
+    # Picks the patients of a ward view: the patient list filters, plus a list of ids and (for HODs) a doctor
+    patients = django_filters.BaseInFilter(field_name='id')
+    doctor = django_filters.NumberFilter(field_name='doctor_id')
+
 class HeartRateFilter(django_filters.FilterSet):
     # Allows filtering heart rates within a date range
     start_date = django_filters.DateFilter(field_name="timestamp", lookup_expr='gte')
@@ -16,4 +21,21 @@ class HeartRateFilter(django_filters.FilterSet):
 
     class Meta:
         model = HeartRate
-        fields = ['start_date', 'end_date', 'value']
\ No newline at end of file
+        fields = ['start_date', 'end_date', 'value']
+
+class HeartRateRollupFilter(django_filters.FilterSet):
+    # Same date range parameters as HeartRateFilter, applied to the bucket start
+    start_date = django_filters.DateFilter(field_name="bucket", lookup_expr='gte')
+    end_date = django_filters.DateFilter(field_name="bucket", lookup_expr='lte')
+
+    class Meta:
+        model = HeartRateRollup
+        fields = ['start_date', 'end_date']
+
+class AlertFilter(django_filters.FilterSet):
+    # Alerts raised at or after this time
+    since = django_filters.IsoDateTimeFilter(field_name="triggered_at", lookup_expr='gte')
+
+    class Meta:
+        model = Alert
+        fields = ['patient', 'kind', 'since']
\ No newline at end of file
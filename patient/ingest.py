@@ -0,0 +1,72 @@
+from django.db import IntegrityError, transaction
+from .alerts import raise_alerts
+from .models import HeartRate
+from .pubsub import publish_readings
+from .response_cache import touch_readings
+from .rollups import update_rollups
+from .vitals import update_vitals
+
+BATCH_SIZE = 500
+INSERT_ATTEMPTS = 3
+
+
+def _key(reading):
+    return (reading.patient_id, reading.device_id, reading.sequence)
+
+
+def drop_replays(readings):
+    """
+    Removes readings whose (patient, device_id, sequence) key is already stored
+    or repeated earlier in the same batch. Readings without a sequence are kept.
+    """
+    keyed = [r for r in readings if r.sequence is not None]
+    if not keyed:
+        return list(readings)
+
+    # One query against the unique index; the IN lists over-select and the set lookup narrows it down
+    stored = set(
+        HeartRate.objects.filter(
+            patient_id__in={r.patient_id for r in keyed},
+            device_id__in={r.device_id for r in keyed},
+            sequence__in={r.sequence for r in keyed},
+        ).values_list('patient_id', 'device_id', 'sequence')
+    )
+
+    fresh = []
+    for reading in readings:
+        if reading.sequence is not None:
+            key = _key(reading)
+            if key in stored:
+                continue
+            stored.add(key)
+        fresh.append(reading)
+    return fresh
+
+
+def store_readings(readings):
+    """
+    Inserts a batch of HeartRate objects in one transaction and returns the ones that were new.
+    Replayed readings are skipped, so devices can safely retry a batch.
+    The minute/hour rollups and alert rules are handled in the same transaction;
+    the latest vitals cache, cached list versions and live subscribers are updated after commit.
+    """
+    for attempt in range(INSERT_ATTEMPTS):
+        fresh = drop_replays(readings)
+        if not fresh:
+            return []
+        try:
+            with transaction.atomic():
+                created = HeartRate.objects.bulk_create(fresh, batch_size=BATCH_SIZE)
+                update_rollups(created)
+                raise_alerts(created)
+                update_vitals(created)
+                transaction.on_commit(lambda: touch_readings(created))
+                transaction.on_commit(lambda: publish_readings(created))
+            return created
+        except IntegrityError:
+            # A concurrent request stored some of these keys after our check. Its rows are
+            # committed by now, so the next pass drops them and we still know exactly what we inserted.
+            if attempt == INSERT_ATTEMPTS - 1:
+                raise
+            for reading in fresh:
+                reading.pk = None
@@ -0,0 +1,27 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from patient.archive import archive_before
+
+
+class Command(BaseCommand):
+    help = (
+        "Moves raw heart rate readings of full months older than the retention period into compressed "
+        "archive files, after compacting them into the minute/hour rollups."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--older-than-days', type=int, default=getattr(settings, 'HEART_RATE_RETENTION_DAYS', 90),
+            help="Archive months that ended more than this many days ago (default: HEART_RATE_RETENTION_DAYS).",
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['older_than_days'])
+        moved = archive_before(cutoff)
+        for (patient_id, month), count in sorted(moved.items()):
+            self.stdout.write(f"patient {patient_id} {month:%Y-%m}: {count} readings")
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {sum(moved.values())} readings from {len(moved)} patient-months before {cutoff:%Y-%m-%d}."
+        ))
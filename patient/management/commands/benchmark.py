@@ -0,0 +1,108 @@
+import json
+import os
+import tempfile
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from patient.benchmark import (
+    SCENARIOS, SERVERS, Worker, compare, compare_servers, hashing_cost, run_scenario, seed,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Seeds a throwaway database with doctors, patients and readings, drives the API endpoints in-process "
+        "with concurrent clients and reports latency percentiles, requests/sec and queries per request as JSON. "
+        "With --server asgi or both, clients also run as tasks on one event loop against the ASGI URLs."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--doctors', type=int, default=4)
+        parser.add_argument('--patients-per-doctor', type=int, default=10)
+        parser.add_argument('--readings', type=int, default=1000, help="Seeded readings per patient.")
+        parser.add_argument('--requests', type=int, default=200, help="Requests per scenario.")
+        parser.add_argument('--concurrency', type=int, default=4, help="Concurrent clients (threads).")
+        parser.add_argument('--batch-size', type=int, default=100, help="Readings per ingest request.")
+        parser.add_argument('--scenario', action='append', dest='scenarios', choices=sorted(SCENARIOS),
+                            help="Scenario to run. Can be repeated. Defaults to all of them.")
+        parser.add_argument('--server', choices=SERVERS + ('both',), default='wsgi',
+                            help="Drive the WSGI views with threads, the ASGI (async) views with tasks, or both.")
+        parser.add_argument('--output', help="Write the JSON report to this file instead of stdout.")
+        parser.add_argument('--compare', help="Earlier JSON report to print relative changes against.")
+
+    def handle(self, *args, **options):
+        if options['doctors'] < 1 or options['patients_per_doctor'] < 1 or options['concurrency'] < 1:
+            raise CommandError("--doctors, --patients-per-doctor and --concurrency must be at least 1.")
+        baseline = None
+        if options['compare']:
+            with open(options['compare']) as handle:
+                baseline = json.load(handle)
+
+        report = self.run(options)
+
+        text = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as handle:
+                handle.write(text + '\n')
+            for server, scenarios in report['servers'].items():
+                for name, result in scenarios.items():
+                    latency = result['latency_ms']
+                    self.stdout.write(
+                        f"{name} ({server}): {result['requests_per_second']} req/s, p50 {latency['p50']} ms, "
+                        f"p95 {latency['p95']} ms, p99 {latency['p99']} ms, "
+                        f"{result['queries_per_request']} queries/req, {result['errors']} errors"
+                    )
+            if 'hashing' in report:
+                for algorithm, cost in report['hashing']['hashers'].items():
+                    self.stdout.write(
+                        f"{algorithm}: {cost['ms_per_hash']} ms/hash, {cost['hashes_per_second_per_core']} "
+                        f"logins/s per core ({report['hashing']['workers']} hash workers)"
+                    )
+        else:
+            self.stdout.write(text)
+        for line in compare_servers(report):
+            self.stdout.write(line)
+        if baseline is not None:
+            for line in compare(report, baseline):
+                self.stdout.write(line)
+
+    def run(self, options):
+        # Never touch the configured database: everything happens in a test database that is dropped afterwards
+        setup_test_environment(debug=False)
+        test_settings = connection.settings_dict.setdefault('TEST', {})
+        if connection.vendor == 'sqlite' and not test_settings.get('NAME'):
+            # An in-memory database would be private to each client thread
+            handle, test_settings['NAME'] = tempfile.mkstemp(suffix='.sqlite3')
+            os.close(handle)
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            assigned = seed(options['doctors'], options['patients_per_doctor'], options['readings'])
+            cache.clear()
+            doctors = list(assigned)
+            workers = [
+                Worker(doctors[i % len(doctors)], assigned[doctors[i % len(doctors)]], options['batch_size'], seed=i)
+                for i in range(options['concurrency'])
+            ]
+            servers = {}
+            for server in SERVERS if options['server'] == 'both' else (options['server'],):
+                servers[server] = {
+                    name: run_scenario(SCENARIOS[name], workers, options['requests'], server)
+                    for name in options['scenarios'] or SCENARIOS
+                }
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        report = {
+            'settings': {
+                key: options[key]
+                for key in ('doctors', 'patients_per_doctor', 'readings', 'requests', 'concurrency', 'batch_size')
+            },
+            'database': connection.vendor,
+            'servers': servers,
+        }
+        if 'login' in (options['scenarios'] or SCENARIOS):
+            # What login throughput is bounded by, to read the login results against
+            report['hashing'] = hashing_cost()
+        return report
@@ -0,0 +1,86 @@
+import json
+from django.core.management.base import BaseCommand
+from heart_monitor.profiling import read_profiles
+from patient.benchmark import percentile
+
+
+class Command(BaseCommand):
+    help = (
+        "Summarizes the request profiles written by heart_monitor.profiling.ProfilingMiddleware: "
+        "slowest routes, the SQL statements taking the most time (with a plan) and the hottest functions."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', help="Profile directory (default: PROFILING_DIR).")
+        parser.add_argument('--route', help="Only requests served by this URL name.")
+        parser.add_argument('--limit', type=int, default=10, help="Entries per section.")
+        parser.add_argument('--json', action='store_true', help="Print the summary as JSON.")
+
+    def handle(self, *args, **options):
+        profiles = [p for p in read_profiles(options['dir']) if not options['route'] or p['route'] == options['route']]
+        summary = summarize(profiles, options['limit'])
+        if options['json']:
+            self.stdout.write(json.dumps(summary, indent=2))
+            return
+
+        self.stdout.write(f"{len(profiles)} profiled requests")
+        self.stdout.write("\nRoutes (by total time):")
+        for row in summary['routes']:
+            self.stdout.write(
+                f"  {row['route']}: {row['requests']} requests, p50 {row['p50_ms']} ms, p95 {row['p95_ms']} ms, "
+                f"{row['queries_per_request']} queries/req"
+            )
+        self.stdout.write("\nSQL (by total time):")
+        for row in summary['queries']:
+            self.stdout.write(
+                f"  {row['total_ms']} ms total, {row['count']}x, max {row['max_ms']} ms: {row['sql'][:200]}"
+            )
+            for line in row['explain'] or []:
+                self.stdout.write(f"      {line}")
+        self.stdout.write("\nFunctions (by cumulative time):")
+        for row in summary['functions']:
+            self.stdout.write(f"  {row['cumulative_ms']} ms cumulative, {row['calls']} calls: {row['function']}")
+
+
+def summarize(profiles, limit):
+    routes = {}
+    queries = {}
+    functions = {}
+    for profile in profiles:
+        route = routes.setdefault(profile['route'], {'durations': [], 'queries': 0})
+        route['durations'].append(profile['duration_ms'])
+        route['queries'] += len(profile['queries'])
+        for query in profile['queries']:
+            # Django passes SQL with placeholders, so statements group without normalizing literals
+            entry = queries.setdefault(query['sql'], {'count': 0, 'total_ms': 0, 'max_ms': 0, 'explain': None})
+            entry['count'] += 1
+            entry['total_ms'] += query['duration_ms']
+            entry['max_ms'] = max(entry['max_ms'], query['duration_ms'])
+            entry['explain'] = query.get('explain') or entry['explain']
+        for function in profile['functions']:
+            entry = functions.setdefault(function['function'], {'calls': 0, 'cumulative_ms': 0})
+            entry['calls'] += function['calls']
+            entry['cumulative_ms'] += function['cumulative_ms']
+
+    route_rows = []
+    for name, route in routes.items():
+        durations = sorted(route['durations'])
+        route_rows.append({
+            'route': name,
+            'requests': len(durations),
+            'total_ms': round(sum(durations), 3),
+            'p50_ms': round(percentile(durations, 0.50), 3),
+            'p95_ms': round(percentile(durations, 0.95), 3),
+            'queries_per_request': round(route['queries'] / len(durations), 2),
+        })
+    return {
+        'routes': sorted(route_rows, key=lambda row: row['total_ms'], reverse=True)[:limit],
+        'queries': sorted(
+            ({'sql': sql, **entry, 'total_ms': round(entry['total_ms'], 3)} for sql, entry in queries.items()),
+            key=lambda row: row['total_ms'], reverse=True,
+        )[:limit],
+        'functions': sorted(
+            ({'function': name, **entry, 'cumulative_ms': round(entry['cumulative_ms'], 3)} for name, entry in functions.items()),
+            key=lambda row: row['cumulative_ms'], reverse=True,
+        )[:limit],
+    }
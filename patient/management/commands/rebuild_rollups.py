@@ -0,0 +1,43 @@
+from datetime import datetime, time
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from patient.rollups import rebuild_rollups
+
+
+def parse_day_or_time(value):
+    """Accepts an ISO date (midnight UTC) or an ISO datetime."""
+    try:
+        moment = datetime.fromisoformat(value)
+    except ValueError:
+        raise CommandError(f"Invalid date or datetime: {value!r}")
+    if len(value) == 10:
+        moment = datetime.combine(moment.date(), time.min)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+class Command(BaseCommand):
+    help = (
+        "Recomputes the per-minute and per-hour heart rate rollups from raw readings for a time window. "
+        "Archived patient-months keep their rollups."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', required=True, help="Start of the window (ISO date or datetime).")
+        parser.add_argument('--end', help="End of the window, exclusive (ISO date or datetime). Defaults to now.")
+        parser.add_argument('--patient', type=int, action='append', dest='patients',
+                            help="Only rebuild this patient id. Can be repeated.")
+
+    def handle(self, *args, **options):
+        start = parse_day_or_time(options['start'])
+        end = parse_day_or_time(options['end']) if options['end'] else timezone.now()
+        if end <= start:
+            raise CommandError("--end must be after --start.")
+
+        written = rebuild_rollups(start, end, patient_ids=options['patients'])
+        for model, count in written.items():
+            self.stdout.write(f"{model.__name__}: {count} rows")
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt rollups from {start:%Y-%m-%d %H:%M} to {end:%Y-%m-%d %H:%M}."
+        ))
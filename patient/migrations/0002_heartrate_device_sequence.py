@@ -0,0 +1,41 @@
+# Generated by Django 5.2.6 on 2026-10-18 15:27
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patient', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='heartrate',
+            options={'ordering': ['-timestamp']},
+        ),
+        migrations.AlterModelOptions(
+            name='patient',
+            options={'ordering': ['id']},
+        ),
+        migrations.AddField(
+            model_name='heartrate',
+            name='device_id',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='heartrate',
+            name='sequence',
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='heartrate',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddConstraint(
+            model_name='heartrate',
+            constraint=models.UniqueConstraint(fields=('patient', 'device_id', 'sequence'), name='unique_heartrate_device_sequence'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.6 on 2026-10-18 15:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patient', '0002_heartrate_device_sequence'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='heartrate',
+            index=models.Index(fields=['patient', '-timestamp'], name='heartrate_patient_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='heartrate',
+            index=models.Index(fields=['patient', '-timestamp', 'value'], name='heartrate_patient_ts_value_idx'),
+        ),
+        migrations.AlterField(
+            model_name='heartrate',
+            name='patient',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='heart_rates', to='patient.patient'),
+        ),
+    ]
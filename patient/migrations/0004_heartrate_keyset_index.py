@@ -0,0 +1,21 @@
+# Generated by Django 5.2.6 on 2026-10-18 15:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patient', '0003_heartrate_patient_timestamp_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='heartrate',
+            name='heartrate_patient_ts_idx',
+        ),
+        migrations.AddIndex(
+            model_name='heartrate',
+            index=models.Index(fields=['patient', '-timestamp', '-id'], name='heartrate_patient_ts_idx'),
+        ),
+    ]
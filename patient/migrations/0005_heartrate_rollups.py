@@ -0,0 +1,48 @@
+# Generated by Django 5.2.6 on 2026-10-18 15:33
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patient', '0004_heartrate_keyset_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HeartRateHour',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.DateTimeField()),
+                ('min_value', models.PositiveIntegerField()),
+                ('max_value', models.PositiveIntegerField()),
+                ('total', models.PositiveBigIntegerField()),
+                ('count', models.PositiveIntegerField()),
+                ('patient', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='patient.patient')),
+            ],
+            options={
+                'ordering': ['bucket'],
+                'abstract': False,
+                'constraints': [models.UniqueConstraint(fields=('patient', 'bucket'), name='heartratehour_unique_patient_bucket')],
+            },
+        ),
+        migrations.CreateModel(
+            name='HeartRateMinute',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.DateTimeField()),
+                ('min_value', models.PositiveIntegerField()),
+                ('max_value', models.PositiveIntegerField()),
+                ('total', models.PositiveBigIntegerField()),
+                ('count', models.PositiveIntegerField()),
+                ('patient', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='patient.patient')),
+            ],
+            options={
+                'ordering': ['bucket'],
+                'abstract': False,
+                'constraints': [models.UniqueConstraint(fields=('patient', 'bucket'), name='heartrateminute_unique_patient_bucket')],
+            },
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.2.6 on 2026-10-18 15:42
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patient', '0005_heartrate_rollups'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AlertRule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('min_value', models.PositiveIntegerField(blank=True, null=True)),
+                ('max_value', models.PositiveIntegerField(blank=True, null=True)),
+                ('sustained_seconds', models.PositiveIntegerField(default=0)),
+                ('max_change_per_minute', models.PositiveIntegerField(blank=True, null=True)),
+                ('is_active', models.BooleanField(default=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('doctor', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='alert_rules', to=settings.AUTH_USER_MODEL)),
+                ('patient', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='alert_rules', to='patient.patient')),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Alert',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('HIGH', 'high'), ('LOW', 'low'), ('RATE', 'rate of change')], max_length=10)),
+                ('value', models.PositiveIntegerField()),
+                ('triggered_at', models.DateTimeField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('patient', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='alerts', to='patient.patient')),
+                ('rule', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='alerts', to='patient.alertrule')),
+            ],
+            options={
+                'ordering': ['-triggered_at'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='alertrule',
+            constraint=models.CheckConstraint(condition=models.Q(models.Q(('doctor__isnull', True), ('patient__isnull', False)), models.Q(('doctor__isnull', False), ('patient__isnull', True)), _connector='OR'), name='alertrule_patient_or_doctor'),
+        ),
+        migrations.AddIndex(
+            model_name='alert',
+            index=models.Index(fields=['patient', '-triggered_at'], name='alert_patient_triggered_idx'),
+        ),
+    ]
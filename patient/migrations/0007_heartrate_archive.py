@@ -0,0 +1,31 @@
+# Generated by Django 5.2.6 on 2026-10-18 15:49
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patient', '0006_alerts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HeartRateArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('path', models.CharField(max_length=255)),
+                ('count', models.PositiveIntegerField()),
+                ('first_timestamp', models.DateTimeField()),
+                ('last_timestamp', models.DateTimeField()),
+                ('created_at', models.DateTimeField(auto_now=True)),
+                ('patient', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='heart_rate_archives', to='patient.patient')),
+            ],
+            options={
+                'ordering': ['patient', 'month'],
+                'constraints': [models.UniqueConstraint(fields=('patient', 'month'), name='unique_heartrate_archive_month')],
+            },
+        ),
+    ]
@@ -1,5 +1,6 @@
 from django.db import models
 from django.conf import settings
+from django.utils import timezone
 
 # Create your models here.
 User = settings.AUTH_USER_MODEL
@@ -34,15 +35,174 @@ class HeartRate(models.Model):
     patient = models.ForeignKey(
         Patient,
         on_delete=models.CASCADE,
-        related_name="heart_rates"
+        related_name="heart_rates",
+        db_index=False, # Covered by the composite indexes below, which all start with patient
     )
     value = models.PositiveIntegerField()
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Measured by the device; falls back to arrival time when the device does not send it
+    timestamp = models.DateTimeField(default=timezone.now)
+    # Together with the patient, (device_id, sequence) identifies a reading so replays can be dropped
+    device_id = models.CharField(max_length=64, blank=True, default='')
+    sequence = models.PositiveBigIntegerField(null=True, blank=True)
 
     class Meta:
         ordering = ['-timestamp']
+        constraints = [
+            # NULL sequences never collide, so readings without a key are always stored
+            models.UniqueConstraint(
+                fields=['patient', 'device_id', 'sequence'],
+                name='unique_heartrate_device_sequence',
+            ),
+        ]
+        indexes = [
+            # History queries filter on patient and a time range and page newest first on (timestamp, id)
+            models.Index(fields=['patient', '-timestamp', '-id'], name='heartrate_patient_ts_idx'),
+            # Covering variant so charts can read values for a time range from the index alone
+            models.Index(fields=['patient', '-timestamp', 'value'], name='heartrate_patient_ts_value_idx'),
+        ]
         
     def __str__(self):
         return f"{self.patient.full_name}-{self.value}"
 
 
+class HeartRateRollup(models.Model):
+    """Pre-aggregated heart rate readings of one patient over one time bucket"""
+    patient = models.ForeignKey(
+        Patient,
+        on_delete=models.CASCADE,
+        related_name="+",
+        db_index=False, # Covered by the (patient, bucket) unique constraint
+    )
+    bucket = models.DateTimeField() # Start of the bucket (UTC)
+    min_value = models.PositiveIntegerField()
+    max_value = models.PositiveIntegerField()
+    total = models.PositiveBigIntegerField() # Sum of values, so averages can be combined across buckets
+    count = models.PositiveIntegerField()
+
+    class Meta:
+        abstract = True
+        ordering = ['bucket']
+        constraints = [
+            models.UniqueConstraint(fields=['patient', 'bucket'], name='%(class)s_unique_patient_bucket'),
+        ]
+
+    def __str__(self):
+        return f"{self.patient_id}-{self.bucket:%Y-%m-%d %H:%M}"
+
+class HeartRateMinute(HeartRateRollup):
+    """Per-minute heart rate rollup"""
+
+class HeartRateHour(HeartRateRollup):
+    """Per-hour heart rate rollup"""
+
+class AlertRule(models.Model):
+    """Heart rate thresholds checked against every incoming reading"""
+    # A rule applies either to one patient or to every patient of one doctor
+    patient = models.ForeignKey(
+        Patient,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name="alert_rules"
+    )
+    doctor = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name="alert_rules"
+    )
+    name = models.CharField(max_length=100)
+    min_value = models.PositiveIntegerField(null=True, blank=True) # Bradycardia below this
+    max_value = models.PositiveIntegerField(null=True, blank=True) # Tachycardia above this
+    sustained_seconds = models.PositiveIntegerField(default=0) # How long a breach must last before it alerts
+    max_change_per_minute = models.PositiveIntegerField(null=True, blank=True) # Largest allowed swing within a minute
+    is_active = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['id']
+        constraints = [
+            models.CheckConstraint(
+                condition=models.Q(patient__isnull=False, doctor__isnull=True)
+                | models.Q(patient__isnull=True, doctor__isnull=False),
+                name='alertrule_patient_or_doctor',
+            ),
+        ]
+
+    def __str__(self):
+        return self.name
+
+class Alert(models.Model):
+    """A rule breach raised while ingesting readings"""
+    class Kind(models.TextChoices):
+        HIGH = "HIGH","high"
+        LOW = "LOW","low"
+        RATE = "RATE","rate of change"
+    rule = models.ForeignKey(
+        AlertRule,
+        on_delete=models.SET_NULL,
+        null=True,
+        related_name="alerts"
+    )
+    patient = models.ForeignKey(
+        Patient,
+        on_delete=models.CASCADE,
+        related_name="alerts",
+        db_index=False, # Covered by the (patient, -triggered_at) index
+    )
+    kind = models.CharField(max_length=10, choices=Kind.choices)
+    value = models.PositiveIntegerField() # The reading that raised the alert
+    triggered_at = models.DateTimeField() # Timestamp of that reading
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-triggered_at']
+        indexes = [
+            models.Index(fields=['patient', '-triggered_at'], name='alert_patient_triggered_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.patient_id}-{self.kind}-{self.value}"
+
+class HeartRateArchive(models.Model):
+    """One month of a patient's raw readings moved out of the HeartRate table into a file"""
+    patient = models.ForeignKey(
+        Patient,
+        on_delete=models.CASCADE,
+        related_name="heart_rate_archives",
+        db_index=False, # Covered by the (patient, month) unique constraint
+    )
+    month = models.DateField() # First day of the archived month (UTC)
+    path = models.CharField(max_length=255) # Relative to settings.HEART_RATE_ARCHIVE_DIR
+    count = models.PositiveIntegerField()
+    first_timestamp = models.DateTimeField()
+    last_timestamp = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['patient', 'month']
+        constraints = [
+            models.UniqueConstraint(fields=['patient', 'month'], name='unique_heartrate_archive_month'),
+        ]
+
+    def __str__(self):
+        return f"{self.patient_id}-{self.month:%Y-%m}"
+
+class DeviceKey(models.Model):
+    """A long-lived API key a monitor uses to post the readings of one patient"""
+    patient = models.ForeignKey(
+        Patient,
+        on_delete=models.CASCADE,
+        related_name="device_keys"
+    )
+    name = models.CharField(max_length=100) # Which monitor holds the key
+    prefix = models.CharField(max_length=12) # Start of the key, to tell keys apart; the key itself is not stored
+    key_hash = models.CharField(max_length=64, unique=True) # SHA-256 of the key, hex
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['id']
+
+    def __str__(self):
+        return f"{self.name} ({self.prefix}...)"
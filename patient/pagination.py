@@ -0,0 +1,133 @@
+import heapq
+from base64 import b64decode, b64encode
+from itertools import islice
+from django.core.paginator import InvalidPage
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination
+from rest_framework.utils.urls import replace_query_param
+
+class HeartRateCursorPagination(CursorPagination):
+    """
+    Keyset pagination for heart rate history.
+    Each page continues from the last (timestamp, id) seen instead of using OFFSET,
+    and no COUNT(*) is run, so deep pages cost the same as the first one.
+    When the view has an `archived_readings(position, backwards)` method, archived readings
+    are merged in, so the history carries on past what is left in the HeartRate table.
+    """
+    ordering = ('-timestamp', '-id')
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+    def paginate_queryset(self, queryset, request, view=None):
+        queryset = self.page_queryset(queryset, request)
+        if queryset is None:
+            return None
+        return self.build_page(list(queryset), view)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """paginate_queryset() for async views; archived readings come from the view as usual."""
+        queryset = self.page_queryset(queryset, request)
+        if queryset is None:
+            return None
+        return self.build_page([reading async for reading in queryset.aiterator()], view)
+
+    def page_queryset(self, queryset, request):
+        """The query for one page past the cursor, plus one row to tell whether there is more."""
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.backwards, self.position = self.decode_position(request)
+
+        if self.position is not None:
+            timestamp, pk = self.position
+            # The plain range bound keeps this an index range scan; the OR settles ties on timestamp
+            if self.backwards:
+                queryset = queryset.filter(timestamp__gte=timestamp).filter(
+                    Q(timestamp__gt=timestamp) | Q(timestamp=timestamp, id__gt=pk)
+                )
+            else:
+                queryset = queryset.filter(timestamp__lte=timestamp).filter(
+                    Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=pk)
+                )
+        ordering = ('timestamp', 'id') if self.backwards else self.ordering
+        return queryset.order_by(*ordering)[:self.page_size + 1]
+
+    def build_page(self, rows, view=None):
+        fetch = self.page_size + 1
+        archived_readings = getattr(view, 'archived_readings', None)
+        if archived_readings is not None:
+            archived = islice(archived_readings(self.position, self.backwards), fetch)
+            rows = list(islice(
+                heapq.merge(rows, archived, key=lambda r: (r.timestamp, r.pk), reverse=not self.backwards), fetch
+            ))
+
+        has_more = len(rows) > self.page_size
+        self.page = rows[:self.page_size]
+        if self.backwards:
+            self.page.reverse()
+        # Moving back from a cursor there is always something newer; moving forward, something older
+        self.has_next = has_more if not self.backwards else bool(self.page)
+        self.has_previous = has_more if self.backwards else self.position is not None and bool(self.page)
+        return self.page
+
+    def decode_position(self, request):
+        """Returns (backwards, (timestamp, id) or None) from the cursor query parameter."""
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return False, None
+        try:
+            direction, timestamp, pk = b64decode(encoded.encode(), altchars=b'-_').decode().split('|')
+            position = (parse_datetime(timestamp), int(pk))
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if direction not in ('n', 'p') or position[0] is None:
+            raise NotFound(self.invalid_cursor_message)
+        return direction == 'p', position
+
+    def encode_position(self, reading, backwards):
+        raw = f"{'p' if backwards else 'n'}|{reading.timestamp.isoformat()}|{reading.pk}"
+        return replace_query_param(
+            self.base_url, self.cursor_query_param, b64encode(raw.encode(), altchars=b'-_').decode()
+        )
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return self.encode_position(self.page[-1], backwards=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        return self.encode_position(self.page[0], backwards=True)
+
+    def get_html_context(self):
+        return {'previous_url': self.get_previous_link(), 'next_url': self.get_next_link()}
+
+
+async def apaginate_by_page_number(paginator, queryset, request):
+    """
+    PageNumberPagination.paginate_queryset() for async views: the count and the page rows are read
+    with the async ORM, and the paginator is left ready for get_paginated_response().
+    """
+    page_size = paginator.get_page_size(request)
+    if not page_size:
+        return None
+
+    django_paginator = paginator.django_paginator_class(queryset, page_size)
+    # `count` is a cached property; filling it in keeps page() from running the query itself
+    django_paginator.count = await queryset.acount()
+    page_number = paginator.get_page_number(request, django_paginator)
+    try:
+        paginator.page = django_paginator.page(page_number)
+    except InvalidPage as exc:
+        raise NotFound(paginator.invalid_page_message.format(page_number=page_number, message=str(exc)))
+    paginator.page.object_list = [row async for row in paginator.page.object_list.aiterator()]
+    paginator.request = request
+    if paginator.template is not None and paginator.page.paginator.num_pages > 1:
+        paginator.display_page_controls = True
+    return list(paginator.page)
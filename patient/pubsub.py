@@ -0,0 +1,97 @@
+import asyncio
+import threading
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+DEFAULT_BROKER = 'patient.pubsub.InProcessBroker'
+
+
+class Subscription:
+    """
+    A listener for the readings of a set of patients.
+    Messages are queued on the event loop that created the subscription.
+    """
+    def __init__(self, patient_ids, max_queued=1000):
+        self.patient_ids = frozenset(patient_ids)
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=max_queued)
+        self.dropped = 0
+
+    def offer(self, message):
+        # Runs on the subscriber's loop. A client that cannot keep up loses readings rather than stalling ingest.
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    async def get(self):
+        return await self.queue.get()
+
+
+class InProcessBroker:
+    """
+    Fans out published readings to the subscribers of this process.
+    publish() is thread safe, so sync ingest code can call it while subscribers wait on an ASGI event loop.
+    Another broker (e.g. one backed by a local Redis) only needs the same subscribe/unsubscribe/publish methods.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_patient = {}
+
+    def subscribe(self, patient_ids):
+        subscription = Subscription(patient_ids)
+        with self._lock:
+            for patient_id in subscription.patient_ids:
+                self._by_patient.setdefault(patient_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for patient_id in subscription.patient_ids:
+                listeners = self._by_patient.get(patient_id)
+                if listeners is not None:
+                    listeners.discard(subscription)
+                    if not listeners:
+                        del self._by_patient[patient_id]
+
+    def subscriber_count(self):
+        with self._lock:
+            return len({sub for listeners in self._by_patient.values() for sub in listeners})
+
+    def publish(self, patient_id, message):
+        with self._lock:
+            listeners = list(self._by_patient.get(patient_id, ()))
+        for subscription in listeners:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.offer, message)
+            except RuntimeError:
+                # The subscriber's loop has shut down
+                self.unsubscribe(subscription)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    """Returns the process-wide broker configured by settings.HEART_RATE_BROKER."""
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                _broker = import_string(getattr(settings, 'HEART_RATE_BROKER', DEFAULT_BROKER))()
+    return _broker
+
+
+def publish_readings(readings):
+    """Pushes newly stored readings to everyone subscribed to their patient."""
+    broker = get_broker()
+    for reading in readings:
+        broker.publish(reading.patient_id, {
+            'id': reading.pk,
+            'patient': reading.patient_id,
+            'value': reading.value,
+            'timestamp': reading.timestamp.isoformat(),
+            'device_id': reading.device_id,
+            'sequence': reading.sequence,
+        })
@@ -0,0 +1,150 @@
+"""
+Cached list responses with conditional GET, for dashboards that poll lists which rarely change.
+
+A list depends on version counters named by its view (cache_version_names). A counter holds the time of
+the last write it covers, in nanoseconds, and is bumped once that write commits:
+- 'patients': any patient created, changed or deleted.
+- 'patient:<id>': a patient changed, or readings stored or archived for them.
+- 'doctor:<id>' and 'readings': readings stored for a patient of that doctor, and for any patient.
+
+A GET of a list then gets, in order of preference:
+- 304 Not Modified, when its If-None-Match matches the current versions.
+  Answered from the cache alone, without a query.
+- The data of an earlier identical request by the same user, while the versions have not moved.
+- The list as usual, which is cached for RESPONSE_CACHE_TTL seconds (not at all with 0).
+Counters expire after RESPONSE_CACHE_VERSION_TTL seconds, and start again from the current time. That
+bounds how long a process whose cache missed a write (when caches are not shared) serves lists from
+before it.
+Responses are private to the user (Cache-Control), and revalidated on every poll. They carry no
+Last-Modified: a date has whole seconds, so a write in the same second as a poll would not move it on.
+"""
+import time
+from hashlib import md5
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+from .access import AccessScope
+
+
+def version_key(name):
+    return f'data-version:{name}'
+
+
+def response_key(etag):
+    return f'response:{etag}'
+
+
+def response_cache_ttl():
+    return getattr(settings, 'RESPONSE_CACHE_TTL', 300)
+
+
+def response_cache_version_ttl():
+    return getattr(settings, 'RESPONSE_CACHE_VERSION_TTL', 60)
+
+
+def bump_versions(names):
+    now = time.time_ns()
+    cache.set_many({version_key(name): now for name in names}, timeout=response_cache_version_ttl())
+
+
+def _take_versions(names, cached):
+    versions = {name: cached.get(version_key(name)) for name in names}
+    # Never written, or evicted: starting from now makes every response cached before it stale
+    missing = {name: time.time_ns() for name, version in versions.items() if version is None}
+    return {**versions, **missing}, {version_key(name): version for name, version in missing.items()}
+
+
+def get_versions(names):
+    """Returns {name: version} for the named counters, starting the ones the cache does not have."""
+    versions, started = _take_versions(names, cache.get_many([version_key(name) for name in names]))
+    if started:
+        cache.set_many(started, timeout=response_cache_version_ttl())
+    return versions
+
+
+async def aget_versions(names):
+    """get_versions() for async views, through the async cache API."""
+    versions, started = _take_versions(names, await cache.aget_many([version_key(name) for name in names]))
+    if started:
+        await cache.aset_many(started, timeout=response_cache_version_ttl())
+    return versions
+
+
+def touch_readings(readings):
+    """Bumps the versions covering a batch of stored readings. Their doctors are read with one query."""
+    patient_ids = {reading.patient_id for reading in readings}
+    owners = AccessScope(None).owners(patient_ids)
+    doctor_ids = {owner[0] for owner in owners.values() if owner is not None}
+    bump_versions(
+        [f'patient:{pk}' for pk in patient_ids] + [f'doctor:{pk}' for pk in doctor_ids] + ['readings']
+    )
+
+
+class CachedListMixin:
+    """
+    Serves list() from the response cache, with an ETag (see patient.response_cache).
+    Views set cache_version_names, the names of the version counters their list depends on, formatted
+    with the URL kwargs and `user`; or override cache_versions() when the names take more than that.
+    """
+    cache_version_names = None
+
+    def cache_versions(self):
+        assert self.cache_version_names is not None, (
+            f"'{self.__class__.__name__}' should either include a `cache_version_names` attribute, "
+            "or override the `cache_versions()` method."
+        )
+        return [name.format(user=self.request.user, **self.kwargs) for name in self.cache_version_names]
+
+    def list(self, request, *args, **kwargs):
+        etag = self.etag(request, get_versions(self.cache_versions()))
+        response = self.not_modified(request, etag)
+        if response is None:
+            data = cache.get(response_key(etag))
+            if data is not None:
+                response = Response(data)
+            else:
+                response = super().list(request, *args, **kwargs)
+                if self.cacheable(response):
+                    cache.set(response_key(etag), response.data, timeout=response_cache_ttl())
+        return self.with_etag(response, etag)
+
+    async def alist(self, request, compute):
+        """list() for async views, with `compute` the coroutine function building the response on a miss."""
+        etag = self.etag(request, await aget_versions(self.cache_versions()))
+        response = self.not_modified(request, etag)
+        if response is None:
+            data = await cache.aget(response_key(etag))
+            if data is not None:
+                response = Response(data)
+            else:
+                response = await compute()
+                if self.cacheable(response):
+                    await cache.aset(response_key(etag), response.data, timeout=response_cache_ttl())
+        return self.with_etag(response, etag)
+
+    def etag(self, request, versions):
+        """ETag of the list for this user, URL, format and versions."""
+        identity = (
+            f"{request.user.pk}:{request.accepted_renderer.format}:{request.get_full_path()}:"
+            f"{sorted(versions.items())}"
+        )
+        return quote_etag(md5(identity.encode(), usedforsecurity=False).hexdigest())
+
+    def not_modified(self, request, etag):
+        conditional = get_conditional_response(request, etag=etag)
+        if conditional is not None:
+            return Response(status=conditional.status_code)
+        return None
+
+    def cacheable(self, response):
+        # A TTL of 0 keeps conditional GET but always builds the list
+        return response.status_code == status.HTTP_200_OK and response_cache_ttl() > 0
+
+    def with_etag(self, response, etag):
+        response['ETag'] = etag
+        # Per user, so no shared cache may keep it; browsers revalidate it on every poll
+        response['Cache-Control'] = 'private, no-cache'
+        return response
@@ -0,0 +1,122 @@
+from datetime import timedelta
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Max, Min, Sum, Value
+from django.db.models.functions import Greatest, Least, TruncHour, TruncMinute
+from .aggregation import floor_time, month_start, next_month
+from .models import HeartRate, HeartRateArchive, HeartRateMinute, HeartRateHour
+
+# Rollup model -> (database truncation, bucket width)
+ROLLUPS = {
+    HeartRateMinute: (TruncMinute, timedelta(minutes=1)),
+    HeartRateHour: (TruncHour, timedelta(hours=1)),
+}
+
+
+def _fold(readings, width):
+    """Groups readings into {(patient_id, bucket): [min, max, sum, count]}."""
+    groups = {}
+    for reading in readings:
+        key = (reading.patient_id, floor_time(reading.timestamp, width))
+        stats = groups.get(key)
+        if stats is None:
+            groups[key] = [reading.value, reading.value, reading.value, 1]
+        else:
+            stats[0] = min(stats[0], reading.value)
+            stats[1] = max(stats[1], reading.value)
+            stats[2] += reading.value
+            stats[3] += 1
+    return groups
+
+
+def _merge_into(model, patient_id, bucket, low, high, total, count):
+    """Adds one bucket's stats to an existing rollup row with a single UPDATE, creating it if missing."""
+    rows = model.objects.filter(patient_id=patient_id, bucket=bucket)
+    changes = dict(
+        min_value=Least(F('min_value'), Value(low)),
+        max_value=Greatest(F('max_value'), Value(high)),
+        total=F('total') + total,
+        count=F('count') + count,
+    )
+    if rows.update(**changes):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(
+                patient_id=patient_id, bucket=bucket,
+                min_value=low, max_value=high, total=total, count=count,
+            )
+    except IntegrityError:
+        # Another writer created the row first
+        rows.update(**changes)
+
+
+def update_rollups(readings):
+    """
+    Folds newly stored readings into the minute and hour rollups.
+    A batch of per-second readings touches only a handful of buckets, so this is a few UPDATEs per batch.
+    """
+    for model, (_, width) in ROLLUPS.items():
+        for (patient_id, bucket), stats in _fold(readings, width).items():
+            _merge_into(model, patient_id, bucket, *stats)
+
+
+def archived_months(start, end, patient_ids=None):
+    """Returns {(month start, next month start): [patient_id]} for the archived patient-months overlapping [start, end)."""
+    archives = HeartRateArchive.objects.filter(month__gte=month_start(start).date(), month__lte=end.date())
+    if patient_ids is not None:
+        archives = archives.filter(patient_id__in=patient_ids)
+    months = {}
+    for patient_id, month in archives.values_list('patient_id', 'month'):
+        begins = month_start(month)
+        months.setdefault((begins, next_month(begins)), []).append(patient_id)
+    return months
+
+
+def _excluding(queryset, field, months):
+    for (begins, ends), patient_ids in months.items():
+        queryset = queryset.exclude(**{f'{field}__gte': begins, f'{field}__lt': ends, 'patient_id__in': patient_ids})
+    return queryset
+
+
+def rebuild_rollups(start, end, patient_ids=None):
+    """
+    Recomputes the rollups for [start, end) from raw readings. The window is widened to whole hours.
+    Archived patient-months are left as they are: their raw readings are gone, and their rollups are all
+    that is left of them in the database (late readings are folded in on ingest).
+    Returns {model: rows written}.
+    """
+    start = floor_time(start, timedelta(hours=1))
+    end = floor_time(end + timedelta(hours=1) - timedelta(microseconds=1), timedelta(hours=1))
+    archived = archived_months(start, end, patient_ids)
+
+    readings = _excluding(HeartRate.objects.filter(timestamp__gte=start, timestamp__lt=end), 'timestamp', archived)
+    if patient_ids is not None:
+        readings = readings.filter(patient_id__in=patient_ids)
+
+    written = {}
+    with transaction.atomic():
+        for model, (trunc, _) in ROLLUPS.items():
+            stale = _excluding(model.objects.filter(bucket__gte=start, bucket__lt=end), 'bucket', archived)
+            if patient_ids is not None:
+                stale = stale.filter(patient_id__in=patient_ids)
+            stale.delete()
+
+            rows = (
+                readings.order_by()
+                .annotate(start=trunc('timestamp'))
+                .values('patient_id', 'start')
+                .annotate(low=Min('value'), high=Max('value'), sum=Sum('value'), n=Count('id'))
+                .values_list('patient_id', 'start', 'low', 'high', 'sum', 'n')
+            )
+            written[model] = 0
+            batch = []
+            for patient_id, bucket, low, high, total, count in rows.iterator(chunk_size=2000):
+                batch.append(model(
+                    patient_id=patient_id, bucket=bucket,
+                    min_value=low, max_value=high, total=total, count=count,
+                ))
+                if len(batch) == 1000:
+                    written[model] += len(model.objects.bulk_create(batch))
+                    batch = []
+            written[model] += len(model.objects.bulk_create(batch))
+    return written
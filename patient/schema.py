@@ -0,0 +1,14 @@
+from drf_spectacular.extensions import OpenApiAuthenticationExtension
+
+
+class DeviceKeyScheme(OpenApiAuthenticationExtension):
+    target_class = 'patient.devices.DeviceKeyAuthentication'
+    name = 'deviceKey'
+
+    def get_security_definition(self, auto_schema):
+        return {
+            'type': 'apiKey',
+            'in': 'header',
+            'name': 'Authorization',
+            'description': 'Device key issued for one patient, sent as "Device <key>".',
+        }
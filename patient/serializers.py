@@ -1,16 +1,100 @@
+from drf_spectacular.utils import extend_schema_field
 from rest_framework import serializers
-from .models import Patient, HeartRate
+from users.models import CustomUser
+from .models import Patient, HeartRate, AlertRule, Alert, DeviceKey
+from .devices import issue_key
+from .ingest import store_readings
+from .vitals import get_latest_vitals
+
+class HeartRateListSerializer(serializers.ListSerializer):
+    """
+    Writes a whole batch of readings with a single bulk INSERT.
+    Readings already stored under the same device/sequence key are skipped.
+    """
+    def create(self, validated_data):
+        return store_readings([HeartRate(**item) for item in validated_data])
 
 class HeartRateSerializer(serializers.ModelSerializer):
     class Meta:
         model = HeartRate
-        fields = ['id', 'patient', 'value', 'timestamp']
+        fields = ['id', 'patient', 'value', 'timestamp', 'device_id', 'sequence']
         read_only_fields = ['patient'] # Patient is set automatically from the URL
+        list_serializer_class = HeartRateListSerializer
+        validators = [] # Replays are dropped on insert instead of a lookup per reading
+
+    def create(self, validated_data):
+        reading = HeartRate(**validated_data)
+        if store_readings([reading]):
+            return reading
+        # A replay of a stored reading: answer with the original
+        return HeartRate.objects.get(
+            patient_id=reading.patient_id, device_id=reading.device_id, sequence=reading.sequence
+        )
+
+class BulkHeartRateSerializer(serializers.ModelSerializer):
+    # Plain id instead of PrimaryKeyRelatedField, so a batch does not look up every patient row
+    patient = serializers.IntegerField(source='patient_id')
+
+    class Meta:
+        model = HeartRate
+        fields = ['id', 'patient', 'value', 'timestamp', 'device_id', 'sequence']
+        list_serializer_class = HeartRateListSerializer
+        validators = []
+
+class HeartRateAggregateQuerySerializer(serializers.Serializer):
+    # Query parameters of the aggregation endpoint
+    mode = serializers.ChoiceField(choices=['buckets', 'lttb'], default='buckets')
+    bucket = serializers.ChoiceField(choices=['1m', '5m', '1h', '1d'], default='1h')
+    points = serializers.IntegerField(min_value=3, max_value=5000, default=500)
+
+class WardQuerySerializer(serializers.Serializer):
+    # Query parameters of the ward endpoint, besides the WardFilter ones choosing the patients
+    mode = serializers.ChoiceField(choices=['buckets', 'readings'], default='buckets')
+    bucket = serializers.ChoiceField(choices=['1m', '5m', '1h', '1d'], default='5m')
+    since = serializers.DateTimeField(required=False)
+    until = serializers.DateTimeField(required=False)
+    limit = serializers.IntegerField(min_value=1, max_value=1000, default=100) # Readings per patient
+
+    def validate(self, attrs):
+        if 'since' in attrs and 'until' in attrs and attrs['since'] >= attrs['until']:
+            raise serializers.ValidationError({'since': "Must be earlier than until."})
+        return attrs
+
+class HeartRateExportQuerySerializer(serializers.Serializer):
+    # Query parameters of the export endpoint (`format` is taken by DRF content negotiation)
+    output = serializers.ChoiceField(choices=['ndjson', 'csv'], default='ndjson')
+
+class HeartRateBucketSerializer(serializers.Serializer):
+    start = serializers.DateTimeField()
+    min = serializers.IntegerField()
+    max = serializers.IntegerField()
+    avg = serializers.FloatField()
+    count = serializers.IntegerField()
+
+class HeartRatePointSerializer(serializers.Serializer):
+    timestamp = serializers.DateTimeField()
+    value = serializers.IntegerField()
+
+class WardBucketSeriesSerializer(serializers.Serializer):
+    patient = serializers.IntegerField()
+    full_name = serializers.CharField()
+    buckets = HeartRateBucketSerializer(many=True)
+
+class WardReadingSeriesSerializer(serializers.Serializer):
+    patient = serializers.IntegerField()
+    full_name = serializers.CharField()
+    readings = HeartRatePointSerializer(many=True)
+
+class LatestVitalsSerializer(serializers.Serializer):
+    value = serializers.IntegerField()
+    timestamp = serializers.DateTimeField()
+    avg_5m = serializers.FloatField(allow_null=True)
 
 class PatientSerializer(serializers.ModelSerializer):
     # Use ReadOnlyField to show the username instead of just the user ID
     user_username = serializers.ReadOnlyField(source='user.username')
     doctor_username = serializers.ReadOnlyField(source='doctor.username')
+    latest_vitals = serializers.SerializerMethodField()
 
     class Meta:
         model = Patient
@@ -24,5 +108,67 @@ class PatientSerializer(serializers.ModelSerializer):
             'user',        # The patient's own user ID
             'user_username',
             'doctor',      # The doctor's user ID
-            'doctor_username'
-        ]
\ No newline at end of file
+            'doctor_username',
+            'latest_vitals',
+        ]
+
+    @extend_schema_field(LatestVitalsSerializer(allow_null=True))
+    def get_latest_vitals(self, obj):
+        # List views look up the whole page at once and pass it in the context
+        vitals = self.context.get('vitals')
+        entry = vitals[obj.pk] if vitals is not None and obj.pk in vitals else get_latest_vitals([obj.pk])[obj.pk]
+        return LatestVitalsSerializer(entry).data if entry else None
+
+
+class AlertRuleSerializer(serializers.ModelSerializer):
+    # Set from the request for a doctor's rules; an HOD names the doctor of a rule without a patient
+    doctor = serializers.PrimaryKeyRelatedField(
+        queryset=CustomUser.objects.filter(role=CustomUser.Role.DOCTOR), required=False, allow_null=True
+    )
+
+    class Meta:
+        model = AlertRule
+        fields = [
+            'id',
+            'name',
+            'patient',     # Leave empty for a rule covering all of the doctor's patients
+            'doctor',
+            'min_value',
+            'max_value',
+            'sustained_seconds',
+            'max_change_per_minute',
+            'is_active',
+            'created_at',
+        ]
+        read_only_fields = ['created_at']
+
+    def validate(self, attrs):
+        min_value = attrs.get('min_value', getattr(self.instance, 'min_value', None))
+        max_value = attrs.get('max_value', getattr(self.instance, 'max_value', None))
+        max_change = attrs.get('max_change_per_minute', getattr(self.instance, 'max_change_per_minute', None))
+        if min_value is None and max_value is None and max_change is None:
+            raise serializers.ValidationError("Set at least one of min_value, max_value or max_change_per_minute.")
+        if min_value is not None and max_value is not None and min_value >= max_value:
+            raise serializers.ValidationError({'min_value': "Must be lower than max_value."})
+        return attrs
+
+class DeviceKeySerializer(serializers.ModelSerializer):
+    # Only in the response to creating the key: it is stored hashed
+    key = serializers.CharField(read_only=True)
+
+    class Meta:
+        model = DeviceKey
+        fields = ['id', 'patient', 'name', 'prefix', 'key', 'created_at']
+        read_only_fields = ['prefix', 'created_at']
+
+    def create(self, validated_data):
+        device_key, key = issue_key(validated_data['patient'], validated_data['name'])
+        device_key.key = key
+        return device_key
+
+class AlertSerializer(serializers.ModelSerializer):
+    rule_name = serializers.ReadOnlyField(source='rule.name')
+
+    class Meta:
+        model = Alert
+        fields = ['id', 'patient', 'rule', 'rule_name', 'kind', 'value', 'triggered_at', 'created_at']
\ No newline at end of file
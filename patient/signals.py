@@ -0,0 +1,38 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .alerts import alert_engine
+from .devices import forget_device_key
+from .models import AlertRule, DeviceKey, HeartRateArchive, Patient
+from .response_cache import bump_versions
+
+
+@receiver(post_save, sender=AlertRule)
+@receiver(post_delete, sender=AlertRule)
+@receiver(post_save, sender=Patient)
+def forget_alert_rules(sender, **kwargs):
+    # Rule edits and patients moving between doctors change which rules apply
+    alert_engine.forget_rules()
+
+
+@receiver(post_save, sender=DeviceKey)
+@receiver(post_delete, sender=DeviceKey)
+def drop_device_key(sender, instance, **kwargs):
+    # Deleting a key (also when its patient is deleted) revokes it; a saved key is read again
+    key_hash = instance.key_hash
+    transaction.on_commit(lambda: forget_device_key(key_hash))
+
+
+@receiver(post_save, sender=Patient)
+@receiver(post_delete, sender=Patient)
+def bump_patient_versions(sender, instance, **kwargs):
+    # Patient lists, and the patient's own data (who may read it), are served again
+    names = ['patients', f'patient:{instance.pk}']
+    transaction.on_commit(lambda: bump_versions(names))
+
+
+@receiver(post_save, sender=HeartRateArchive)
+def bump_archived_patient_version(sender, instance, **kwargs):
+    # Readings moved into an archive are served from it from now on
+    names = [f'patient:{instance.patient_id}']
+    transaction.on_commit(lambda: bump_versions(names))
@@ -0,0 +1,134 @@
+import asyncio
+import json
+import time
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.exceptions import InvalidToken
+from users.authentication import CachedJWTAuthentication, aget_user_state
+from users.models import CustomUser
+from .access import AccessScope
+from .pubsub import get_broker
+
+KEEPALIVE_SECONDS = 15
+
+
+def authenticate_stream(request):
+    """
+    Resolves (user, validated token) from a Bearer token, or from ?token= since browser EventSource
+    cannot send headers. Returns None when no token was sent.
+    """
+    authenticator = CachedJWTAuthentication()
+    header = authenticator.get_header(request)
+    raw_token = authenticator.get_raw_token(header) if header else None
+    if raw_token is None and request.GET.get('token'):
+        raw_token = request.GET['token'].encode()
+    if raw_token is None:
+        return None
+    validated_token = authenticator.get_validated_token(raw_token)
+    return authenticator.get_user(validated_token), validated_token
+
+
+async def allowed_patient_ids(user):
+    """Patients whose readings the user may follow: a doctor's own patients, or a patient's own profile."""
+    patients = AccessScope(user).readable_patients()
+    return {pk async for pk in patients.values_list('pk', flat=True)}
+
+
+async def followed_patient_ids(user_id, requested=None):
+    """
+    The patients a stream's user may follow now (within `requested`, if given), or None when the user
+    may no longer use the stream: deleted, deactivated, or no longer a doctor or patient.
+    """
+    try:
+        user = CachedJWTAuthentication().user_from_state(await aget_user_state(user_id))
+    except AuthenticationFailed:
+        return None
+    if user.role not in (CustomUser.Role.DOCTOR, CustomUser.Role.PATIENT):
+        return None
+    patient_ids = await allowed_patient_ids(user)
+    return patient_ids if requested is None else patient_ids & requested
+
+
+def end_event(detail):
+    return f"event: end\ndata: {json.dumps({'detail': detail})}\n\n"
+
+
+async def heart_rate_events(patient_ids, keepalive=KEEPALIVE_SECONDS, expires_at=None, recheck=None):
+    """
+    Yields Server-Sent Events for new readings, with a comment line as keepalive while idle.
+    The stream ends with an `end` event at `expires_at` (a timestamp, the expiry of the client's token).
+    Every `keepalive` seconds, `recheck()` returns the patients the client may still follow, or None to end it.
+    """
+    broker = get_broker()
+    subscription = broker.subscribe(patient_ids)
+    try:
+        yield ': connected\n\n'
+        next_check = time.monotonic() + keepalive
+        while True:
+            if expires_at is not None and time.time() >= expires_at:
+                yield end_event('Token expired.')
+                return
+            if time.monotonic() >= next_check:
+                if recheck is not None:
+                    allowed = await recheck()
+                    if allowed is None:
+                        yield end_event('User is no longer allowed to follow readings.')
+                        return
+                    if allowed != subscription.patient_ids:
+                        # Readings queued for patients that were taken away are dropped with the old subscription
+                        broker.unsubscribe(subscription)
+                        subscription = broker.subscribe(allowed)
+                yield ': keepalive\n\n'
+                next_check = time.monotonic() + keepalive
+
+            timeout = next_check - time.monotonic()
+            if expires_at is not None:
+                timeout = min(timeout, expires_at - time.time())
+            try:
+                message = await asyncio.wait_for(subscription.get(), timeout=max(timeout, 0))
+            except asyncio.TimeoutError:
+                continue
+            yield f"id: {message['id']}\nevent: heart_rate\ndata: {json.dumps(message)}\n\n"
+    finally:
+        broker.unsubscribe(subscription)
+
+
+@require_GET
+async def heart_rate_stream(request):
+    """
+    Server-Sent Events stream pushing new heart rate readings as they are ingested.
+    - Doctors receive readings for the patients they manage, patients for themselves.
+    - `?patients=1,2` narrows the stream to some of those patients.
+    - Only routed by the ASGI application (patient.async_urls); each open stream costs no thread.
+    - The stream ends when the token expires, or (checked on every keepalive) the user is deactivated;
+      patients moving between doctors are followed on the next keepalive.
+    """
+    try:
+        authenticated = await sync_to_async(authenticate_stream)(request)
+    except (InvalidToken, AuthenticationFailed) as exc:
+        return JsonResponse({'detail': exc.detail}, status=401)
+    if authenticated is None:
+        return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=401)
+    user, validated_token = authenticated
+    if user.role not in (CustomUser.Role.DOCTOR, CustomUser.Role.PATIENT):
+        return JsonResponse({'detail': 'You do not have permission to perform this action.'}, status=403)
+
+    requested = None
+    if request.GET.get('patients'):
+        try:
+            requested = {int(pk) for pk in request.GET['patients'].split(',')}
+        except ValueError:
+            return JsonResponse({'patients': ['Expected a comma separated list of patient ids.']}, status=400)
+    patient_ids = await allowed_patient_ids(user)
+    if requested is not None:
+        patient_ids &= requested
+
+    events = heart_rate_events(
+        patient_ids, expires_at=validated_token['exp'], recheck=lambda: followed_patient_ids(user.pk, requested),
+    )
+    response = StreamingHttpResponse(events, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no' # Keep reverse proxies from buffering the stream
+    return response
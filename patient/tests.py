@@ -1,9 +1,37 @@
 # patients/tests.py
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone as dt_timezone
+from io import StringIO
+from unittest import mock, skipUnless
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import DatabaseError, connection, transaction
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import http_date
 from rest_framework import status
 from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import RefreshToken
 from users.models import CustomUser
-from .models import Patient
+from .models import Patient, HeartRate, HeartRateMinute, HeartRateHour, HeartRateArchive, Alert
+from .alerts import alert_engine
+from .ingest import store_readings
+from .aggregation import lttb
+from .archive import read_segment, write_segment
+from .rollups import rebuild_rollups
+from heart_monitor.profiling import read_profiles
+from .benchmark import SCENARIOS, Worker, run_scenario, seed
+from . import writebehind
+from .writebehind import WriteBehindBuffer
+from .pubsub import get_broker, publish_readings
+from .streams import followed_patient_ids, heart_rate_events
 
 class PatientAPITests(APITestCase):
     def setUp(self):
@@ -23,6 +51,10 @@ class PatientAPITests(APITestCase):
         self.patient2_user = CustomUser.objects.create_user(username='patient2', password='password123', role=CustomUser.Role.PATIENT)
         self.patient2 = Patient.objects.create(user=self.patient2_user, doctor=self.doctor2, full_name='Patient Two', age=40)
 
+        # Alert state and cached vitals live in memory and must not leak between tests
+        alert_engine.reset()
+        cache.clear()
+
     ## Patient Management Tests
     
     def test_doctor_can_list_only_their_patients(self):
@@ -123,4 +155,1135 @@ class PatientAPITests(APITestCase):
         
         self.assertEqual(response.status_code, status.HTTP_200_OK)
      
-        self.assertEqual(len(response.data['results']), 0)
\ No newline at end of file
+        self.assertEqual(len(response.data['results']), 0)
+
+    ## Batch Ingestion Tests
+
+    def test_doctor_can_post_batch_of_heart_rates(self):
+        """
+        Ensure a list of readings for one patient is stored in one request.
+        """
+        self.client.force_authenticate(user=self.doctor1)
+
+        url = reverse('patient-heart-rates', kwargs={'patient_pk': self.patient1.pk})
+        data = [{'value': 70 + i} for i in range(50)]
+        response = self.client.post(url, data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(response.data), 50)
+        self.assertEqual(HeartRate.objects.filter(patient=self.patient1).count(), 50)
+
+    def test_doctor_can_bulk_ingest_for_several_own_patients(self):
+        """
+        Ensure the multi-patient endpoint stores readings for every patient the doctor manages.
+        """
+        patient3_user = CustomUser.objects.create_user(username='patient3', password='password123', role=CustomUser.Role.PATIENT)
+        patient3 = Patient.objects.create(user=patient3_user, doctor=self.doctor1, full_name='Patient Three', age=50)
+        self.client.force_authenticate(user=self.doctor1)
+
+        url = reverse('heart-rates-bulk')
+        data = [{'patient': self.patient1.pk, 'value': 80}, {'patient': patient3.pk, 'value': 90}]
+        response = self.client.post(url, data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(HeartRate.objects.filter(patient=self.patient1).count(), 1)
+        self.assertEqual(HeartRate.objects.filter(patient=patient3).count(), 1)
+
+    def test_bulk_ingest_rejects_whole_batch_with_foreign_patient(self):
+        """
+        Ensure a batch containing another doctor's patient is refused and nothing is written.
+        """
+        self.client.force_authenticate(user=self.doctor1)
+
+        url = reverse('heart-rates-bulk')
+        data = [{'patient': self.patient1.pk, 'value': 80}, {'patient': self.patient2.pk, 'value': 90}]
+        response = self.client.post(url, data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertFalse(HeartRate.objects.exists())
+
+    def test_replayed_readings_are_not_duplicated(self):
+        """
+        Ensure re-sending readings with the same device/sequence key does not store them twice.
+        """
+        self.client.force_authenticate(user=self.doctor1)
+
+        url = reverse('patient-heart-rates', kwargs={'patient_pk': self.patient1.pk})
+        data = [
+            {'value': 72, 'device_id': 'monitor-7', 'sequence': seq, 'timestamp': f'2025-01-01T10:00:0{seq}Z'}
+            for seq in range(5)
+        ]
+        first = self.client.post(url, data, format='json')
+        replay = self.client.post(url, data + [{'value': 75, 'device_id': 'monitor-7', 'sequence': 5}], format='json')
+
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(replay.status_code, status.HTTP_201_CREATED)
+        # Only the one new reading is stored by the replay
+        self.assertEqual(len(replay.data), 1)
+        self.assertEqual(HeartRate.objects.filter(patient=self.patient1).count(), 6)
+        # The device-measured time is kept rather than the arrival time
+        self.assertTrue(HeartRate.objects.filter(sequence=0, timestamp='2025-01-01T10:00:00Z').exists())
+
+    def test_replayed_single_reading_returns_original(self):
+        """
+        Ensure a single reading sent twice returns the stored reading instead of failing.
+        """
+        self.client.force_authenticate(user=self.doctor1)
+
+        url = reverse('patient-heart-rates', kwargs={'patient_pk': self.patient1.pk})
+        data = {'value': 88, 'device_id': 'monitor-7', 'sequence': 42}
+        first = self.client.post(url, data, format='json')
+        replay = self.client.post(url, data, format='json')
+
+        self.assertEqual(replay.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(replay.data['id'], first.data['id'])
+        self.assertEqual(HeartRate.objects.count(), 1)
+
+    def test_heart_rate_history_is_cursor_paginated(self):
+        """
+        Ensure heart rate history pages follow a cursor newest-first without counting the whole history.
+        """
+        start = timezone.now() - timedelta(minutes=10)
+        HeartRate.objects.bulk_create(
+            HeartRate(patient=self.patient1, value=60 + i, timestamp=start + timedelta(seconds=i)) for i in range(5)
+        )
+        self.client.force_authenticate(user=self.doctor1)
+
+        url = reverse('patient-heart-rates', kwargs={'patient_pk': self.patient1.pk})
+        values = []
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url, {'page_size': 2})
+            while True:
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                values += [row['value'] for row in response.data['results']]
+                if not response.data['next']:
+                    break
+                response = self.client.get(response.data['next'])
+
+        self.assertEqual(values, [64, 63, 62, 61, 60])
+        self.assertFalse(any('COUNT(' in q['sql'] for q in ctx.captured_queries))
+
+    ## Write-behind Ingest Tests
+
+    @override_settings(HEART_RATE_WRITE_BEHIND=True)
+    def test_write_behind_acknowledges_then_stores_in_batches(self):
+        """
+        Ensure queued ingest answers 202 after the ownership check, refuses work when full, and stores on flush.
+        """
+        self.client.force_authenticate(user=self.doctor1)
+        url = reverse('patient-heart-rates', kwargs={'patient_pk': self.patient1.pk})
+        with tempfile.TemporaryDirectory() as spill_root:
+            buffer = WriteBehindBuffer(spill_root, max_pending=3)
+            with mock.patch.object(writebehind, '_buffer', buffer):
+                response = self.client.post(url, [{'value': 70}, {'value': 71}], format='json')
+                self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+                self.assertEqual(response.data, {'accepted': 2})
+                self.assertFalse(HeartRate.objects.exists())
+
+                # Backpressure
+                response = self.client.post(url, [{'value': 72}, {'value': 73}], format='json')
+                self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+                self.assertEqual(response['Retry-After'], '1')
+
+                # Another doctor's patient is refused before anything is queued
+                other_url = reverse('patient-heart-rates', kwargs={'patient_pk': self.patient2.pk})
+                response = self.client.post(other_url, {'value': 72}, format='json')
+                self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+                self.assertEqual(buffer.flush(), 2)
+            buffer.close()
+            self.assertEqual(sorted(HeartRate.objects.values_list('value', flat=True)), [70, 71])
+            self.assertEqual([name for name in os.listdir(spill_root) if name.endswith('.jsonl')], [])
+
+    def test_write_behind_recovers_acknowledged_readings_after_crash(self):
+        """
+        Ensure readings journaled by a buffer that never flushed are stored by the next one,
+        and still go through the ownership check.
+        """
+        reading = {'value': 80, 'timestamp': '2025-01-01T10:00:00+00:00', 'device_id': '', 'sequence': None}
+        with tempfile.TemporaryDirectory() as spill_root:
+            crashed = WriteBehindBuffer(spill_root)
+            crashed.enqueue([
+                {**reading, 'patient': self.patient1.pk, 'user': self.doctor1.pk},
+                # Queued by a doctor who no longer manages the patient
+                {**reading, 'patient': self.patient1.pk, 'user': self.doctor2.pk},
+            ])
+            crashed.close()
+
+            with self.assertLogs('patient.writebehind', 'WARNING'):
+                survivor = WriteBehindBuffer(spill_root)
+                self.assertEqual(survivor.pending(), 2)
+                self.assertEqual(survivor.flush(), 1)
+            survivor.close()
+            self.assertFalse([name for name in os.listdir(spill_root) if name.endswith('.jsonl')])
+        self.assertEqual(list(HeartRate.objects.values_list('value', flat=True)), [80])
+
+    ## Device Key Tests
+
+    def test_device_key_posts_readings_without_user_lookups(self):
+        """
+        Ensure a monitor posts its patient's readings with a device key, checked from the cache after the first request.
+        """
+        self.client.force_authenticate(user=self.doctor1)
+        response = self.client.post(reverse('device-key-list'), {'patient': self.patient1.pk, 'name': 'Bed 4'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        key = response.data['key']
+        self.assertTrue(key.startswith(response.data['prefix']))
+        self.assertNotIn('key', self.client.get(reverse('device-key-list')).data['results'][0])
+        self.client.force_authenticate(user=None)
+
+        url = reverse('heart-rates-device')
+        headers = {'Authorization': f'Device {key}'}
+        response = self.client.post(url, {'value': 72}, format='json', headers=headers)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(url, [{'value': 73}, {'value': 74}], format='json', headers=headers)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertFalse([q for q in ctx.captured_queries if 'users_customuser' in q['sql'] or 'devicekey' in q['sql']])
+        self.assertEqual(HeartRate.objects.filter(patient=self.patient1).count(), 3)
+
+        # The key is for ingest only
+        history = reverse('patient-heart-rates', kwargs={'patient_pk': self.patient1.pk})
+        self.assertEqual(self.client.get(history, headers=headers).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_deleted_device_key_is_rejected(self):
+        """
+        Ensure doctors only issue keys for their own patients, and a deleted key stops working at once.
+        """
+        self.client.force_authenticate(user=self.doctor2)
+        response = self.client.post(reverse('device-key-list'), {'patient': self.patient1.pk, 'name': 'Bed 4'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        self.client.force_authenticate(user=self.doctor1)
+        response = self.client.post(reverse('device-key-list'), {'patient': self.patient1.pk, 'name': 'Bed 4'}, format='json')
+        key_id, headers = response.data['id'], {'Authorization': f"Device {response.data['key']}"}
+        self.client.force_authenticate(user=None)
+        url = reverse('heart-rates-device')
+        self.assertEqual(self.client.post(url, {'value': 72}, format='json', headers=headers).status_code, status.HTTP_201_CREATED)
+
+        self.client.force_authenticate(user=self.doctor1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(reverse('device-key-detail', kwargs={'pk': key_id}))
+        self.client.force_authenticate(user=None)
+        response = self.client.post(url, {'value': 73}, format='json', headers=headers)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(HeartRate.objects.filter(patient=self.patient1).count(), 1)
+
+    ## Aggregation Tests
+
+    def test_heart_rate_aggregate_returns_bucket_stats(self):
+        """
+        Ensure readings are reduced to min/max/avg/count per 5 minute bucket.
+        """
+        start = datetime(2025, 1, 1, 10, 0, tzinfo=dt_timezone.utc)
+        self.client.force_authenticate(user=self.doctor1)
+        ingest_url = reverse('patient-heart-rates', kwargs={'patient_pk': self.patient1.pk})
+        data = [{'value': 60 + i, 'timestamp': (start + timedelta(minutes=i)).isoformat()} for i in range(10)]
+        self.client.post(ingest_url, data, format='json')
+
+        url = reverse('patient-heart-rates-aggregate', kwargs={'patient_pk': self.patient1.pk})
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url, {'bucket': '5m'})
+        # Answered from the minute rollups without reading raw readings
+        self.assertFalse(any('patient_heartrate"' in q['sql'] for q in ctx.captured_queries))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 2)
+        first = response.data['results'][0]
+        self.assertEqual((first['min'], first['max'], first['avg'], first['count']), (60, 64, 62.0, 5))
+
+    def test_heart_rate_aggregate_lttb_limits_points(self):
+        """
+        Ensure the LTTB mode returns at most the requested number of points, keeping both ends.
+        """
+        start = datetime(2025, 1, 1, 10, 0, tzinfo=dt_timezone.utc)
+        HeartRate.objects.bulk_create(
+            HeartRate(patient=self.patient1, value=60 + (i % 7) * 5, timestamp=start + timedelta(seconds=i)) for i in range(200)
+        )
+        self.client.force_authenticate(user=self.patient1_user)
+
+        url = reverse('patient-heart-rates-aggregate', kwargs={'patient_pk': self.patient1.pk})
+        response = self.client.get(url, {'mode': 'lttb', 'points': 20})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 20)
+        self.assertEqual(response.data['results'][0]['value'], 60)
+        self.assertEqual(response.data['results'][-1]['value'], 60 + (199 % 7) * 5)
+
+    def test_lttb_streams_points_two_buckets_at_a_time(self):
+        """
+        Ensure LTTB over a stream with a known count picks the same points as over a list, without holding the stream.
+        """
+        start = datetime(2025, 1, 1, 10, 0, tzinfo=dt_timezone.utc)
+        count = 50000
+
+        def stream():
+            return ((start + timedelta(seconds=i), 60 + (i * 37) % 50) for i in range(count))
+
+        tracemalloc.start()
+        try:
+            sampled = lttb(stream(), 50, count)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        self.assertEqual(sampled, lttb(list(stream()), 50))
+        self.assertEqual(len(sampled), 50)
+        # The whole series would take over 5 MB; two buckets of about 1000 points a fraction of that
+        self.assertLess(peak, 2 * 1024 * 1024)
+
+    def test_rollups_follow_ingest_and_can_be_rebuilt(self):
+        """
+        Ensure batches update the minute/hour rollups incrementally, and that the
+        rebuild command recomputes the same rollups from raw readings.
+        """
+        start = datetime(2025, 1, 1, 10, 0, tzinfo=dt_timezone.utc)
+        self.client.force_authenticate(user=self.doctor1)
+        url = reverse('patient-heart-rates', kwargs={'patient_pk': self.patient1.pk})
+        for batch in range(3):
+            data = [
+                {'value': 70 + i, 'timestamp': (start + timedelta(seconds=batch * 40 + i)).isoformat()}
+                for i in range(40)
+            ]
+            self.client.post(url, data, format='json')
+
+        def snapshot():
+            return {
+                model.__name__: list(model.objects.values_list('bucket', 'min_value', 'max_value', 'total', 'count'))
+                for model in (HeartRateMinute, HeartRateHour)
+            }
+
+        incremental = snapshot()
+        self.assertEqual(incremental['HeartRateHour'], [(start, 70, 109, 3 * sum(range(70, 110)), 120)])
+        self.assertEqual(len(incremental['HeartRateMinute']), 2)
+
+        HeartRateMinute.objects.all().delete()
+        HeartRateHour.objects.update(count=0)
+        call_command('rebuild_rollups', start='2025-01-01', end='2025-01-02', stdout=StringIO())
+        self.assertEqual(snapshot(), incremental)
+
+    ## Ward View Tests
+
+    def test_ward_returns_series_for_all_of_a_doctors_patients(self):
+        """
+        Ensure the ward view returns one series per managed patient, bucketed or as the latest readings per patient.
+        """
+        third_user = CustomUser.objects.create_user(username='patient3', role=CustomUser.Role.PATIENT)
+        third = Patient.objects.create(user=third_user, doctor=self.doctor1, full_name='Patient Three', age=70)
+        start = datetime(2025, 1, 1, 10, 0, tzinfo=dt_timezone.utc)
+        for patient, base in ((self.patient1, 60), (third, 90), (self.patient2, 120)):
+            data = [{'value': base + i, 'timestamp': (start + timedelta(minutes=i)).isoformat()} for i in range(10)]
+            self.client.force_authenticate(user=patient.doctor)
+            self.client.post(reverse('patient-heart-rates', kwargs={'patient_pk': patient.pk}), data, format='json')
+
+        self.client.force_authenticate(user=self.doctor1)
+        url = reverse('heart-rates-ward')
+        window = {'since': start.isoformat(), 'until': (start + timedelta(hours=1)).isoformat()}
+        response = self.client.get(url, {**window, 'bucket': '5m'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # Doctor2's patient is not part of doctor1's ward
+        self.assertEqual([s['patient'] for s in response.data['results']], [self.patient1.pk, third.pk])
+        first = response.data['results'][1]['buckets'][0]
+        self.assertEqual((first['min'], first['max'], first['count']), (90, 94, 5))
+
+        response = self.client.get(url, {**window, 'mode': 'readings', 'limit': 3, 'age__gte': 50})
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual([r['value'] for r in response.data['results'][0]['readings']], [97, 98, 99])
+
+        self.client.force_authenticate(user=self.patient1_user)
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_403_FORBIDDEN)
+
+    ## Export Tests
+
+    def test_heart_rate_export_streams_csv_and_ndjson(self):
+        """
+        Ensure the full history streams as CSV or NDJSON, oldest first.
+        """
+        start = datetime(2025, 1, 1, 10, 0, tzinfo=dt_timezone.utc)
+        HeartRate.objects.bulk_create(
+            HeartRate(patient=self.patient1, value=60 + i, timestamp=start + timedelta(seconds=i)) for i in range(5)
+        )
+        self.client.force_authenticate(user=self.patient1_user)
+        url = reverse('patient-heart-rates-export', kwargs={'patient_pk': self.patient1.pk})
+
+        response = self.client.get(url, {'output': 'csv'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'id,timestamp,value,device_id,sequence')
+        self.assertEqual([line.split(',')[2] for line in lines[1:]], ['60', '61', '62', '63', '64'])
+
+        response = self.client.get(url)
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual([row['value'] for row in rows], [60, 61, 62, 63, 64])
+
+    def test_heart_rate_export_is_scoped_to_own_patients(self):
+        """
+        Ensure a doctor exporting another doctor's patient gets no rows.
+        """
+        HeartRate.objects.create(patient=self.patient2, value=90)
+        self.client.force_authenticate(user=self.doctor1)
+
+        url = reverse('patient-heart-rates-export', kwargs={'patient_pk': self.patient2.pk})
+        response = self.client.get(url)
+
+        self.assertEqual(b''.join(response.streaming_content), b'')
+
+    ## Live Stream Tests
+
+    @override_settings(ROOT_URLCONF='heart_monitor.asgi_urls')
+    async def test_doctor_receives_pushed_readings_over_sse(self):
+        """
+        Ensure a doctor's event stream delivers readings of their patients and nothing else.
+        """
+        token = await sync_to_async(lambda: str(RefreshToken.for_user(self.doctor1).access_token))()
+        url = reverse('heart-rates-stream')
+        response = await self.async_client.get(url, {'token': token})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = aiter(response.streaming_content)
+        self.assertEqual(await anext(events), b': connected\n\n')
+
+        other = HeartRate(pk=2, patient=self.patient2, value=99, timestamp=timezone.now())
+        own = HeartRate(pk=1, patient=self.patient1, value=77, timestamp=timezone.now())
+        publish_readings([other, own])
+
+        event = (await anext(events)).decode()
+        self.assertIn('event: heart_rate', event)
+        self.assertEqual(json.loads(event.split('data: ')[1])['value'], 77)
+
+        await events.aclose()
+
+    async def test_closing_event_stream_unsubscribes(self):
+        """
+        Ensure a stream that ends (client gone, task cancelled) stops receiving readings.
+        """
+        broker = get_broker()
+        before = broker.subscriber_count()
+        events = heart_rate_events({self.patient1.pk})
+
+        await anext(events)
+        self.assertEqual(broker.subscriber_count(), before + 1)
+        await events.aclose()
+        self.assertEqual(broker.subscriber_count(), before)
+
+    async def test_stream_ends_when_token_expires(self):
+        """
+        Ensure a stream ends with an `end` event once the client's token has expired.
+        """
+        events = heart_rate_events({self.patient1.pk}, expires_at=time.time() + 0.05)
+        self.assertEqual(await anext(events), ': connected\n\n')
+        rest = [event async for event in events]
+        self.assertTrue(rest[-1].startswith('event: end'))
+        self.assertIn('Token expired.', rest[-1])
+
+    async def test_stream_follows_access_changes(self):
+        """
+        Ensure a stream stops delivering a patient moved to another doctor, and ends when its user is deactivated.
+        """
+        events = heart_rate_events(
+            {self.patient1.pk}, keepalive=0.05, recheck=lambda: followed_patient_ids(self.doctor1.pk)
+        )
+        self.assertEqual(await anext(events), ': connected\n\n')
+        self.patient1.doctor = self.doctor2
+        await self.patient1.asave()
+        self.assertEqual(await anext(events), ': keepalive\n\n')
+
+        publish_readings([HeartRate(pk=1, patient=self.patient1, value=77, timestamp=timezone.now())])
+        self.assertEqual(await anext(events), ': keepalive\n\n')
+
+        def deactivate():
+            self.doctor1.is_active = False
+            with self.captureOnCommitCallbacks(execute=True):
+                self.doctor1.save()
+        await sync_to_async(deactivate)()
+        self.assertTrue((await anext(events)).startswith('event: end'))
+        with self.assertRaises(StopAsyncIteration):
+            await anext(events)
+
+    @override_settings(ROOT_URLCONF='heart_monitor.asgi_urls')
+    async def test_stream_requires_token(self):
+        """
+        Ensure the event stream refuses anonymous clients.
+        """
+        response = await self.async_client.get(reverse('heart-rates-stream'))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_stream_is_not_served_under_wsgi(self):
+        """
+        Ensure the endless event stream is only routed by the ASGI application, where it holds no worker thread.
+        """
+        self.assertEqual(self.client.get('/api/heart-rates/stream/').status_code, status.HTTP_404_NOT_FOUND)
+        with override_settings(ROOT_URLCONF='heart_monitor.asgi_urls'):
+            self.assertEqual(reverse('heart-rates-stream'), '/api/heart-rates/stream/')
+
+    ## Async View Tests
+
+    def access_token(self, user):
+        return str(RefreshToken.for_user(user).access_token)
+
+    @override_settings(ROOT_URLCONF='heart_monitor.asgi_urls')
+    async def test_async_views_answer_like_drf_views(self):
+        """
+        Ensure the async patient and heart rate history views return the same data as the DRF views.
+        """
+        await HeartRate.objects.abulk_create(HeartRate(patient=self.patient1, value=60 + i) for i in range(5))
+        token = await sync_to_async(self.access_token)(self.doctor1)
+        headers = {'Authorization': f'Bearer {token}'}
+        history = reverse('patient-heart-rates', kwargs={'patient_pk': self.patient1.pk})
+
+        for url, params in (
+            (reverse('patient-list'), {}),
+            (reverse('patient-list'), {'age__gte': 35}),
+            (reverse('patient-detail', kwargs={'pk': self.patient1.pk}), {}),
+            (history, {'page_size': 2}),
+        ):
+            expected = await sync_to_async(self.client.get)(url, params, headers=headers)
+            response = await self.async_client.get(url, params, headers=headers)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.json(), expected.json())
+
+        # Following the cursor works the same way
+        second = (await self.async_client.get(history, {'page_size': 2}, headers=headers)).json()['next']
+        response = await self.async_client.get(second, headers=headers)
+        self.assertEqual([r['value'] for r in response.json()['results']], [62, 61])
+
+    @override_settings(ROOT_URLCONF='heart_monitor.asgi_urls')
+    async def test_async_views_enforce_access_rules(self):
+        """
+        Ensure the async views turn away anonymous callers, other roles and other doctors' patients.
+        """
+        history = reverse('patient-heart-rates', kwargs={'patient_pk': self.patient2.pk})
+        response = await self.async_client.get(history)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(response['WWW-Authenticate'], 'Bearer realm="api"')
+
+        token = await sync_to_async(self.access_token)(self.patient1_user)
+        response = await self.async_client.get(reverse('patient-list'), headers={'Authorization': f'Bearer {token}'})
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        token = await sync_to_async(self.access_token)(self.doctor1)
+        headers = {'Authorization': f'Bearer {token}'}
+        response = await self.async_client.post(history, {'value': 80}, content_type='application/json', headers=headers)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        response = await self.async_client.get(history, headers=headers)
+        self.assertEqual(response.json()['results'], [])
+        response = await self.async_client.get(
+            reverse('patient-detail', kwargs={'pk': self.patient2.pk}), headers=headers
+        )
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    @override_settings(ROOT_URLCONF='heart_monitor.asgi_urls')
+    async def test_async_ingest_stores_readings(self):
+        """
+        Ensure readings posted to the async view are stored, single or batched, and other methods still work.
+        """
+        token = await sync_to_async(self.access_token)(self.doctor1)
+        headers = {'Authorization': f'Bearer {token}'}
+        url = reverse('patient-heart-rates', kwargs={'patient_pk': self.patient1.pk})
+
+        response = await self.async_client.post(url, {'value': 85}, content_type='application/json', headers=headers)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.json()['value'], 85)
+        response = await self.async_client.post(
+            url, [{'value': 90}, {'value': 95}], content_type='application/json', headers=headers
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(await HeartRate.objects.filter(patient=self.patient1).acount(), 3)
+
+        # Writes to patients are passed on to the DRF viewset
+        detail = reverse('patient-detail', kwargs={'pk': self.patient1.pk})
+        response = await self.async_client.patch(detail, {'age': 31}, content_type='application/json', headers=headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['age'], 31)
+
+    ## Response Cache Tests
+
+    def test_unchanged_lists_are_served_without_queries(self):
+        """
+        Ensure polling an unchanged list answers 304 (or the cached data) without a query, and writes move it on.
+        """
+        self.client.force_authenticate(user=self.doctor1)
+        patients = reverse('patient-list')
+        history = reverse('patient-heart-rates', kwargs={'patient_pk': self.patient1.pk})
+        first = self.client.get(patients)
+        self.assertEqual(first['Cache-Control'], 'private, no-cache')
+
+        with self.assertNumQueries(0):
+            response = self.client.get(patients, headers={'If-None-Match': first['ETag']})
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+            self.assertEqual(self.client.get(patients).data, first.data)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(history, {'value': 88}, format='json')
+        response = self.client.get(patients, headers={'If-None-Match': first['ETag']})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'][0]['latest_vitals']['value'], 88)
+
+        page = self.client.get(history)
+        self.assertEqual([r['value'] for r in page.data['results']], [88])
+        with self.assertNumQueries(0):
+            response = self.client.get(history, headers={'If-None-Match': page['ETag']})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # Responses are per user
+        self.client.force_authenticate(user=self.patient1_user)
+        response = self.client.get(history, headers={'If-None-Match': page['ETag']})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        # Moving the patient to another doctor takes their data out of doctor1's cached page
+        with self.captureOnCommitCallbacks(execute=True):
+            self.patient1.doctor = self.doctor2
+            self.patient1.save()
+        self.client.force_authenticate(user=self.doctor1)
+        response = self.client.get(history, headers={'If-None-Match': page['ETag']})
+        self.assertEqual(response.data['results'], [])
+
+    def test_write_in_the_same_second_moves_the_list_on(self):
+        """
+        Ensure a list revalidated right after a write is served anew, whatever the client's dates say.
+        """
+        self.client.force_authenticate(user=self.doctor1)
+        history = reverse('patient-heart-rates', kwargs={'patient_pk': self.patient1.pk})
+        page = self.client.get(history)
+        self.assertNotIn('Last-Modified', page)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(history, {'value': 88}, format='json')
+        response = self.client.get(history, headers={'If-Modified-Since': http_date()})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.get(history, headers={'If-None-Match': page['ETag'], 'If-Modified-Since': http_date()})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([r['value'] for r in response.data['results']], [88])
+
+    @override_settings(RESPONSE_CACHE_VERSION_TTL=60)
+    def test_versions_expire(self):
+        """
+        Ensure a write this process's cache did not see (made by another worker) shows once the versions expire.
+        """
+        self.client.force_authenticate(user=self.doctor1)
+        history = reverse('patient-heart-rates', kwargs={'patient_pk': self.patient1.pk})
+        page = self.client.get(history)
+        # Never committed here, so nothing is bumped, as with a write in another process
+        HeartRate.objects.create(patient=self.patient1, value=88)
+        response = self.client.get(history, headers={'If-None-Match': page['ETag']})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        with mock.patch('time.time', return_value=time.time() + 61):
+            response = self.client.get(history, headers={'If-None-Match': page['ETag']})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([r['value'] for r in response.data['results']], [88])
+
+    @override_settings(ROOT_URLCONF='heart_monitor.asgi_urls')
+    async def test_async_export_streams_archived_and_live_readings(self):
+        """
+        Ensure the ASGI export streams through an async iterator, with the same lines as the DRF view.
+        """
+        january = datetime(2025, 1, 31, 23, 59, tzinfo=dt_timezone.utc)
+        await HeartRate.objects.abulk_create(
+            HeartRate(patient=self.patient1, value=70 + i % 20, timestamp=january + timedelta(seconds=i)) for i in range(90)
+        )
+        token = await sync_to_async(self.access_token)(self.patient1_user)
+        headers = {'Authorization': f'Bearer {token}'}
+        url = reverse('patient-heart-rates-export', kwargs={'patient_pk': self.patient1.pk})
+
+        @override_settings(ROOT_URLCONF='heart_monitor.urls')
+        def wsgi_export(output):
+            return b''.join(self.client.get(url, {'output': output}, headers=headers).streaming_content)
+
+        with tempfile.TemporaryDirectory() as archive_root, override_settings(HEART_RATE_ARCHIVE_DIR=archive_root):
+            await sync_to_async(call_command)('archive_heart_rates', older_than_days=30, stdout=StringIO())
+            await HeartRate.objects.acreate(patient=self.patient1, value=60, timestamp=january + timedelta(seconds=30.5))
+            for output in ('ndjson', 'csv'):
+                response = await self.async_client.get(url, {'output': output}, headers=headers)
+                self.assertTrue(response.is_async)
+                lines = b''.join([chunk async for chunk in response.streaming_content])
+                self.assertEqual(lines, await sync_to_async(wsgi_export)(output))
+        self.assertEqual(len(lines.splitlines()), 92)
+
+    @override_settings(ROOT_URLCONF='heart_monitor.asgi_urls')
+    async def test_async_lists_answer_not_modified(self):
+        """
+        Ensure the async views serve the same ETags and 304s as the DRF views.
+        """
+        token = await sync_to_async(self.access_token)(self.doctor1)
+        headers = {'Authorization': f'Bearer {token}'}
+        for url in (reverse('patient-list'), reverse('patient-heart-rates', kwargs={'patient_pk': self.patient1.pk})):
+            etag = (await sync_to_async(self.client.get)(url, headers=headers))['ETag']
+            response = await self.async_client.get(url, headers={**headers, 'If-None-Match': etag})
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+            self.assertEqual(response['ETag'], etag)
+
+    ## Alerting Tests
+
+    def post_series(self, patient, values, start=None):
+        """Ingests one reading per second for a patient as doctor1."""
+        start = start or datetime(2025, 1, 1, 10, 0, tzinfo=dt_timezone.utc)
+        self.client.force_authenticate(user=self.doctor1)
+        url = reverse('patient-heart-rates', kwargs={'patient_pk': patient.pk})
+        data = [{'value': v, 'timestamp': (start + timedelta(seconds=i)).isoformat()} for i, v in enumerate(values)]
+        return self.client.post(url, data, format='json')
+
+    def test_sustained_tachycardia_raises_one_alert(self):
+        """
+        Ensure a breach raises a single alert once it has lasted the rule's duration.
+        """
+        self.client.force_authenticate(user=self.doctor1)
+        response = self.client.post(reverse('alert-rule-list'), {'name': 'Tachycardia', 'max_value': 120, 'sustained_seconds': 10}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        # A short spike, then a breach lasting 15 seconds
+        self.post_series(self.patient1, [80, 130, 130, 80] + [135] * 15)
+
+        alerts = list(Alert.objects.all())
+        self.assertEqual(len(alerts), 1)
+        self.assertEqual((alerts[0].kind, alerts[0].patient_id), (Alert.Kind.HIGH, self.patient1.pk))
+        self.assertEqual(alerts[0].triggered_at, datetime(2025, 1, 1, 10, 0, 14, tzinfo=dt_timezone.utc))
+
+    def test_rolled_back_batch_leaves_no_alert_state(self):
+        """
+        Ensure a batch whose transaction rolls back does not count towards breaches that were already alerted.
+        """
+        self.client.force_authenticate(user=self.doctor1)
+        self.client.post(reverse('alert-rule-list'), {'name': 'Tachycardia', 'max_value': 120}, format='json')
+        start = datetime(2025, 1, 1, 10, 0, tzinfo=dt_timezone.utc)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(DatabaseError), transaction.atomic():
+                store_readings([HeartRate(patient=self.patient1, value=130, timestamp=start)])
+                raise DatabaseError("rolled back")
+        self.assertFalse(Alert.objects.exists())
+
+        for second in (1, 2):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.post_series(self.patient1, [130], start=start + timedelta(seconds=second))
+        self.assertEqual(Alert.objects.count(), 1)
+
+    def test_rate_of_change_alert_and_scoped_alert_list(self):
+        """
+        Ensure a fast swing raises a rate alert, visible to the patient's doctor only.
+        """
+        self.client.force_authenticate(user=self.doctor1)
+        self.client.post(reverse('alert-rule-list'), {'name': 'Swing', 'max_change_per_minute': 30}, format='json')
+
+        self.post_series(self.patient1, [70, 72, 75, 110, 112])
+
+        response = self.client.get(reverse('alert-list'))
+        self.assertEqual(response.data['count'], 1)
+        self.assertEqual(response.data['results'][0]['kind'], Alert.Kind.RATE)
+        self.assertEqual(response.data['results'][0]['rule_name'], 'Swing')
+
+        self.client.force_authenticate(user=self.doctor2)
+        self.assertEqual(self.client.get(reverse('alert-list')).data['count'], 0)
+
+    def test_doctor_cannot_add_rule_for_other_doctor_patient(self):
+        """
+        Ensure rules can only target the doctor's own patients.
+        """
+        self.client.force_authenticate(user=self.doctor1)
+        response = self.client.post(reverse('alert-rule-list'), {'name': 'Low', 'patient': self.patient2.pk, 'min_value': 40}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_clearing_rule_patient_makes_it_doctor_wide(self):
+        """
+        Ensure a patient rule updated with no patient becomes a rule for all of the doctor's patients.
+        """
+        self.client.force_authenticate(user=self.doctor1)
+        rule = self.client.post(reverse('alert-rule-list'), {'name': 'Low', 'patient': self.patient1.pk, 'min_value': 40}, format='json')
+        url = reverse('alert-rule-detail', kwargs={'pk': rule.data['id']})
+
+        response = self.client.patch(url, {'patient': None}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.data['patient'], response.data['doctor']), (None, self.doctor1.pk))
+
+        response = self.client.patch(url, {'patient': self.patient1.pk}, format='json')
+        self.assertEqual((response.data['patient'], response.data['doctor']), (self.patient1.pk, None))
+
+    def test_hod_rules_without_patient_name_their_doctor(self):
+        """
+        Ensure an HOD's rule without a patient covers the doctor it names, and needs one.
+        """
+        self.client.force_authenticate(user=self.hod)
+        response = self.client.post(reverse('alert-rule-list'), {'name': 'Low', 'min_value': 40}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('doctor', response.data)
+
+        response = self.client.post(
+            reverse('alert-rule-list'), {'name': 'Low', 'min_value': 40, 'doctor': self.doctor2.pk}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual((response.data['patient'], response.data['doctor']), (None, self.doctor2.pk))
+
+    def test_hod_update_keeps_the_doctor_of_a_rule(self):
+        """
+        Ensure an HOD editing a doctor's rule without a patient leaves it covering that doctor's patients.
+        """
+        self.client.force_authenticate(user=self.doctor1)
+        rule = self.client.post(reverse('alert-rule-list'), {'name': 'Low', 'min_value': 40}, format='json')
+        url = reverse('alert-rule-detail', kwargs={'pk': rule.data['id']})
+
+        self.client.force_authenticate(user=self.hod)
+        response = self.client.put(url, {'name': 'Low', 'patient': None, 'min_value': 45}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.data['patient'], response.data['doctor']), (None, self.doctor1.pk))
+
+        # Clearing the patient of a patient's rule makes it cover that patient's doctor
+        rule = self.client.post(
+            reverse('alert-rule-list'), {'name': 'High', 'patient': self.patient2.pk, 'max_value': 150}, format='json'
+        )
+        url = reverse('alert-rule-detail', kwargs={'pk': rule.data['id']})
+        response = self.client.patch(url, {'patient': None}, format='json')
+        self.assertEqual(response.data['doctor'], self.doctor2.pk)
+
+    ## Latest Vitals Tests
+
+    def test_patient_list_shows_latest_vitals_written_through_on_ingest(self):
+        """
+        Ensure the patient list carries each patient's latest reading and 5 minute average,
+        and that a new reading updates the cached entry without another lookup.
+        """
+        start = datetime(2025, 1, 1, 10, 0, tzinfo=dt_timezone.utc)
+        self.client.force_authenticate(user=self.doctor1)
+        ingest_url = reverse('patient-heart-rates', kwargs={'patient_pk': self.patient1.pk})
+        data = [{'value': 60 + i * 10, 'timestamp': (start + timedelta(minutes=i)).isoformat()} for i in range(3)]
+        self.client.post(ingest_url, data, format='json')
+
+        url = reverse('patient-list')
+        vitals = self.client.get(url).data['results'][0]['latest_vitals']
+        self.assertEqual((vitals['value'], vitals['avg_5m']), (80, 70.0))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(ingest_url, {'value': 100, 'timestamp': (start + timedelta(minutes=3)).isoformat()}, format='json')
+        with self.assertNumQueries(2):
+            vitals = self.client.get(url).data['results'][0]['latest_vitals']
+        self.assertEqual((vitals['value'], vitals['avg_5m']), (100, 77.5))
+
+        self.client.force_authenticate(user=self.doctor2)
+        self.assertIsNone(self.client.get(url).data['results'][0]['latest_vitals'])
+
+    ## Retention Tests
+
+    def test_old_months_are_compacted_and_archived(self):
+        """
+        Ensure readings of months past retention move to an archive file, keep their rollups,
+        and leave recent readings untouched.
+        """
+        january = datetime(2025, 1, 31, 23, 59, tzinfo=dt_timezone.utc)
+        HeartRate.objects.bulk_create(
+            HeartRate(patient=self.patient1, value=70 + i, timestamp=january + timedelta(seconds=i)) for i in range(90)
+        )
+        recent = HeartRate.objects.create(patient=self.patient1, value=75)
+
+        with tempfile.TemporaryDirectory() as archive_root, override_settings(HEART_RATE_ARCHIVE_DIR=archive_root):
+            call_command('archive_heart_rates', older_than_days=30, stdout=StringIO())
+
+            self.assertEqual(list(HeartRate.objects.values_list('pk', flat=True)), [recent.pk])
+            archives = {a.month.month: a for a in HeartRateArchive.objects.all()}
+            self.assertEqual((archives[1].count, archives[2].count), (60, 30))
+            values = [row[2] for month in (1, 2) for row in read_segment(archives[month].path)]
+            self.assertEqual(values, [70 + i for i in range(90)])
+
+        # Raw data is gone but the month is still summarised
+        self.assertEqual(sum(HeartRateHour.objects.values_list('count', flat=True)), 90)
+
+        # Rebuilding the window leaves the archived months' rollups alone
+        rebuild_rollups(datetime(2025, 1, 1, tzinfo=dt_timezone.utc), datetime(2025, 3, 1, tzinfo=dt_timezone.utc))
+        self.assertEqual(sum(HeartRateHour.objects.values_list('count', flat=True)), 90)
+        self.assertEqual(sum(HeartRateMinute.objects.values_list('count', flat=True)), 90)
+
+    def test_archive_files_are_compact_and_read_by_range(self):
+        """
+        Ensure the columnar archive format round-trips readings in a few bytes each,
+        and reads a time range in either direction.
+        """
+        start = datetime(2025, 1, 1, tzinfo=dt_timezone.utc)
+        rows = [
+            (i + 1, start + timedelta(seconds=i), 70 + i % 7, 'ward-1' if i % 2 else '', i if i % 3 else None)
+            for i in range(20000)
+        ]
+        with tempfile.TemporaryDirectory() as archive_root, override_settings(HEART_RATE_ARCHIVE_DIR=archive_root):
+            self.assertEqual(write_segment('test.hrc', rows), (20000, rows[0][1], rows[-1][1]))
+            self.assertLess(os.path.getsize(os.path.join(archive_root, 'test.hrc')), 20000 * 2)
+
+            self.assertEqual(list(read_segment('test.hrc')), rows)
+            window = list(read_segment('test.hrc', rows[8000][1], rows[9000][1], descending=True))
+            self.assertEqual(window, rows[8000:9001][::-1])
+
+    def test_history_spans_archived_and_live_readings(self):
+        """
+        Ensure the history list, export and downsampling read archived months as if the readings were still live.
+        """
+        january = datetime(2025, 1, 31, 23, 59, tzinfo=dt_timezone.utc)
+        HeartRate.objects.bulk_create(
+            HeartRate(patient=self.patient1, value=70 + i, timestamp=january + timedelta(seconds=i)) for i in range(90)
+        )
+        expected = list(HeartRate.objects.order_by('-timestamp', '-id').values_list('pk', flat=True))
+        with tempfile.TemporaryDirectory() as archive_root, override_settings(HEART_RATE_ARCHIVE_DIR=archive_root):
+            call_command('archive_heart_rates', older_than_days=30, stdout=StringIO())
+            # A late reading for an archived month stays live until the next run
+            late = HeartRate.objects.create(patient=self.patient1, value=60, timestamp=january + timedelta(seconds=30.5))
+            expected.insert(59, late.pk) # Between the readings of seconds 31 and 30
+            self.client.force_authenticate(user=self.patient1_user)
+            url = reverse('patient-heart-rates', kwargs={'patient_pk': self.patient1.pk})
+
+            seen, next_url = [], url + '?page_size=25'
+            while next_url:
+                response = self.client.get(next_url)
+                seen += [row['id'] for row in response.data['results']]
+                previous_url, next_url = response.data['previous'], response.data['next']
+            self.assertEqual(seen, expected)
+            # Going back from the last page returns the page before it
+            previous = self.client.get(previous_url).data['results']
+            self.assertEqual([row['id'] for row in previous], expected[50:75])
+
+            export_url = reverse('patient-heart-rates-export', kwargs={'patient_pk': self.patient1.pk})
+            lines = b''.join(self.client.get(export_url).streaming_content).splitlines()
+            self.assertEqual([json.loads(line)['id'] for line in lines], expected[::-1])
+
+            aggregate_url = reverse('patient-heart-rates-aggregate', kwargs={'patient_pk': self.patient1.pk})
+            response = self.client.get(aggregate_url, {'mode': 'lttb', 'points': 1000, 'start_date': '2025-02-01'})
+            self.assertEqual(len(response.data['results']), 30)
+
+        # Another patient's archive is not readable
+        self.client.force_authenticate(user=self.patient2_user)
+        response = self.client.get(reverse('patient-heart-rates', kwargs={'patient_pk': self.patient1.pk}))
+        self.assertEqual(response.data['results'], [])
+
+    ## Instrumentation Tests
+
+    @override_settings(METRICS_SAMPLE_RATE=1, METRICS_SERVER_TIMING=True)
+    def test_requests_are_measured_by_route(self):
+        """
+        Ensure sampled requests report database and serializer timings and show up in the local metrics endpoint.
+        """
+        self.client.force_authenticate(user=self.doctor1)
+        response = self.client.get(reverse('patient-list'))
+        timing = response['Server-Timing']
+        self.assertIn('db;dur=', timing)
+        self.assertIn('serialize;dur=', timing)
+
+        metrics = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn('http_requests_total{route="patient-list",method="GET",status="200"}', metrics)
+        self.assertIn('http_request_db_queries_count{route="patient-list"}', metrics)
+
+        # Only local callers may scrape
+        response = self.client.get(reverse('metrics'), REMOTE_ADDR='10.0.0.5')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_sampled_requests_are_profiled_and_summarized(self):
+        """
+        Ensure profiling writes a rotating set of request profiles with SQL timings and plans, and summarizes them.
+        """
+        HeartRate.objects.create(patient=self.patient1, value=70)
+        self.client.force_authenticate(user=self.doctor1)
+        url = reverse('patient-heart-rates', kwargs={'patient_pk': self.patient1.pk})
+
+        with tempfile.TemporaryDirectory() as profile_root, override_settings(
+            PROFILING_SAMPLE_RATE=1, PROFILING_SLOW_QUERY_MS=0, PROFILING_DIR=profile_root, PROFILING_MAX_FILES=2,
+            RESPONSE_CACHE_TTL=0,
+        ):
+            for _ in range(3):
+                self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+
+            profiles = list(read_profiles())
+            self.assertEqual(len(profiles), 2)
+            self.assertEqual(profiles[0]['route'], 'patient-heart-rates')
+            history = next(q for q in profiles[0]['queries'] if 'FROM "patient_heartrate"' in q['sql'])
+            self.assertTrue(history['explain'])
+            self.assertTrue(profiles[0]['functions'])
+
+            out = StringIO()
+            call_command('profile_summary', stdout=out)
+            self.assertIn('patient-heart-rates: 2 requests', out.getvalue())
+
+    ## Benchmark Tests
+
+    def test_benchmark_reports_latency_and_queries(self):
+        """
+        Ensure the benchmark seeds its own doctors and patients and reports percentiles and queries per request.
+        """
+        assigned = seed(doctors=1, patients_per_doctor=2, readings_per_patient=30)
+        doctor, patient_ids = next(iter(assigned.items()))
+        self.assertEqual(HeartRate.objects.filter(patient_id__in=patient_ids).count(), 60)
+
+        worker = Worker(doctor, patient_ids, batch_size=5, seed=0)
+        history = run_scenario(SCENARIOS['history'], [worker], requests=5)
+        ingest = run_scenario(SCENARIOS['ingest'], [worker], requests=3)
+
+        self.assertEqual((history['requests'], history['errors'], ingest['errors']), (5, 0, 0))
+        self.assertLessEqual(history['latency_ms']['p50'], history['latency_ms']['p99'])
+        self.assertGreater(history['queries_per_request'], 0)
+        self.assertEqual(HeartRate.objects.filter(patient_id__in=patient_ids).count(), 75)
+
+    def test_benchmark_drives_async_views_concurrently(self):
+        """
+        Ensure the ASGI run serves the same scenarios through the async views, with clients as concurrent tasks.
+        """
+        assigned = seed(doctors=1, patients_per_doctor=2, readings_per_patient=30)
+        doctor, patient_ids = next(iter(assigned.items()))
+        workers = [Worker(doctor, patient_ids, batch_size=5, seed=i) for i in range(3)]
+
+        for name in ('patients', 'history', 'ingest'):
+            result = run_scenario(SCENARIOS[name], workers, requests=6, server='asgi')
+            self.assertEqual((result['requests'], result['errors']), (6, 0), name)
+            self.assertGreater(result['queries_per_request'], 0)
+        self.assertEqual(HeartRate.objects.filter(patient_id__in=patient_ids).count(), 90)
+
+    ## Query Plan Tests
+
+    @skipUnless(connection.vendor == 'sqlite', 'Plan assertions use SQLite EXPLAIN QUERY PLAN output')
+    def test_heart_rate_history_uses_index_without_sort(self):
+        """
+        Ensure the date-filtered history query is answered from the (patient, timestamp) index
+        and does not sort the patient's readings in memory.
+        """
+        HeartRate.objects.bulk_create(HeartRate(patient=self.patient1, value=70) for _ in range(3))
+        self.client.force_authenticate(user=self.doctor1)
+
+        url = reverse('patient-heart-rates', kwargs={'patient_pk': self.patient1.pk})
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url, {'start_date': '2025-01-01'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        history_sql = next(
+            q['sql'] for q in ctx.captured_queries if 'FROM "patient_heartrate"' in q['sql'] and 'ORDER BY' in q['sql']
+        )
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + history_sql)
+            plan = ' | '.join(row[-1] for row in cursor.fetchall())
+
+        self.assertIn('heartrate_patient_ts', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+
+# The query counts are those of building the responses, not of serving them from the response cache
+@override_settings(RESPONSE_CACHE_TTL=0)
+class QueryCountTests(APITestCase):
+    """
+    Pins the number of queries per endpoint so that serializing a longer page
+    never adds per-row queries (N+1).
+    """
+    def setUp(self):
+        # Users without passwords keep the setup fast; requests are force-authenticated
+        self.hod = CustomUser.objects.create_user(username='hod', role=CustomUser.Role.HOD)
+        self.doctor = CustomUser.objects.create_user(username='doctor', role=CustomUser.Role.DOCTOR)
+        self.patient = self.add_patient('patient0')
+        alert_engine.reset()
+        cache.clear()
+
+    def add_patient(self, username):
+        user = CustomUser.objects.create_user(username=username, role=CustomUser.Role.PATIENT)
+        return Patient.objects.create(user=user, doctor=self.doctor, full_name=username, age=30, address='Ward 1', blood_group='O+')
+
+    def test_patient_list_queries_do_not_grow_with_page(self):
+        """
+        Ensure listing patients costs a COUNT and one SELECT whether the page has one row or a full page.
+        """
+        self.client.force_authenticate(user=self.doctor)
+        url = reverse('patient-list')
+
+        # A cold vitals cache costs one more query for the whole page
+        with self.assertNumQueries(3):
+            response = self.client.get(url)
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        self.assertEqual(len(response.data['results']), 1)
+
+        for i in range(1, 5):
+            self.add_patient(f'patient{i}')
+        self.client.force_authenticate(user=self.hod)
+        self.client.get(url)
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertEqual(response.data['results'][0]['doctor_username'], 'doctor')
+
+    def test_patient_retrieve_is_one_query(self):
+        """
+        Ensure a patient detail, usernames and cached vitals included, is read with one query.
+        """
+        self.client.force_authenticate(user=self.doctor)
+        url = reverse('patient-detail', kwargs={'pk': self.patient.pk})
+        self.client.get(url)
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEqual(response.data['user_username'], 'patient0')
+
+    def test_heart_rate_list_queries_do_not_grow_with_page_size(self):
+        """
+        Ensure a heart rate page is one query for any page size, plus the archive index and the access check.
+        """
+        HeartRate.objects.bulk_create(HeartRate(patient=self.patient, value=70 + i) for i in range(50))
+        self.client.force_authenticate(user=self.doctor)
+        url = reverse('patient-heart-rates', kwargs={'patient_pk': self.patient.pk})
+
+        for page_size in (1, 50):
+            with self.assertNumQueries(3):
+                response = self.client.get(url, {'page_size': page_size})
+            self.assertEqual(len(response.data['results']), page_size)
+
+    def test_ward_queries_do_not_grow_with_patients(self):
+        """
+        Ensure the ward view is two queries (patients, then their data) for one patient or many, in both modes.
+        """
+        self.client.force_authenticate(user=self.doctor)
+        url = reverse('heart-rates-ward')
+        patients = [self.patient] + [self.add_patient(f'patient{i}') for i in range(1, 6)]
+        HeartRate.objects.bulk_create(HeartRate(patient=patient, value=70) for patient in patients for _ in range(3))
+
+        for params in ({'mode': 'readings'}, {'bucket': '1m'}):
+            for ids in (str(self.patient.pk), ','.join(str(p.pk) for p in patients)):
+                with self.assertNumQueries(2):
+                    response = self.client.get(url, {**params, 'patients': ids})
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(len(response.data['results']), 6)
+        self.assertEqual([len(s['readings']) for s in self.client.get(url, {'mode': 'readings'}).data['results']], [3] * 6)
+
+    def test_heart_rate_access_is_checked_once_per_request(self):
+        """
+        Ensure the patient access check is one query shared by every lookup in a request,
+        and follows a patient moving to another doctor from the next request on.
+        """
+        self.client.force_authenticate(user=self.doctor)
+        url = reverse('patient-heart-rates-aggregate', kwargs={'patient_pk': self.patient.pk})
+
+        def access_queries():
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.get(url, {'mode': 'lttb'})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return len([q for q in ctx.captured_queries if 'FROM "patient_patient"' in q['sql']])
+
+        HeartRate.objects.create(patient=self.patient, value=70)
+        # Readings and archives are both scoped, with one check
+        self.assertEqual(access_queries(), 1)
+        self.assertEqual(access_queries(), 1)
+
+        # Even an update that sends no signal is seen at once
+        other = CustomUser.objects.create_user(username='other', role=CustomUser.Role.DOCTOR)
+        Patient.objects.filter(pk=self.patient.pk).update(doctor=other)
+        self.assertEqual(self.client.get(url, {'mode': 'lttb'}).data['results'], [])
+
+    def test_heart_rate_ingest_queries_do_not_grow_with_batch_size(self):
+        """
+        Ensure posting 1 or 150 readings (within one minute) runs the same number of queries.
+        (Much larger batches are split into several INSERTs by the database parameter limit.)
+        """
+        self.client.force_authenticate(user=self.doctor)
+        url = reverse('patient-heart-rates', kwargs={'patient_pk': self.patient.pk})
+        start = datetime(2025, 1, 1, 10, 0, tzinfo=dt_timezone.utc)
+
+        def post(count, minute):
+            data = [
+                {'value': 70, 'timestamp': (start + timedelta(minutes=minute, seconds=i * 0.3)).isoformat()}
+                for i in range(count)
+            ]
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.post(url, data, format='json')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            return len(ctx.captured_queries)
+
+        post(1, minute=0)  # First batch creates the hour rollup and loads alert rules
+        self.assertEqual(post(1, minute=1), post(150, minute=2))
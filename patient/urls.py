@@ -1,11 +1,22 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import PatientViewSet, HeartRateListCreateView
+from .views import (
+    PatientViewSet, HeartRateListCreateView, HeartRateBulkCreateView, HeartRateAggregateView, HeartRateExportView,
+    WardHeartRateView, DeviceHeartRateView, AlertRuleViewSet, AlertViewSet, DeviceKeyViewSet,
+)
 
 router = DefaultRouter()
 router.register(r'patients', PatientViewSet, basename='patient')
+router.register(r'alert-rules', AlertRuleViewSet, basename='alert-rule')
+router.register(r'alerts', AlertViewSet, basename='alert')
+router.register(r'device-keys', DeviceKeyViewSet, basename='device-key')
 
 urlpatterns = [
     path('', include(router.urls)),
     path('patients/<int:patient_pk>/heart-rates/', HeartRateListCreateView.as_view(), name='patient-heart-rates'),
+    path('patients/<int:patient_pk>/heart-rates/aggregate/', HeartRateAggregateView.as_view(), name='patient-heart-rates-aggregate'),
+    path('patients/<int:patient_pk>/heart-rates/export/', HeartRateExportView.as_view(), name='patient-heart-rates-export'),
+    path('heart-rates/bulk/', HeartRateBulkCreateView.as_view(), name='heart-rates-bulk'),
+    path('heart-rates/device/', DeviceHeartRateView.as_view(), name='heart-rates-device'),
+    path('heart-rates/ward/', WardHeartRateView.as_view(), name='heart-rates-ward'),
 ]
\ No newline at end of file
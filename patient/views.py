@@ -1,19 +1,58 @@
-from django.shortcuts import get_object_or_404
-from rest_framework import viewsets, generics
+from datetime import datetime, time, timedelta
+from itertools import dropwhile
+from django.http import Http404, StreamingHttpResponse
+from rest_framework import viewsets, generics, mixins, status
+from rest_framework.exceptions import PermissionDenied, ValidationError
 from rest_framework.permissions import IsAuthenticated
-from .models import Patient, HeartRate
-from .serializers import PatientSerializer, HeartRateSerializer
+from rest_framework.response import Response
+from django.db.models import Q
+from django.utils import timezone
+from .models import Patient, HeartRate, HeartRateMinute, HeartRateHour, HeartRateArchive, AlertRule, Alert, DeviceKey
+from .serializers import (
+    PatientSerializer, HeartRateSerializer, BulkHeartRateSerializer,
+    HeartRateAggregateQuerySerializer, HeartRateBucketSerializer, HeartRatePointSerializer,
+    HeartRateExportQuerySerializer, AlertRuleSerializer, AlertSerializer, DeviceKeySerializer,
+    WardQuerySerializer, WardBucketSeriesSerializer, WardReadingSeriesSerializer,
+)
+from .access import access_scope
+from .aggregation import rollup_stats, downsample, rollup_stats_by_patient, latest_readings_by_patient
+from .archive import archived_rows
+from .devices import DeviceKeyAuthentication, IsDevice
+from .export import EXPORT_FORMATS
 from users.permissions import IsDoctor, IsHOD, IsPatient
-from .filters import PatientFilter, HeartRateFilter
+from .filters import PatientFilter, WardFilter, HeartRateFilter, HeartRateRollupFilter, AlertFilter
+from .pagination import HeartRateCursorPagination
+from .response_cache import CachedListMixin
+from .vitals import get_latest_vitals
+from .writebehind import accept_readings, write_behind_enabled
+from heart_monitor.middleware import TimedSerializationMixin, serializing
 
-class PatientViewSet(viewsets.ModelViewSet):
+
+class PatientViewSet(CachedListMixin, TimedSerializationMixin, viewsets.ModelViewSet):
     """
     ViewSet for Doctors and HODs to manage patients.
     Supports filtering by name and age.
+    Each patient includes their latest heart rate, served from the vitals cache.
+    Lists are cached per user and carry an ETag; an unchanged list answers 304 without a query.
     """
     serializer_class = PatientSerializer
     permission_classes = [IsAuthenticated, IsDoctor | IsHOD]
     filterset_class = PatientFilter
+    # The latest heart rate is part of each patient, so new readings change the list too
+    cache_version_names = ['patients', 'doctor:{user.pk}']
+
+    def cache_versions(self):
+        # An HOD lists every patient, so readings for any of them count
+        if self.request.user.role == 'HOD':
+            return ['patients', 'readings']
+        return super().cache_versions()
+
+    def get_serializer(self, *args, **kwargs):
+        # Look up the latest vitals for a whole page in one go
+        if args and kwargs.get('many'):
+            context = kwargs.setdefault('context', self.get_serializer_context())
+            context['vitals'] = get_latest_vitals([patient.pk for patient in args[0]])
+        return super().get_serializer(*args, **kwargs)
     
     def get_queryset(self):
 
@@ -21,49 +60,451 @@ class PatientViewSet(viewsets.ModelViewSet):
         if getattr(self, 'swagger_fake_view', False):
             return Patient.objects.none()
 
-        user = self.request.user
-        if user.role == 'HOD':
-            return Patient.objects.all()
-        elif user.role == 'DOCTOR':
-            return Patient.objects.filter(doctor=user)
-        return Patient.objects.none()
+        # Fetch the usernames shown by PatientSerializer in the same query, without the rest of the user rows
+        patients = Patient.objects.select_related('user', 'doctor').only(
+            *[field.name for field in Patient._meta.concrete_fields], 'user__username', 'doctor__username'
+        )
+        return access_scope(self.request).managed_patients(patients)
 
-class HeartRateListCreateView(generics.ListCreateAPIView):
+
+class PatientHeartRateMixin:
+    """
+    Scopes heart rate queries to the patient in the URL and to what the requesting user may see.
+    """
+    archives = None  # The patient's HeartRateArchive rows, once loaded
+
+    def get_queryset(self):
+
+        if getattr(self, 'swagger_fake_view', False):
+            return HeartRate.objects.none()
+        return self.scope(HeartRate.objects.all())
+
+    def scope(self, queryset):
+        """
+        Restricts a queryset of per-patient rows (readings, rollups or archives) to the patient in the URL.
+        Access is checked once per request, so the row queries need no join to the patient.
+        """
+        # A patient can only see their own data, a doctor the data of patients they manage
+        return access_scope(self.request).readable_rows(queryset, self.kwargs['patient_pk'])
+
+    def writable_patient_pk(self):
+        """The patient in the URL, if the user may add data for them."""
+        patient_pk = self.kwargs['patient_pk']
+        scope = access_scope(self.request)
+        if not scope.exists(patient_pk):
+            raise Http404
+
+        # A doctor can only create heart rate data for their own patients
+        if not scope.can_write(patient_pk):
+            raise PermissionDenied("You do not have permission to add data for this patient.")
+        return patient_pk
+
+    def archive_index(self):
+        # Async views load it up front with the async ORM, as they cannot run a query from here
+        if self.archives is None:
+            self.archives = list(self.scope(HeartRateArchive.objects.all()))
+        return self.archives
+
+    def archived_rows(self, descending=False, position=None):
+        """
+        Archived readings of the patient in the URL that match the heart rate filters, as
+        (id, timestamp, value, device_id, sequence) tuples, oldest first (newest first when `descending`).
+        With a (timestamp, id) `position`, only the rows that come after it in that order.
+        Costs one query for the patient's archive index; files outside the range are not read.
+        """
+        archives = self.archive_index()
+        if not archives:
+            return iter(())
+
+        filterset = HeartRateFilter(self.request.query_params, queryset=HeartRate.objects.none())
+        filterset.is_valid()
+        options = filterset.form.cleaned_data
+        # Dates compare against timestamps as midnight in the current time zone, as in the database query
+        start, end = [
+            timezone.make_aware(datetime.combine(day, time.min)) if day else None
+            for day in (options.get('start_date'), options.get('end_date'))
+        ]
+        if position is not None:
+            if descending:
+                end = min(end, position[0]) if end else position[0]
+            else:
+                start = max(start, position[0]) if start else position[0]
+
+        rows = archived_rows(archives, start, end, descending)
+        if position is not None:
+            # Skip the ties with the position that were already served
+            if descending:
+                rows = dropwhile(lambda row: (row[1], row[0]) >= position, rows)
+            else:
+                rows = dropwhile(lambda row: (row[1], row[0]) <= position, rows)
+        if options.get('value') is not None:
+            rows = (row for row in rows if row[2] == options['value'])
+        return rows
+
+
+class ReadingBatchMixin:
+    """
+    Takes either a single reading or a JSON list of up to max_batch_size readings in the body.
+    """
+    max_batch_size = 1000
+
+    def get_serializer(self, *args, **kwargs):
+        # A JSON list in the body is a batch of readings for this patient
+        if isinstance(kwargs.get('data'), list):
+            kwargs['many'] = True
+            kwargs['max_length'] = self.max_batch_size
+        return super().get_serializer(*args, **kwargs)
+
+
+class HeartRateListCreateView(CachedListMixin, TimedSerializationMixin, PatientHeartRateMixin, ReadingBatchMixin,
+                              generics.ListCreateAPIView):
     """
     API view for listing and creating heart rate records for a specific patient.
     - Doctors can create/view heart rates for their patients.
     - Patients can only view their own heart rate history.
     - Supports filtering by date range.
+    - Accepts either a single reading or a list of readings per POST.
+    - With HEART_RATE_WRITE_BEHIND, POSTs answer 202 once the readings are queued (503 when the queue is full).
+    - Uses cursor pagination, newest first (`?page_size=` up to 1000).
+    - Pages continue into archived months once the live readings run out.
+    - Pages are cached per user and carry an ETag; an unchanged page answers 304 without a query.
+    """
+    serializer_class = HeartRateSerializer
+    permission_classes = [IsAuthenticated, IsDoctor | IsPatient]
+    filterset_class = HeartRateFilter
+    pagination_class = HeartRateCursorPagination
+    cache_version_names = ['patient:{patient_pk}']
+
+    def archived_readings(self, position=None, backwards=False):
+        # Unsaved HeartRate objects so archived rows serialize like live ones
+        patient_id = self.kwargs['patient_pk']
+        for pk, timestamp, value, device_id, sequence in self.archived_rows(not backwards, position):
+            yield HeartRate(pk=pk, patient_id=patient_id, value=value, timestamp=timestamp,
+                            device_id=device_id, sequence=sequence)
+
+    def create(self, request, *args, **kwargs):
+        if not write_behind_enabled():
+            return super().create(request, *args, **kwargs)
+
+        # Write-behind: validated, checked and queued; stored shortly after the response
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        patient_pk = self.writable_patient_pk()
+        items = serializer.validated_data if isinstance(serializer.validated_data, list) else [serializer.validated_data]
+        accepted = accept_readings([{**item, 'patient_id': patient_pk} for item in items], request.user)
+        return Response({'accepted': accepted}, status=status.HTTP_202_ACCEPTED)
+
+    def perform_create(self, serializer):
+        serializer.save(patient_id=self.writable_patient_pk())
+
+
+class HeartRateBulkCreateView(generics.GenericAPIView):
+    """
+    API view for ingesting a batch of heart rate readings that spans several patients.
+    - Only doctors can ingest, and only for patients they manage.
+    - Ownership is checked with one query for the whole batch.
+    - Readings are written with a single bulk insert inside one transaction,
+      or queued for the background writer (202) with HEART_RATE_WRITE_BEHIND.
+    """
+    serializer_class = BulkHeartRateSerializer
+    permission_classes = [IsAuthenticated, IsDoctor]
+    max_batch_size = 1000
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data, many=True, max_length=self.max_batch_size)
+        serializer.is_valid(raise_exception=True)
+
+        patient_ids = {item['patient_id'] for item in serializer.validated_data}
+        if patient_ids - access_scope(request).writable(patient_ids):
+            raise PermissionDenied("You do not have permission to add data for one or more of these patients.")
+
+        if write_behind_enabled():
+            accepted = accept_readings(serializer.validated_data, request.user)
+            return Response({'accepted': accepted}, status=status.HTTP_202_ACCEPTED)
+
+        serializer.save()
+        with serializing():
+            data = serializer.data
+        return Response(data, status=status.HTTP_201_CREATED)
+
+
+class DeviceHeartRateView(ReadingBatchMixin, generics.CreateAPIView):
+    """
+    API view for monitors posting readings with a device key (`Authorization: Device <key>`).
+    - The key decides the patient; no user, token or ownership lookups are made.
+    - Accepts either a single reading or a list of readings per POST.
+    - With HEART_RATE_WRITE_BEHIND, POSTs answer 202 once the readings are queued (503 when the queue is full).
     """
     serializer_class = HeartRateSerializer
+    authentication_classes = [DeviceKeyAuthentication]
+    permission_classes = [IsDevice]
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        patient_pk = request.user.patient_id
+
+        if write_behind_enabled():
+            items = serializer.validated_data if isinstance(serializer.validated_data, list) else [serializer.validated_data]
+            accepted = accept_readings([{**item, 'patient_id': patient_pk} for item in items], request.user)
+            return Response({'accepted': accepted}, status=status.HTTP_202_ACCEPTED)
+
+        serializer.save(patient_id=patient_pk)
+        with serializing():
+            data = serializer.data
+        return Response(data, status=status.HTTP_201_CREATED)
+
+
+class HeartRateAggregateView(PatientHeartRateMixin, generics.GenericAPIView):
+    """
+    API view returning a patient's heart rate history reduced for charting.
+    - `mode=buckets` (default): min/max/avg/count per `bucket` (1m, 5m, 1h, 1d), read from the rollup tables.
+    - `mode=lttb`: at most `points` raw readings chosen with Largest-Triangle-Three-Buckets, archived ones included.
+    - Supports the same date range filters and access rules as the heart rate list.
+    """
+    permission_classes = [IsAuthenticated, IsDoctor | IsPatient]
+    filterset_class = HeartRateFilter
+    serializer_class = HeartRateBucketSerializer
+
+    def get(self, request, *args, **kwargs):
+        params = HeartRateAggregateQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        options = params.validated_data
+
+        if options['mode'] == 'lttb':
+            queryset = self.filter_queryset(self.get_queryset())
+            # Archived rows are read twice, to count and to stream them, rather than held in memory
+            archived_count = sum(1 for _ in self.archived_rows())
+            archived = ((row[1], row[2]) for row in self.archived_rows())
+            points = [
+                {'timestamp': timestamp, 'value': value}
+                for timestamp, value in downsample(queryset, options['points'], archived, archived_count)
+            ]
+            with serializing():
+                results = HeartRatePointSerializer(points, many=True).data
+            return Response({'mode': 'lttb', 'results': results})
+
+        bucket = options['bucket']
+        rollup_model = HeartRateMinute if bucket in ('1m', '5m') else HeartRateHour
+        rollups = HeartRateRollupFilter(request.query_params, queryset=self.scope(rollup_model.objects.all())).qs
+        stats = rollup_stats(rollups, bucket)
+        with serializing():
+            results = HeartRateBucketSerializer(stats, many=True).data
+        return Response({
+            'mode': 'buckets',
+            'bucket': bucket,
+            'results': results,
+        })
+
+
+class HeartRateExportView(PatientHeartRateMixin, generics.GenericAPIView):
+    """
+    API view streaming a patient's full heart rate history as a file download.
+    - `output=ndjson` (default) or `output=csv`.
+    - Rows are read in chunks and written as they arrive, so memory use does not grow with the history.
+    - Archived months are read from their files and merged in.
+    - Supports the same date range filters and access rules as the heart rate list.
+    """
     permission_classes = [IsAuthenticated, IsDoctor | IsPatient]
     filterset_class = HeartRateFilter
+    serializer_class = HeartRateSerializer
+
+    def get(self, request, *args, **kwargs):
+        output = self.export_output()
+        lines = EXPORT_FORMATS[output][0]
+        queryset = self.filter_queryset(self.get_queryset())
+        return self.export_response(output, lines(queryset, self.archived_rows()))
+
+    def export_output(self):
+        params = HeartRateExportQuerySerializer(data=self.request.query_params)
+        params.is_valid(raise_exception=True)
+        return params.validated_data['output']
+
+    def export_response(self, output, lines):
+        _, content_type, extension = EXPORT_FORMATS[output]
+        response = StreamingHttpResponse(lines, content_type=content_type)
+        response['Content-Disposition'] = (
+            f'attachment; filename="patient-{self.kwargs["patient_pk"]}-heart-rates.{extension}"'
+        )
+        return response
+
+
+class WardHeartRateView(generics.GenericAPIView):
+    """
+    API view returning heart rate series for many patients in one call, for ward dashboards.
+    - Doctors get the patients they manage, HODs every patient (`doctor=` narrows it down).
+    - Patients are picked with `patients=1,2,3` and the patient list filters (`full_name__icontains`, `age__gte`, ...).
+    - `mode=buckets` (default): min/max/avg/count per `bucket` (1m, 5m, 1h, 1d), read from the rollup tables.
+    - `mode=readings`: the latest `limit` readings of each patient.
+    - Covers `since` to `until` (ISO datetimes), the last hour by default.
+    - Two queries whatever the number of patients: one for the patients, one for all of their data.
+    """
+    permission_classes = [IsAuthenticated, IsDoctor | IsHOD]
+    filterset_class = WardFilter
+    serializer_class = WardBucketSeriesSerializer
+    default_window = timedelta(hours=1)
+    max_patients = 200
 
     def get_queryset(self):
 
         if getattr(self, 'swagger_fake_view', False):
-            return HeartRate.objects.none()
-        patient_pk = self.kwargs['patient_pk']
+            return Patient.objects.none()
+        return access_scope(self.request).managed_patients().order_by('pk')
+
+    def get(self, request, *args, **kwargs):
+        params = WardQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        options = params.validated_data
+        until = options.get('until') or timezone.now()
+        since = options.get('since') or until - self.default_window
+
+        patients = list(
+            self.filter_queryset(self.get_queryset()).values_list('pk', 'full_name')[:self.max_patients + 1]
+        )
+        if len(patients) > self.max_patients:
+            raise ValidationError({'patients': [f"Narrow the ward down to at most {self.max_patients} patients."]})
+        patient_ids = [pk for pk, _ in patients]
+
+        if options['mode'] == 'readings':
+            readings = HeartRate.objects.filter(patient_id__in=patient_ids, timestamp__gte=since, timestamp__lt=until)
+            points = latest_readings_by_patient(readings, options['limit'])
+            series = [
+                {'patient': pk, 'full_name': name,
+                 'readings': [{'timestamp': timestamp, 'value': value} for timestamp, value in points.get(pk, [])]}
+                for pk, name in patients
+            ]
+            with serializing():
+                results = WardReadingSeriesSerializer(series, many=True).data
+            return Response({
+                'mode': 'readings',
+                'since': since,
+                'until': until,
+                'results': results,
+            })
+
+        bucket = options['bucket']
+        rollup_model = HeartRateMinute if bucket in ('1m', '5m') else HeartRateHour
+        # Rollup buckets that start within the window
+        rollups = rollup_model.objects.filter(patient_id__in=patient_ids, bucket__gte=since, bucket__lt=until)
+        buckets = rollup_stats_by_patient(rollups, bucket)
+        series = [{'patient': pk, 'full_name': name, 'buckets': buckets.get(pk, [])} for pk, name in patients]
+        with serializing():
+            results = WardBucketSeriesSerializer(series, many=True).data
+        return Response({
+            'mode': 'buckets',
+            'bucket': bucket,
+            'since': since,
+            'until': until,
+            'results': results,
+        })
+
+
+class AlertRuleViewSet(TimedSerializationMixin, viewsets.ModelViewSet):
+    """
+    ViewSet for Doctors and HODs to manage heart rate alert rules.
+    - A rule with a patient applies to that patient; without one it covers all of the doctor's patients.
+    - Doctors only see and manage rules for their own patients.
+    """
+    serializer_class = AlertRuleSerializer
+    permission_classes = [IsAuthenticated, IsDoctor | IsHOD]
+
+    def get_queryset(self):
+
+        if getattr(self, 'swagger_fake_view', False):
+            return AlertRule.objects.none()
+
         user = self.request.user
-        
-        # Ensure the user has permission to view this patient's data
-        if user.role == 'PATIENT':
-            # A patient can only see their own data
-            return HeartRate.objects.filter(patient__user=user, patient_id=patient_pk)
+        if user.role == 'HOD':
+            return AlertRule.objects.all()
         elif user.role == 'DOCTOR':
-            # A doctor can only see data for patients they manage
-            return HeartRate.objects.filter(patient__doctor=user, patient_id=patient_pk)
-        
-        return HeartRate.objects.none()
+            return AlertRule.objects.filter(Q(doctor=user) | Q(patient__doctor=user))
+        return AlertRule.objects.none()
+
+    def check_patient(self, patient):
+        # A doctor can only attach rules to their own patients
+        if self.request.user.role == 'DOCTOR' and patient.doctor_id != self.request.user.pk:
+            raise PermissionDenied("You do not have permission to add rules for this patient.")
+
+    def rule_doctor(self, serializer):
+        # A rule without a patient covers a doctor's patients: a doctor's own, or the ones of the doctor an HOD names
+        user = self.request.user
+        if user.role == 'DOCTOR':
+            return user
+        doctor = serializer.validated_data.get('doctor')
+        rule = serializer.instance
+        if doctor is None and rule is not None:
+            doctor = rule.doctor or (rule.patient.doctor if rule.patient is not None else None)
+        if doctor is None:
+            raise ValidationError({'doctor': "Name the doctor whose patients a rule without a patient covers."})
+        return doctor
 
     def perform_create(self, serializer):
-        patient = get_object_or_404(Patient, pk=self.kwargs['patient_pk'])
-            
-            # A doctor can only create heart rate data for their own patients
-        if self.request.user != patient.doctor:
-            from rest_framework.exceptions import PermissionDenied
-            raise PermissionDenied("You do not have permission to add data for this patient.")
+        patient = serializer.validated_data.get('patient')
+        if patient is None:
+            serializer.save(doctor=self.rule_doctor(serializer))
+        else:
+            self.check_patient(patient)
+            serializer.save(doctor=None)
+
+    def perform_update(self, serializer):
+        patient = serializer.validated_data.get('patient', serializer.instance.patient)
+        if patient is None:
+            # Clearing the patient turns the rule into one for all of a doctor's patients
+            serializer.save(doctor=self.rule_doctor(serializer))
+        else:
+            self.check_patient(patient)
+            serializer.save(doctor=None)
+
+
+class AlertViewSet(TimedSerializationMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    ViewSet for Doctors and HODs to review alerts raised on ingest.
+    Supports filtering by patient, kind and `since` (ISO datetime).
+    """
+    serializer_class = AlertSerializer
+    permission_classes = [IsAuthenticated, IsDoctor | IsHOD]
+    filterset_class = AlertFilter
+
+    def get_queryset(self):
 
-        serializer.save(patient=patient)
+        if getattr(self, 'swagger_fake_view', False):
+            return Alert.objects.none()
 
-    
\ No newline at end of file
+        user = self.request.user
+        alerts = Alert.objects.select_related('rule')
+        if user.role == 'HOD':
+            return alerts
+        elif user.role == 'DOCTOR':
+            return alerts.filter(patient__doctor=user)
+        return Alert.objects.none()
+
+
+class DeviceKeyViewSet(TimedSerializationMixin, mixins.CreateModelMixin, mixins.RetrieveModelMixin, mixins.DestroyModelMixin,
+                       mixins.ListModelMixin, viewsets.GenericViewSet):
+    """
+    ViewSet for Doctors and HODs to issue and revoke device keys.
+    - A key lets one monitor post readings for one patient (see DeviceHeartRateView).
+    - The key is only returned when it is created; deleting it revokes it.
+    - Doctors only see and manage keys for their own patients.
+    """
+    serializer_class = DeviceKeySerializer
+    permission_classes = [IsAuthenticated, IsDoctor | IsHOD]
+
+    def get_queryset(self):
+
+        if getattr(self, 'swagger_fake_view', False):
+            return DeviceKey.objects.none()
+
+        user = self.request.user
+        if user.role == 'HOD':
+            return DeviceKey.objects.all()
+        elif user.role == 'DOCTOR':
+            return DeviceKey.objects.filter(patient__doctor=user)
+        return DeviceKey.objects.none()
+
+    def perform_create(self, serializer):
+        # A doctor can only issue keys for their own patients
+        patient = serializer.validated_data['patient']
+        if self.request.user.role == 'DOCTOR' and patient.doctor_id != self.request.user.pk:
+            raise PermissionDenied("You do not have permission to issue keys for this patient.")
+        serializer.save()
@@ -0,0 +1,112 @@
+from datetime import timedelta
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+from .aggregation import floor_time
+from .models import HeartRate, HeartRateMinute, Patient
+
+MINUTE = timedelta(minutes=1)
+AVERAGE_MINUTES = 5
+
+
+def vitals_key(patient_id):
+    return f'vitals:{patient_id}'
+
+
+def vitals_ttl():
+    # Bounds staleness when each process has its own cache; a shared backend stays current via write-through
+    return getattr(settings, 'LATEST_VITALS_TTL', 60)
+
+
+def recent_averages(latest):
+    """
+    Returns {patient_id: average} over the last five minute rollups up to each patient's latest reading.
+    `latest` maps patient ids to the timestamp of their latest reading. One query for all patients.
+    """
+    if not latest:
+        return {}
+    last_bucket = {pk: floor_time(ts, MINUTE) for pk, ts in latest.items()}
+    window = (AVERAGE_MINUTES - 1) * MINUTE
+    rows = HeartRateMinute.objects.filter(
+        patient_id__in=last_bucket, bucket__gte=min(last_bucket.values()) - window,
+    ).values_list('patient_id', 'bucket', 'total', 'count')
+
+    sums = {}
+    for patient_id, bucket, total, count in rows:
+        if last_bucket[patient_id] - window <= bucket <= last_bucket[patient_id]:
+            running = sums.setdefault(patient_id, [0, 0])
+            running[0] += total
+            running[1] += count
+    return {pk: total / count for pk, (total, count) in sums.items()}
+
+
+def update_vitals(readings):
+    """
+    Write-through for the latest vitals cache: refreshes cached entries of the patients in a batch.
+    Patients not currently cached are left to be filled on the next read. The cache is written
+    only once the ingest transaction commits.
+    """
+    newest = {}
+    for reading in readings:
+        current = newest.get(reading.patient_id)
+        if current is None or reading.timestamp >= current.timestamp:
+            newest[reading.patient_id] = reading
+
+    cached = cache.get_many([vitals_key(pk) for pk in newest])
+    latest = {}
+    for pk, reading in newest.items():
+        entry = cached.get(vitals_key(pk), False)
+        if entry is False:
+            continue
+        # Late replays of older readings do not replace a newer latest value
+        if entry is None or entry['timestamp'] <= reading.timestamp:
+            latest[pk] = reading
+    if not latest:
+        return
+
+    averages = recent_averages({pk: reading.timestamp for pk, reading in latest.items()})
+    entries = {
+        vitals_key(pk): {'value': reading.value, 'timestamp': reading.timestamp, 'avg_5m': averages.get(pk)}
+        for pk, reading in latest.items()
+    }
+    transaction.on_commit(lambda: cache.set_many(entries, timeout=vitals_ttl()))
+
+
+def get_latest_vitals(patient_ids):
+    """
+    Returns {patient_id: {'value', 'timestamp', 'avg_5m'} or None} for the given patients.
+    Cached entries cost no query; the misses are filled with two queries in total.
+    """
+    keys = {vitals_key(pk): pk for pk in patient_ids}
+    vitals = {keys[key]: entry for key, entry in cache.get_many(keys).items()}
+    missing = [pk for pk in patient_ids if pk not in vitals]
+    if not missing:
+        return vitals
+
+    newest = HeartRate.objects.filter(patient=OuterRef('pk')).order_by('-timestamp', '-id')
+    rows = Patient.objects.filter(pk__in=missing).annotate(
+        latest_value=Subquery(newest.values('value')[:1]),
+        latest_timestamp=Subquery(newest.values('timestamp')[:1]),
+    ).values_list('pk', 'latest_value', 'latest_timestamp')
+    latest = {pk: (value, timestamp) for pk, value, timestamp in rows if timestamp is not None}
+
+    averages = recent_averages({pk: timestamp for pk, (_, timestamp) in latest.items()})
+    filled = {
+        pk: {'value': latest[pk][0], 'timestamp': latest[pk][1], 'avg_5m': averages.get(pk)} if pk in latest else None
+        for pk in missing
+    }
+    cache.set_many({vitals_key(pk): entry for pk, entry in filled.items()}, timeout=vitals_ttl())
+    vitals.update(filled)
+    return vitals
+
+
+async def aget_latest_vitals(patient_ids):
+    """get_latest_vitals() for async views. Cached entries are read asynchronously, misses are filled on a thread."""
+    keys = {vitals_key(pk): pk for pk in patient_ids}
+    vitals = {keys[key]: entry for key, entry in (await cache.aget_many(keys)).items()}
+    missing = [pk for pk in patient_ids if pk not in vitals]
+    if missing:
+        vitals.update(await sync_to_async(get_latest_vitals)(missing))
+    return vitals
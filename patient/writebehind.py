@@ -0,0 +1,265 @@
+"""
+Write-behind ingestion, switched on with HEART_RATE_WRITE_BEHIND.
+
+Validated readings are appended to a local journal (fsynced), acknowledged with 202, and stored
+by a background thread in batches of HEART_RATE_WRITE_BEHIND_BATCH_SIZE, at least every
+HEART_RATE_WRITE_BEHIND_FLUSH_SECONDS. When HEART_RATE_WRITE_BEHIND_MAX_PENDING readings are
+waiting, new ones are refused with 503 until the writer catches up.
+
+Journal segments are deleted once their readings are committed. A process that starts after a
+crash adopts the segments of buffers that are gone (their lock file is no longer held) and stores
+them first. Delivery is at least once: readings with a device sequence are deduplicated as usual,
+readings without one can be stored twice if the crash fell between a commit and the cleanup.
+"""
+import atexit
+import fcntl
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+from uuid import uuid4
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from .ingest import store_readings
+from .models import HeartRate, Patient
+
+logger = logging.getLogger(__name__)
+
+
+class IngestQueueFull(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Too many readings are waiting to be stored, retry shortly.'
+    default_code = 'ingest_queue_full'
+    wait = 1  # Sent as Retry-After by the DRF exception handler
+
+
+def _lock(path):
+    """Opens and exclusively locks a file, or returns None if another live buffer holds it."""
+    handle = open(path, 'a')
+    try:
+        fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        handle.close()
+        return None
+    return handle
+
+
+def _read_segment(path):
+    records = []
+    with open(path) as handle:
+        for line in handle:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                # A torn last line was never acknowledged
+                break
+    return records
+
+
+class WriteBehindBuffer:
+    """
+    Journaled queue of acknowledged readings plus the thread that stores them, see the module docstring.
+    """
+    def __init__(self, spill_dir, max_pending=10000, batch_size=500, flush_seconds=0.5, fsync=True):
+        self.spill_dir = Path(spill_dir)
+        self.spill_dir.mkdir(parents=True, exist_ok=True)
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.fsync = fsync
+        self.token = uuid4().hex
+
+        self._lock = threading.Lock()        # pending records and the open journal segment
+        self._flush_lock = threading.Lock()  # one flush at a time
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread = None
+        self._pending = []   # acknowledged records not stored yet
+        self._sealed = []    # closed journal segments, deleted once everything is stored
+        self._segments = 0
+
+        # Held for the life of the buffer; a lock that can be taken means its buffer is gone
+        self._lock_file = _lock(self.spill_dir / f'{self.token}.lock')
+        self.recover()
+        self._journal_path, self._journal = self._open_segment()
+
+    def _open_segment(self):
+        self._segments += 1
+        path = self.spill_dir / f'{self.token}-{self._segments:06d}.jsonl'
+        return path, open(path, 'a')
+
+    def recover(self):
+        """Adopts the journal segments of buffers whose process is gone. Returns the number of readings adopted."""
+        adopted = 0
+        owners = {path.name.split('-', 1)[0] for path in self.spill_dir.glob('*.jsonl')} - {self.token}
+        for owner in sorted(owners):
+            lock = _lock(self.spill_dir / f'{owner}.lock')
+            if lock is None:
+                continue  # Still running
+            try:
+                for path in sorted(self.spill_dir.glob(f'{owner}-*.jsonl')):
+                    # Renamed first, so no other process can adopt the same segment
+                    self._segments += 1
+                    claimed = self.spill_dir / f'{self.token}-{self._segments:06d}.jsonl'
+                    os.rename(path, claimed)
+                    records = _read_segment(claimed)
+                    self._pending.extend(records)
+                    self._sealed.append(claimed)
+                    adopted += len(records)
+            finally:
+                (self.spill_dir / f'{owner}.lock').unlink(missing_ok=True)
+                lock.close()
+        if adopted:
+            logger.warning("Recovered %d acknowledged heart rate readings from %s", adopted, self.spill_dir)
+        return adopted
+
+    def pending(self):
+        with self._lock:
+            return len(self._pending)
+
+    def enqueue(self, records):
+        """Journals and queues records; raises IngestQueueFull when the queue has no room for them."""
+        with self._lock:
+            if len(self._pending) + len(records) > self.max_pending:
+                raise IngestQueueFull()
+            self._journal.write(''.join(json.dumps(record) + '\n' for record in records))
+            self._journal.flush()
+            if self.fsync:
+                os.fsync(self._journal.fileno())
+            self._pending.extend(records)
+            batch_ready = len(self._pending) >= self.batch_size
+        if batch_ready:
+            self._wakeup.set()
+
+    def flush(self):
+        """Stores every queued record, in batches. Returns the number of readings stored."""
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending and not self._sealed:
+                    return 0
+                records, self._pending = self._pending, []
+                # New records go to a fresh segment, so the sealed ones can go once these are stored
+                self._journal.close()
+                self._sealed.append(self._journal_path)
+                self._journal_path, self._journal = self._open_segment()
+                sealed = list(self._sealed)
+
+            stored = 0
+            for start in range(0, len(records), self.batch_size):
+                try:
+                    stored += self.store(records[start:start + self.batch_size])
+                except Exception:
+                    with self._lock:
+                        self._pending[:0] = records[start:]
+                    raise
+
+            with self._lock:
+                self._sealed = [path for path in self._sealed if path not in sealed]
+            for path in sealed:
+                path.unlink(missing_ok=True)
+            return stored
+
+    def store(self, records):
+        """Stores one batch, dropping readings for patients the submitting doctor no longer manages."""
+        owners = dict(
+            Patient.objects.filter(pk__in={r['patient'] for r in records}).order_by().values_list('pk', 'doctor_id')
+        )
+        # Readings posted with a device key have no user: the key was for that patient
+        readings = [
+            HeartRate(patient_id=r['patient'], value=r['value'], timestamp=parse_datetime(r['timestamp']),
+                      device_id=r['device_id'], sequence=r['sequence'])
+            for r in records
+            if r['patient'] in owners and (r['user'] is None or owners[r['patient']] == r['user'])
+        ]
+        if len(readings) < len(records):
+            logger.warning("Dropped %d queued readings for patients no longer managed by their sender",
+                           len(records) - len(readings))
+        return len(store_readings(readings)) if readings else 0
+
+    def _run(self):
+        while not self._stopping:
+            self._wakeup.wait(self.flush_seconds)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Write-behind flush failed, retrying")
+            finally:
+                close_old_connections()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='heart-rate-write-behind', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        """Stops the writer thread and stores what is left."""
+        self._stopping = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Final write-behind flush failed; readings stay in %s", self.spill_dir)
+        self.close()
+
+    def close(self):
+        """Closes the journal and releases the lock; unflushed readings stay on disk for the next process."""
+        with self._lock:
+            self._journal.close()
+            if not self._pending and os.path.getsize(self._journal_path) == 0:
+                self._journal_path.unlink(missing_ok=True)
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def write_behind_enabled():
+    return getattr(settings, 'HEART_RATE_WRITE_BEHIND', False)
+
+
+def get_buffer():
+    """The write-behind buffer of this process, started on first use."""
+    global _buffer
+    with _buffer_lock:
+        if _buffer is None:
+            _buffer = WriteBehindBuffer(
+                getattr(settings, 'HEART_RATE_WRITE_BEHIND_SPILL_DIR', settings.BASE_DIR / 'spill'),
+                max_pending=getattr(settings, 'HEART_RATE_WRITE_BEHIND_MAX_PENDING', 10000),
+                batch_size=getattr(settings, 'HEART_RATE_WRITE_BEHIND_BATCH_SIZE', 500),
+                flush_seconds=getattr(settings, 'HEART_RATE_WRITE_BEHIND_FLUSH_SECONDS', 0.5),
+            )
+            _buffer.start()
+        return _buffer
+
+
+def accept_readings(items, user):
+    """
+    Queues validated readings (serializer validated_data with patient_id) submitted by a doctor
+    whose ownership was already checked, or by a device (patient.devices). Returns the number accepted.
+    """
+    received = timezone.now()
+    records = [
+        {
+            'patient': item['patient_id'],
+            'value': item['value'],
+            # Readings without a timestamp are dated when they were received, not when they are written
+            'timestamp': item.get('timestamp', received).isoformat(),
+            'device_id': item.get('device_id', ''),
+            'sequence': item.get('sequence'),
+            'user': user.pk,
+        }
+        for item in items
+    ]
+    get_buffer().enqueue(records)
+    return len(records)
@@ -0,0 +1,98 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import router
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from .models import CustomUser
+
+# Fields of a user that authentication and the permission classes rely on
+STATE_FIELDS = ('id', 'username', 'role', 'is_active')
+
+
+def user_state_key(user_id):
+    return f'auth-user:{user_id}'
+
+
+def user_state_ttl():
+    # Bounds how long another process may accept a deactivated user when caches are not shared
+    return getattr(settings, 'AUTH_USER_CACHE_TTL', 60)
+
+
+def cache_user_state(user):
+    """Write-through for a saved user; a deactivated user is cached as such, which revokes their tokens."""
+    cache.set(user_state_key(user.pk), {field: getattr(user, field) for field in STATE_FIELDS}, timeout=user_state_ttl())
+
+
+def forget_user_state(user_id):
+    # A deleted user is looked up again, and not found
+    cache.delete(user_state_key(user_id))
+
+
+def get_user_state(user_id):
+    """
+    Returns {'id', 'username', 'role', 'is_active'} for a user id, or None if there is no such user.
+    Served from the cache; a miss costs one query.
+    """
+    key = user_state_key(user_id)
+    state = cache.get(key)
+    if state is None:
+        state = CustomUser.objects.filter(pk=user_id).values(*STATE_FIELDS).first()
+        if state is None:
+            return None
+        cache.set(key, state, timeout=user_state_ttl())
+    return state
+
+
+async def aget_user_state(user_id):
+    """get_user_state() for async views, through the async cache and ORM."""
+    key = user_state_key(user_id)
+    state = await cache.aget(key)
+    if state is None:
+        state = await CustomUser.objects.filter(pk=user_id).values(*STATE_FIELDS).afirst()
+        if state is None:
+            return None
+        await cache.aset(key, state, timeout=user_state_ttl())
+    return state
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication that does not load the user row on every request.
+    The user is rebuilt from a short-lived cache entry of the fields the API needs (id, username,
+    role, is_active); any other field is loaded from the database if it is read. Saving or deleting
+    a user updates the entry at once, so deactivated users are turned away on their next request.
+    """
+    def get_user(self, validated_token):
+        return self.user_from_state(get_user_state(self.user_id(validated_token)))
+
+    async def aget_user(self, validated_token):
+        return self.user_from_state(await aget_user_state(self.user_id(validated_token)))
+
+    async def aauthenticate(self, request):
+        """authenticate() for async views: the token is checked as usual, the user state is read asynchronously."""
+        header = self.get_header(request)
+        raw_token = self.get_raw_token(header) if header else None
+        if raw_token is None:
+            return None
+        validated_token = self.get_validated_token(raw_token)
+        return await self.aget_user(validated_token), validated_token
+
+    def user_id(self, validated_token):
+        try:
+            return validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+    def user_from_state(self, state):
+        if state is None:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+        if api_settings.CHECK_USER_IS_ACTIVE and not state['is_active']:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        # Fields not in the state are deferred, so save() only writes the ones that were loaded.
+        # from_db() takes the values in model field order.
+        fields = [f.attname for f in CustomUser._meta.concrete_fields if f.attname in state]
+        return CustomUser.from_db(router.db_for_read(CustomUser), fields, [state[name] for name in fields])
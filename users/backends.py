@@ -0,0 +1,29 @@
+from django.contrib.auth.backends import ModelBackend
+from .hashing import check_password_pooled, make_password_pooled
+from .models import CustomUser
+
+
+class PooledModelBackend(ModelBackend):
+    """
+    ModelBackend that checks passwords on the bounded hashing pool (users.hashing) instead of the
+    request thread, and upgrades hashes made with an older hasher or parameters as users log in.
+    """
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        if username is None:
+            username = kwargs.get(CustomUser.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+        try:
+            user = CustomUser._default_manager.get_by_natural_key(username)
+        except CustomUser.DoesNotExist:
+            # Hash once anyway, so unknown usernames take as long as wrong passwords (#20760)
+            make_password_pooled(password)
+            return None
+
+        is_correct, rehashed = check_password_pooled(password, user.password)
+        if not is_correct or not self.user_can_authenticate(user):
+            return None
+        if rehashed is not None:
+            user.password = rehashed
+            user.save(update_fields=['password'])
+        return user
@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.contrib.auth.hashers import ScryptPasswordHasher
+
+
+class TunedScryptPasswordHasher(ScryptPasswordHasher):
+    """
+    scrypt with its cost taken from the PASSWORD_SCRYPT_* settings, so it can be tuned to the hardware.
+    Hashes made with other parameters (or by another hasher) are upgraded when their user next logs in.
+    """
+    @property
+    def work_factor(self):
+        return getattr(settings, 'PASSWORD_SCRYPT_WORK_FACTOR', 2 ** 15)
+
+    @property
+    def block_size(self):
+        return getattr(settings, 'PASSWORD_SCRYPT_BLOCK_SIZE', 8)
+
+    @property
+    def parallelism(self):
+        return getattr(settings, 'PASSWORD_SCRYPT_PARALLELISM', 1)
+
+    @property
+    def maxmem(self):
+        # scrypt needs 128 * n * r bytes; OpenSSL refuses anything over 32 MiB unless allowed more
+        return 2 * 128 * self.work_factor * self.block_size
@@ -0,0 +1,89 @@
+"""
+Password hashing on a pool of worker threads shared by the process.
+The standard hashers (PBKDF2, scrypt) do their work in C with the GIL released, so
+hashing on PASSWORD_HASH_WORKERS threads uses that many cores, and no more: a login storm
+cannot take the CPU away from the rest of the API.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.contrib.auth.hashers import check_password, make_password
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+
+class HashingBusy(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Too many logins are being processed, retry shortly.'
+    default_code = 'hashing_busy'
+    wait = 1  # Sent as Retry-After by the DRF exception handler
+
+
+_pool = None
+_slots = None  # Password checks running or waiting for a worker
+_pool_lock = threading.Lock()
+
+
+def hash_workers():
+    return getattr(settings, 'PASSWORD_HASH_WORKERS', None) or os.cpu_count() or 1
+
+
+def hash_pool():
+    """The process-wide hashing pool, created on first use."""
+    global _pool, _slots
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=hash_workers(), thread_name_prefix='password-hash')
+            _slots = threading.BoundedSemaphore(hash_workers() + getattr(settings, 'PASSWORD_CHECK_QUEUE', 32))
+        return _pool
+
+
+def hash_passwords(passwords):
+    """
+    make_password() for each password, in parallel. Returns the hashes in the same order.
+    At most hash_workers() hashes are submitted at a time, each holding a slot as a password check does,
+    so a login arriving during a bulk onboarding waits for one round of hashes rather than the whole batch.
+    """
+    pool = hash_pool()
+    slots, workers = _slots, hash_workers()
+    futures = []
+    for index, password in enumerate(passwords):
+        if index >= workers:
+            futures[index - workers].result()
+        slots.acquire()
+        future = pool.submit(make_password, password)
+        future.add_done_callback(lambda _: slots.release())
+        futures.append(future)
+    return [future.result() for future in futures]
+
+
+def _check(password, encoded):
+    rehashed = []
+    is_correct = check_password(password, encoded, setter=lambda raw: rehashed.append(make_password(raw)))
+    return is_correct, rehashed[0] if rehashed else None
+
+
+def _run_bounded(function, *args):
+    # Waits for a worker, unless PASSWORD_CHECK_QUEUE calls are already waiting for one
+    pool = hash_pool()
+    if not _slots.acquire(blocking=False):
+        raise HashingBusy()
+    try:
+        return pool.submit(function, *args).result()
+    finally:
+        _slots.release()
+
+
+def check_password_pooled(password, encoded):
+    """
+    check_password() on the hashing pool. Returns (is_correct, new hash or None): a new hash when the
+    password is correct but was stored with another hasher or other parameters than the preferred ones.
+    Raises HashingBusy when the pool is saturated.
+    """
+    return _run_bounded(_check, password, encoded)
+
+
+def make_password_pooled(password):
+    """make_password() on the hashing pool. Raises HashingBusy when the pool is saturated."""
+    return _run_bounded(make_password, password)
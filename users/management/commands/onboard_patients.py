@@ -0,0 +1,67 @@
+import csv
+import json
+from django.core.management.base import BaseCommand, CommandError
+from users.models import CustomUser
+from users.onboarding import onboard_patients
+
+
+def read_rows(path, file_format):
+    """Returns (rows, line numbers, errors) from a CSV file with a header row or an NDJSON file."""
+    rows, lines, errors = [], [], []
+    with open(path, newline='') as handle:
+        if file_format == 'csv':
+            reader = csv.DictReader(handle)
+            for row in reader:
+                rows.append(row)
+                lines.append(reader.line_num)
+        else:
+            for number, line in enumerate(handle, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    rows.append(json.loads(line))
+                    lines.append(number)
+                except ValueError as exc:
+                    errors.append((number, f"invalid JSON ({exc})"))
+    return rows, lines, errors
+
+
+def describe(errors):
+    """Flattens serializer errors to 'field: message' text."""
+    return '; '.join(f"{field}: {' '.join(str(message) for message in messages)}" for field, messages in errors.items())
+
+
+class Command(BaseCommand):
+    help = (
+        "Onboards patients from a CSV file (with a header row) or an NDJSON file, one patient per row with the "
+        "fields of the create-patient endpoint, all assigned to one doctor. Rows that cannot be created are "
+        "reported by line and skipped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--doctor', required=True, help="Username of the doctor the patients are assigned to.")
+        parser.add_argument('--format', choices=['csv', 'ndjson'],
+                            help="File format. Defaults to the file extension (.csv, otherwise NDJSON).")
+        parser.add_argument('--chunk-size', type=int,
+                            help="Rows per transaction (default: PATIENT_ONBOARDING_CHUNK_SIZE).")
+
+    def handle(self, *args, **options):
+        try:
+            doctor = CustomUser.objects.get(username=options['doctor'], role=CustomUser.Role.DOCTOR)
+        except CustomUser.DoesNotExist:
+            raise CommandError(f"No doctor with the username {options['doctor']!r}.")
+        file_format = options['format'] or ('csv' if options['path'].lower().endswith('.csv') else 'ndjson')
+        try:
+            rows, lines, problems = read_rows(options['path'], file_format)
+        except OSError as exc:
+            raise CommandError(str(exc))
+
+        result = onboard_patients(rows, doctor, options['chunk_size'])
+
+        problems.extend((lines[error['row']], describe(error['errors'])) for error in result['errors'])
+        for line, problem in sorted(problems):
+            self.stderr.write(f"line {line}: {problem}")
+        self.stdout.write(
+            f"Onboarded {len(result['created'])} patients for {doctor.username}, {len(problems)} rows skipped."
+        )
@@ -0,0 +1,125 @@
+"""
+Bulk patient onboarding, behind the create-patients endpoint and `manage.py onboard_patients`.
+
+Creates the same user and Patient profile per row as the create-patient endpoint, but for a whole
+census at a time:
+- Every row is validated before anything is written. Invalid rows, usernames used twice in the
+  batch and usernames that are already taken are reported by row, and the other rows go ahead.
+- Passwords are hashed in parallel (users.hashing).
+- Users and patients are written with bulk inserts, PATIENT_ONBOARDING_CHUNK_SIZE rows per transaction.
+"""
+from functools import partial
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from rest_framework.settings import api_settings
+from patient.response_cache import bump_versions
+from patient.models import Patient
+from .hashing import hash_passwords
+from .models import CustomUser
+from .serializers import PatientCreationSerializer
+
+TAKEN = 'A user with that username already exists.'
+REPEATED = 'This username appears more than once in the batch.'
+NOT_SAVED = 'This row could not be saved.'
+
+
+def chunk_size():
+    return getattr(settings, 'PATIENT_ONBOARDING_CHUNK_SIZE', 500)
+
+
+def validate_rows(rows):
+    """
+    Returns (valid, errors): (row index, validated data) for the rows that can be created, and
+    {'row': index, 'errors': {...}} for the others. Usernames are normalized as create_user() does.
+    """
+    valid, errors, seen = [], [], set()
+    for index, row in enumerate(rows):
+        serializer = PatientCreationSerializer(data=row)
+        if not serializer.is_valid():
+            errors.append({'row': index, 'errors': serializer.errors})
+            continue
+        data = serializer.validated_data
+        data['username'] = CustomUser.normalize_username(data['username'])
+        if data['username'] in seen:
+            errors.append({'row': index, 'errors': {'username': [REPEATED]}})
+            continue
+        seen.add(data['username'])
+        valid.append((index, data))
+    return valid, errors
+
+
+def insert(entries, doctor):
+    """Writes (row index, data, password hash) entries with one bulk insert for users and one for patients."""
+    users = CustomUser.objects.bulk_create(
+        CustomUser(username=data['username'], password=password, role=CustomUser.Role.PATIENT)
+        for _, data, password in entries
+    )
+    if any(user.pk is None for user in users):
+        # The database does not return ids from bulk inserts
+        usernames = [user.username for user in users]
+        ids = dict(CustomUser.objects.filter(username__in=usernames).values_list('username', 'pk'))
+        for user in users:
+            user.pk = ids[user.username]
+
+    patients = Patient.objects.bulk_create(
+        Patient(
+            user=user,
+            doctor=doctor,
+            full_name=data['full_name'],
+            age=data['age'],
+            address=data['address'],
+            contact_number=data.get('contact_number'),
+            blood_group=data['blood_group'],
+        )
+        for user, (_, data, _) in zip(users, entries)
+    )
+    # bulk_create sends no post_save, which would bump the patient lists
+    transaction.on_commit(partial(bump_versions, ['patients']))
+    return [
+        {'row': index, 'id': patient.pk, 'username': user.username}
+        for (index, _, _), user, patient in zip(entries, users, patients)
+    ]
+
+
+def onboard_patients(rows, doctor, size=None):
+    """
+    Creates a patient user and profile for each row (the fields of PatientCreationSerializer),
+    all assigned to `doctor`. Returns {'created': [{'row', 'id', 'username'}], 'errors': [{'row', 'errors'}]},
+    rows being indexes into `rows`.
+    """
+    size = size or chunk_size()
+    valid, errors = validate_rows(rows)
+    created = []
+
+    for start in range(0, len(valid), size):
+        chunk = valid[start:start + size]
+        taken = set(
+            CustomUser.objects.filter(username__in=[data['username'] for _, data in chunk])
+            .values_list('username', flat=True)
+        )
+        errors.extend(
+            {'row': index, 'errors': {'username': [TAKEN]}} for index, data in chunk if data['username'] in taken
+        )
+        chunk = [(index, data) for index, data in chunk if data['username'] not in taken]
+        if not chunk:
+            continue
+
+        passwords = hash_passwords([data['password'] for _, data in chunk])
+        entries = [(index, data, password) for (index, data), password in zip(chunk, passwords)]
+        try:
+            with transaction.atomic():
+                created.extend(insert(entries, doctor))
+        except IntegrityError:
+            # A username was taken after the check: insert this chunk row by row to find out which
+            for entry in entries:
+                try:
+                    with transaction.atomic():
+                        created.extend(insert([entry], doctor))
+                except IntegrityError:
+                    if CustomUser.objects.filter(username=entry[1]['username']).exists():
+                        errors.append({'row': entry[0], 'errors': {'username': [TAKEN]}})
+                    else:
+                        errors.append({'row': entry[0], 'errors': {api_settings.NON_FIELD_ERRORS_KEY: [NOT_SAVED]}})
+
+    errors.sort(key=lambda error: error['row'])
+    return {'created': created, 'errors': errors}
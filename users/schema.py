@@ -0,0 +1,6 @@
+from drf_spectacular.contrib.rest_framework_simplejwt import SimpleJWTScheme
+
+
+class CachedJWTScheme(SimpleJWTScheme):
+    # Same bearer scheme in the OpenAPI document as plain JWT authentication
+    target_class = 'users.authentication.CachedJWTAuthentication'
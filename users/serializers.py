@@ -35,7 +35,7 @@ class PatientCreationSerializer(serializers.Serializer):
     
     # Patient profile fields
     full_name = serializers.CharField(max_length=255)
-    age = serializers.IntegerField()
+    age = serializers.IntegerField(min_value=0)
     address = serializers.CharField()
     contact_number = serializers.CharField(max_length=12, required=False, allow_blank=True)
     blood_group = serializers.CharField(max_length=3)
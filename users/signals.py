@@ -0,0 +1,17 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .authentication import cache_user_state, forget_user_state
+from .models import CustomUser
+
+
+@receiver(post_save, sender=CustomUser)
+def refresh_user_state(sender, instance, **kwargs):
+    # Role changes and deactivation reach authentication without waiting for the cache to expire
+    transaction.on_commit(lambda: cache_user_state(instance))
+
+
+@receiver(post_delete, sender=CustomUser)
+def drop_user_state(sender, instance, **kwargs):
+    user_id = instance.pk
+    transaction.on_commit(lambda: forget_user_state(user_id))
@@ -1,7 +1,22 @@
 
+import json
+import os
+import tempfile
+import threading
+import time
+from io import StringIO
+from unittest import mock
+from django.contrib.auth.hashers import check_password, make_password
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import IntegrityError, connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import AccessToken
+from . import hashing, onboarding
+from .hashing import hash_passwords
 from .models import CustomUser
 from patient.models import Patient
 
@@ -13,6 +28,8 @@ class CustomUserAPITests(APITestCase):
         self.hod_user = CustomUser.objects.create_user(username='test_hod', password='password123', role=CustomUser.Role.HOD)
         self.doctor_user = CustomUser.objects.create_user(username='test_doctor', password='password123', role=CustomUser.Role.DOCTOR)
         self.patient_user = CustomUser.objects.create_user(username='test_patient', password='password123', role=CustomUser.Role.PATIENT)
+        # Cached user state must not leak between tests
+        cache.clear()
 
 
 
@@ -110,4 +127,173 @@ class CustomUserAPITests(APITestCase):
         data = {"username": "test_doctor", "password": "wrongpassword"}
         response = self.client.post(url, data, format='json')
 
-        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
\ No newline at end of file
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    ## Bulk Onboarding Tests
+
+    def patient_row(self, username, **fields):
+        return {'username': username, 'password': 'newpassword123', 'full_name': f'Patient {username}',
+                'age': 40, 'address': 'Ward 1', 'blood_group': 'O+', **fields}
+
+    def test_bulk_onboarding_reports_rows_it_cannot_create(self):
+        """
+        Ensure a bulk onboarding request creates every valid row and reports the others by row, without aborting.
+        """
+        self.client.force_authenticate(user=self.doctor_user)
+        rows = [
+            self.patient_row('bulk1'),
+            self.patient_row('bulk2', age='old'),
+            self.patient_row('test_patient'),  # Taken
+            self.patient_row('bulk3'),
+            self.patient_row('bulk1'),  # Repeated
+        ]
+        response = self.client.post(reverse('create_patients'), rows, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([p['row'] for p in response.data['created']], [0, 3])
+        self.assertEqual([e['row'] for e in response.data['errors']], [1, 2, 4])
+        self.assertIn('age', response.data['errors'][0]['errors'])
+
+        patient = Patient.objects.select_related('user').get(user__username='bulk3')
+        self.assertEqual((patient.doctor, patient.user.role), (self.doctor_user, CustomUser.Role.PATIENT))
+        self.assertTrue(check_password('newpassword123', patient.user.password))
+
+        response = self.client.post(reverse('create_patients'), [self.patient_row('bulk1')], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(reverse('create_patients'), [self.patient_row('bulk4', age=-1)], format='json')
+        self.assertIn('age', response.data['errors'][0]['errors'])
+
+    def test_bulk_onboarding_tells_failed_inserts_apart(self):
+        """
+        Ensure a row whose insert fails is reported as taken only when its username was taken meanwhile.
+        """
+        def hash_while_taken(passwords):
+            # Another request takes the username between the check and the insert
+            CustomUser.objects.create_user(username='raced', password='password123')
+            return hash_passwords(passwords)
+
+        def insert(entries, doctor):
+            if any(data['username'] == 'broken' for _, data, _ in entries):
+                raise IntegrityError('CHECK constraint failed')
+            return real_insert(entries, doctor)
+
+        real_insert = onboarding.insert
+        rows = [self.patient_row('raced'), self.patient_row('broken'), self.patient_row('fine')]
+        with mock.patch.object(onboarding, 'hash_passwords', side_effect=hash_while_taken), \
+                mock.patch.object(onboarding, 'insert', side_effect=insert):
+            result = onboarding.onboard_patients(rows, self.doctor_user)
+
+        self.assertEqual([p['row'] for p in result['created']], [2])
+        self.assertEqual(result['errors'], [
+            {'row': 0, 'errors': {'username': [onboarding.TAKEN]}},
+            {'row': 1, 'errors': {'non_field_errors': [onboarding.NOT_SAVED]}},
+        ])
+
+    def test_onboarding_command_reads_csv_and_ndjson(self):
+        """
+        Ensure the onboarding command creates patients from CSV and NDJSON files in chunks, reporting bad lines.
+        """
+        fields = ['username', 'password', 'full_name', 'age', 'address', 'contact_number', 'blood_group']
+        csv_text = ','.join(fields) + '\n' + ''.join(
+            f'csv{i},newpassword123,Patient {i},{30 + i},Ward 2,,A+\n' for i in range(5)
+        ) + 'csvbad,newpassword123,Bad,,Ward 2,,A+\n'
+        ndjson_text = json.dumps(self.patient_row('nd1')) + '\n{not json\n' + json.dumps(self.patient_row('csv0')) + '\n'
+
+        for suffix, text, created in (('.csv', csv_text, 5), ('.ndjson', ndjson_text, 1)):
+            handle, path = tempfile.mkstemp(suffix=suffix)
+            with os.fdopen(handle, 'w') as file:
+                file.write(text)
+            self.addCleanup(os.remove, path)
+            out, err = StringIO(), StringIO()
+            call_command('onboard_patients', path, doctor='test_doctor', chunk_size=2, stdout=out, stderr=err)
+            self.assertIn(f'Onboarded {created} patients', out.getvalue())
+
+            self.assertEqual(len(err.getvalue().splitlines()), 1 if suffix == '.csv' else 2)
+        self.assertIn('line 2: invalid JSON', err.getvalue())
+        self.assertIn('line 3: username', err.getvalue())
+        self.assertEqual(Patient.objects.filter(doctor=self.doctor_user).count(), 6)
+
+    ## Password Hashing Tests
+
+    def test_login_upgrades_password_hash(self):
+        """
+        Ensure logging in with a password stored by an older hasher stores it again with the preferred one.
+        """
+        self.doctor_user.password = make_password('password123', hasher='pbkdf2_sha256')
+        self.doctor_user.save(update_fields=['password'])
+        url = reverse('token_obtain_pair')
+
+        response = self.client.post(url, {"username": "test_doctor", "password": "wrongpassword"}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.doctor_user.refresh_from_db()
+        self.assertTrue(self.doctor_user.password.startswith('pbkdf2_sha256$'))
+
+        response = self.client.post(url, {"username": "test_doctor", "password": "password123"}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.doctor_user.refresh_from_db()
+        self.assertTrue(self.doctor_user.password.startswith('scrypt$'))
+        self.assertTrue(check_password('password123', self.doctor_user.password))
+
+    def test_login_is_not_queued_behind_bulk_hashing(self):
+        """
+        Ensure a password check during a bulk onboarding waits for a round of hashes, not for the whole batch.
+        """
+        def slow_hash(password):
+            time.sleep(0.05)
+            return 'hash'
+
+        with mock.patch.object(hashing, 'make_password', side_effect=slow_hash):
+            bulk = threading.Thread(target=hashing.hash_passwords, args=(['password123'] * 40,))
+            bulk.start()
+            time.sleep(0.1)
+            began = time.monotonic()
+            hashing.check_password_pooled('password123', '!unusable')
+            waited = time.monotonic() - began
+            bulk.join()
+        self.assertLess(waited, 0.05 * hashing.hash_workers() + 0.3)
+
+    def test_login_is_refused_when_hashing_is_saturated(self):
+        """
+        Ensure logins are answered 503 with Retry-After, rather than queued, while the password check queue is full.
+        """
+        hashing.hash_pool()
+        slots = threading.BoundedSemaphore(1)
+        slots.acquire()
+        with mock.patch.object(hashing, '_slots', slots):
+            response = self.client.post(
+                reverse('token_obtain_pair'), {"username": "test_doctor", "password": "password123"}, format='json'
+            )
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response['Retry-After'], '1')
+
+    ## Token Authentication Tests
+
+    def test_token_requests_do_not_load_the_user(self):
+        """
+        Ensure a bearer token is authenticated from the cache after the first request, without a user query.
+        """
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.doctor_user)}')
+        url = reverse('patient-list')
+
+        def user_lookups():
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return [q for q in ctx.captured_queries if q['sql'].startswith('SELECT') and 'FROM "users_customuser"' in q['sql']]
+
+        self.assertEqual(len(user_lookups()), 1)
+        self.assertEqual(user_lookups(), [])
+
+    def test_deactivated_user_token_is_rejected(self):
+        """
+        Ensure deactivating a user revokes their tokens at once, even while their state is cached.
+        """
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.doctor_user)}')
+        url = reverse('patient-list')
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+
+        self.doctor_user.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.doctor_user.save()
+
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_401_UNAUTHORIZED)
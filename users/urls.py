@@ -1,10 +1,11 @@
 from django.urls import path
 from rest_framework_simplejwt.views import TokenRefreshView
-from .views import MyTokenObtainPairView, CreateDoctorView, CreatePatientView
+from .views import MyTokenObtainPairView, CreateDoctorView, CreatePatientView, BulkCreatePatientsView
 
 urlpatterns = [
     path('token/', MyTokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path('create-doctor/', CreateDoctorView.as_view(), name='create_doctor'),
     path('create-patient/', CreatePatientView.as_view(), name='create_patient'),
+    path('create-patients/', BulkCreatePatientsView.as_view(), name='create_patients'),
 ]
\ No newline at end of file
@@ -1,10 +1,13 @@
 from rest_framework import generics, status
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
 from rest_framework_simplejwt.views import TokenObtainPairView
 from .serializers import MyTokenObtainPairSerializer, DoctorCreationSerializer, PatientCreationSerializer
 from .models import CustomUser
 from patient.models import Patient
 from .permissions import IsHOD, IsDoctor
 from rest_framework.permissions import IsAuthenticated
+from .onboarding import onboard_patients
 
 class MyTokenObtainPairView(TokenObtainPairView):
     serializer_class = MyTokenObtainPairSerializer
@@ -26,4 +29,25 @@ class CreatePatientView(generics.CreateAPIView):
         Pass the request object to the serializer.
         This is needed to get the logged-in doctor.
         """
-        return {'request': self.request}
\ No newline at end of file
+        return {'request': self.request}
+
+class BulkCreatePatientsView(generics.GenericAPIView):
+    """
+    Onboards many patients in one request: a JSON list of the fields taken by create-patient.
+    - Every row is validated before anything is written; rows that cannot be created are reported and skipped.
+    - Passwords are hashed in parallel and rows are written with bulk inserts, in chunks.
+    - Answers 201 with the created patients and the errors by row, or 400 when no row could be created.
+    - For larger censuses, use `manage.py onboard_patients`.
+    """
+    serializer_class = PatientCreationSerializer
+    permission_classes = [IsAuthenticated, IsDoctor | IsHOD]
+    max_batch_size = 1000
+
+    def post(self, request, *args, **kwargs):
+        if not isinstance(request.data, list):
+            raise ValidationError({'non_field_errors': ["Expected a list of patients."]})
+        if len(request.data) > self.max_batch_size:
+            raise ValidationError({'non_field_errors': [f"At most {self.max_batch_size} patients per request."]})
+
+        result = onboard_patients(request.data, request.user)
+        return Response(result, status=status.HTTP_201_CREATED if result['created'] else status.HTTP_400_BAD_REQUEST)